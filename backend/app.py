@@ -1,17 +1,44 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
 from config import ALLOWED_ORIGINS
 from db import connect_db, close_db
-from routers import auth, challenges, submissions, admin, leaderboard, trek_sessions
+from jobs.queue import start_verification_workers, stop_verification_workers
+from ml.executor import start_ml_executor, shutdown_ml_executor, worker_reports, is_ready
+from ml.cache import result_cache
+from ml.face_index import start_face_index, stop_face_index
+from utils.geo_index import setup_checkpoint_index
+from utils.tracks import setup_track_store, start_track_sweeper, stop_track_sweeper
+from utils.track_monitor import setup_track_events
+from utils.storage import start_blob_gc, stop_blob_gc
+from utils.resumable import start_upload_sweeper, stop_upload_sweeper
+from routers import auth, challenges, submissions, admin, leaderboard, trek_sessions, media, uploads
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     await connect_db()
+    await result_cache.setup()
+    await setup_checkpoint_index()
+    await setup_track_store()
+    await setup_track_events()
+    await start_track_sweeper()
+    await start_blob_gc()
+    await start_upload_sweeper()
+    # Loads OCR, MediaPipe and InsightFace models in every ML worker
+    await start_ml_executor()
+    await start_face_index()
+    await start_verification_workers()
     yield
     # Shutdown
+    await stop_verification_workers()
+    await stop_face_index()
+    await stop_upload_sweeper()
+    await stop_track_sweeper()
+    await stop_blob_gc()
+    await shutdown_ml_executor()
     await close_db()
 
 app = FastAPI(
@@ -28,6 +55,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Resumable upload state, read by browser clients
+    expose_headers=["Location", "Tus-Resumable", "Upload-Offset", "Upload-Length", "Upload-Expires"],
 )
 
 # Include routers
@@ -37,6 +66,8 @@ app.include_router(submissions.router)
 app.include_router(admin.router)
 app.include_router(leaderboard.router)
 app.include_router(trek_sessions.router)
+app.include_router(media.router)
+app.include_router(uploads.router)
 
 @app.get("/")
 async def root():
@@ -46,6 +77,13 @@ async def root():
 async def health():
     return {"status": "healthy"}
 
+@app.get("/health/ready")
+async def readiness():
+    """ML workers with their loaded engines, load times and memory"""
+    ready = is_ready()
+    body = {"status": "ready" if ready else "warming", "workers": worker_reports()}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,97 @@
+"""
+Micro-benchmark: scalar haversine loops vs the vectorized helpers in utils/gps.py
+Run with: python bench_gps.py
+"""
+import math
+import timeit
+import numpy as np
+
+from utils.gps import (
+    haversine_distance,
+    distances_to_points,
+    path_length,
+    point_to_polyline_distance,
+)
+
+REPEAT = 5
+
+
+def scalar_distances(lat, lon, lats, lons):
+    return [haversine_distance(lat, lon, a, b) for a, b in zip(lats, lons)]
+
+
+def scalar_path_length(lats, lons):
+    return sum(
+        haversine_distance(lats[i], lons[i], lats[i + 1], lons[i + 1])
+        for i in range(len(lats) - 1)
+    )
+
+
+def scalar_polyline_distance(lat, lon, lats, lons):
+    # Same projection as point_to_polyline_distance, one segment at a time
+    scale = math.radians(1.0) * 6371000
+    cos_lat = math.cos(math.radians(lat))
+    best = math.inf
+    for i in range(len(lats) - 1):
+        ax, ay = (lons[i] - lon) * scale * cos_lat, (lats[i] - lat) * scale
+        bx, by = (lons[i + 1] - lon) * scale * cos_lat, (lats[i + 1] - lat) * scale
+        dx, dy = bx - ax, by - ay
+        length_sq = dx * dx + dy * dy
+        t = min(max(-(ax * dx + ay * dy) / length_sq, 0.0), 1.0) if length_sq > 0 else 0.0
+        best = min(best, math.hypot(ax + t * dx, ay + t * dy))
+    return best
+
+
+def check_agreement(lat, lon, lats, lons, lats_list, lons_list):
+    """The scalar baselines must compute what the vectorized helpers compute"""
+    assert np.allclose(scalar_distances(lat, lon, lats_list, lons_list), distances_to_points(lat, lon, lats, lons))
+    assert math.isclose(scalar_path_length(lats_list, lons_list), path_length(lats, lons), rel_tol=1e-9)
+    assert math.isclose(
+        scalar_polyline_distance(lat, lon, lats_list, lons_list),
+        point_to_polyline_distance(lat, lon, lats, lons)[0],
+        rel_tol=1e-9, abs_tol=1e-6,
+    )
+
+
+def best_of(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=REPEAT)) / number * 1000
+
+
+def report(name, scalar_ms, vector_ms):
+    print(f"{name:<34} scalar {scalar_ms:9.3f} ms   vectorized {vector_ms:8.3f} ms   x{scalar_ms / vector_ms:6.1f}")
+
+
+def main():
+    rng = np.random.default_rng(42)
+    lat, lon = 27.9881, 86.9250
+
+    for n in (100, 10_000):
+        lats = lat + rng.normal(0, 0.05, n)
+        lons = lon + rng.normal(0, 0.05, n)
+        lats_list, lons_list = lats.tolist(), lons.tolist()
+        number = 20 if n <= 100 else 3
+
+        report(
+            f"point -> {n} checkpoints",
+            best_of(lambda: scalar_distances(lat, lon, lats_list, lons_list), number),
+            best_of(lambda: distances_to_points(lat, lon, lats, lons), number),
+        )
+
+        track_lats = lat + np.cumsum(rng.normal(0, 0.0001, n))
+        track_lons = lon + np.cumsum(rng.normal(0, 0.0001, n))
+        track_lats_list, track_lons_list = track_lats.tolist(), track_lons.tolist()
+        check_agreement(lat, lon, track_lats, track_lons, track_lats_list, track_lons_list)
+        report(
+            f"path length, {n} points",
+            best_of(lambda: scalar_path_length(track_lats_list, track_lons_list), number),
+            best_of(lambda: path_length(track_lats, track_lons), number),
+        )
+        report(
+            f"point -> polyline, {n} points",
+            best_of(lambda: scalar_polyline_distance(lat, lon, track_lats_list, track_lons_list), 1),
+            best_of(lambda: point_to_polyline_distance(lat, lon, track_lats, track_lons), number),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -9,13 +9,51 @@ DATABASE_NAME = os.getenv("DATABASE_NAME", "trek_challenge")
 
 # Storage
 UPLOAD_DIR = BASE_DIR / "uploads"
-PHOTOS_DIR = UPLOAD_DIR / "photos"
+PHOTOS_DIR = UPLOAD_DIR / "photos"  # legacy per-upload files (see migrate_uploads.py)
 SELFIES_DIR = UPLOAD_DIR / "selfies"
+BLOBS_DIR = UPLOAD_DIR / "blobs"  # content-addressed store, sharded by SHA-256
+BLOB_TMP_DIR = BLOBS_DIR / "tmp"
+RESUMABLE_DIR = UPLOAD_DIR / "resumable"  # partial files of resumable uploads
 
 # Create directories
 UPLOAD_DIR.mkdir(exist_ok=True)
 PHOTOS_DIR.mkdir(exist_ok=True)
 SELFIES_DIR.mkdir(exist_ok=True)
+BLOBS_DIR.mkdir(exist_ok=True)
+BLOB_TMP_DIR.mkdir(exist_ok=True)
+RESUMABLE_DIR.mkdir(exist_ok=True)
+
+# Uploads are streamed to disk in chunks; larger files are rejected with 413
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# Keep the images of submissions rejected by the GPS pre-check (for audit)
+KEEP_REJECTED_UPLOADS = os.getenv("KEEP_REJECTED_UPLOADS", "0") == "1"
+# Unreferenced blobs are deleted after this grace period
+BLOB_GC_GRACE_SECONDS = 24 * 3600
+BLOB_GC_INTERVAL_SECONDS = 3600
+# Resumable uploads: dropped after this long without a PATCH; a PATCH holds the
+# upload for RESUMABLE_LOCK_SECONDS (renewed while data keeps arriving)
+RESUMABLE_UPLOAD_EXPIRY_SECONDS = 24 * 3600
+RESUMABLE_LOCK_SECONDS = 120
+RESUMABLE_SWEEP_INTERVAL_SECONDS = 900
+
+# Ingest derivatives: oriented, metadata-free working copy for ML + WebP thumbnail
+INGEST_WORK_MAX_SIDE = 2048
+INGEST_WORK_QUALITY = 90
+INGEST_THUMB_MAX_SIDE = 320
+INGEST_THUMB_QUALITY = 70
+
+# Blob bytes backend: "local" (uploads/blobs), "s3" (S3-compatible object
+# storage, credentials from the usual AWS_* variables) or "memory" (in-process fake)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "blobs")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "")  # e.g. MinIO; empty for AWS
+S3_REGION = os.getenv("S3_REGION", "")
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "32"))
+S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+S3_MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024  # S3 requires >= 5 MB per part
+PRESIGNED_URL_EXPIRES = 900  # seconds
 
 # Verification thresholds
 OCR_THRESHOLD = 70.0
@@ -23,6 +61,90 @@ LIVENESS_THRESHOLD = 0.6
 FACE_MATCH_THRESHOLD = 0.7
 DEFAULT_GPS_RADIUS = 50.0  # meters
 
+# Liveness: MediaPipe face detection
+LIVENESS_DETECTOR_POOL_SIZE = int(os.getenv("LIVENESS_DETECTOR_POOL_SIZE", "1"))  # graphs per process
+LIVENESS_DETECTION_MAX_SIDE = 640  # selfies are downscaled to this before detection
+
+# Face matching: InsightFace models on ONNX Runtime (CPU)
+FACE_MODEL_DIR = Path(os.getenv("FACE_MODEL_DIR", str(BASE_DIR / "ml_models")))  # expects models/<name>/*.onnx
+FACE_MODEL_NAME = os.getenv("FACE_MODEL_NAME", "buffalo_l")
+FACE_EMBEDDING_FORMAT = os.getenv("FACE_EMBEDDING_FORMAT", "float32")  # or "int8"
+FACE_DET_SIZE = int(os.getenv("FACE_DET_SIZE", "640"))
+FACE_ORT_INTRA_OP_THREADS = int(os.getenv("FACE_ORT_INTRA_OP_THREADS", "1"))
+FACE_ORT_INTER_OP_THREADS = int(os.getenv("FACE_ORT_INTER_OP_THREADS", "1"))
+
+# 1:N face search index ("flat" brute force, or "ivf" clustered for large populations)
+FACE_INDEX_MODE = os.getenv("FACE_INDEX_MODE", "flat")
+FACE_INDEX_NLIST = 256  # IVF clusters (capped at ~size/39)
+FACE_INDEX_NPROBE = 8  # IVF clusters scored per query
+FACE_INDEX_IVF_MIN_SIZE = 5000  # below this, IVF falls back to brute force
+FACE_INDEX_PATH = BASE_DIR / "indexes" / "face_index.npz"
+FACE_INDEX_REFRESH_SECONDS = 60.0  # pick up enrollments made on other API nodes
+FACE_SEARCH_TOP_K = 5
+
+# Checkpoint spatial index (2dsphere collection + in-process grid)
+GEO_GRID_CELL_DEGREES = 0.05  # ~5.5 km cells
+GEO_GRID_MAX_QUERY_CELLS = 4000  # wider lookups (near the poles) go to the 2dsphere index
+GEO_INDEX_REFRESH_SECONDS = 60.0  # pick up challenge edits made on other API nodes
+NEARBY_DEFAULT_RADIUS = 10000.0  # meters
+NEARBY_MAX_RADIUS = 100000.0  # meters
+
+# Trek session GPS tracks (trek_tracks time-series collection)
+TRACK_MAX_FIXES_PER_BATCH = 2000
+TRACK_MAX_ACCURACY = 100.0  # meters; coarser fixes are dropped
+TRACK_CLOCK_SKEW_SECONDS = 300  # fixes before the session start or after now, beyond this, are dropped
+TRACK_UPDATE_ATTEMPTS = 5  # re-evaluations when concurrent batches race for the session
+TRACK_PENDING_CLAIM_SECONDS = 30  # a committed batch whose points are not stored by then is completed by the next one
+
+# Live track monitoring (trek_events collection)
+TRACK_OFF_ROUTE_DISTANCE = 75.0  # meters from the route before "off_route"
+TRACK_BACK_ON_ROUTE_DISTANCE = 50.0  # meters; hysteresis for "back_on_route"
+TRACK_GEOFENCE_EXIT_MARGIN = 10.0  # meters beyond gps_radius before "geofence_exit"
+TRACK_STALL_SECONDS = 900  # no progress for this long -> "stalled"
+TRACK_STALL_RADIUS = 25.0  # meters that count as no progress
+TRACK_STALL_SWEEP_INTERVAL_SECONDS = 60  # stall checks for sessions that stopped sending fixes
+TRACK_ROUTE_SEARCH_WINDOW = 20  # segments either side of the last match scored first
+ROUTE_INDEX_CELL_SIZE = 250.0  # meters per route index grid cell
+
+# Douglas-Peucker route levels: map zoom -> tolerance in meters
+ROUTE_ZOOM_LEVELS = {10: 100.0, 13: 15.0, 16: 2.0}
+
+# OCR cascade: try downscaled, then thresholded, then denoised input; stop at the first match
+OCR_CASCADE = os.getenv("OCR_CASCADE", "1") == "1"
+OCR_CASCADE_MAX_SIDE = 1280  # longest side of the downscaled first stage
+
+# Sign text localization: OCR only detected text lines (first cascade stage)
+OCR_ROI_ENABLED = os.getenv("OCR_ROI_ENABLED", "1") == "1"
+OCR_ROI_MAX_REGIONS = 8
+OCR_ROI_LINE_HEIGHT = 48  # pixels each text line is normalized to before OCR
+OCR_EAST_MODEL = os.getenv("OCR_EAST_MODEL")  # path to frozen_east_text_detection.pb, MSER if unset
+
+# OCR engine: "auto", "tesserocr" (in-process API), "pytesseract" (subprocess) or "paddle"
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto")
+TESSDATA_PATH = os.getenv("TESSDATA_PREFIX")  # tessdata directory for tesserocr, None uses the default
+
+# Verification queue
+VERIFICATION_QUEUE_BACKEND = os.getenv("VERIFICATION_QUEUE_BACKEND", "mongo")
+VERIFICATION_WORKERS = int(os.getenv("VERIFICATION_WORKERS", "2"))
+VERIFICATION_VISIBILITY_TIMEOUT = 120.0  # seconds a claimed job stays invisible
+VERIFICATION_MAX_ATTEMPTS = 3
+VERIFICATION_RETRY_BACKOFF = 5.0  # seconds, doubled on every retry
+VERIFICATION_POLL_INTERVAL = 1.0  # seconds between queue polls when idle
+VERIFICATION_MAX_WAIT = 30.0  # longest long-poll on GET /api/submissions/{id}
+
+# ML result cache (keyed by image SHA-256 + engine version)
+ML_CACHE_ENABLED = os.getenv("ML_CACHE_ENABLED", "1") == "1"
+ML_CACHE_MAX_ENTRIES = 2048
+ML_CACHE_MAX_BYTES = 64 * 1024 * 1024
+ML_CACHE_PERSIST = True  # second tier in the ml_results collection
+ML_CACHE_TTL_DAYS = 30
+
+# ML process pool
+ML_WORKERS = int(os.getenv("ML_WORKERS", str(os.cpu_count() or 1)))  # 0 runs ML in threads
+ML_TASK_TIMEOUT = float(os.getenv("ML_TASK_TIMEOUT", "60"))  # seconds per OCR/face task
+ML_WARMUP = os.getenv("ML_WARMUP", "1") == "1"  # load models when workers start
+ML_START_METHOD = os.getenv("ML_START_METHOD", "spawn")  # fork is unsafe with a running event loop
+
 # JWT
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
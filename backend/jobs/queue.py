@@ -0,0 +1,348 @@
+"""
+Verification job queue.
+
+Uploads are stored as `pending` submissions and verified in the background by a
+pool of workers. The local backend uses the `submissions` collection itself as
+the queue: every submission carries a `job` sub-document with its delivery
+state, and workers claim jobs with an atomic find_one_and_update. A claimed
+job is leased for VERIFICATION_VISIBILITY_TIMEOUT seconds; if the worker dies
+the lease expires and the job becomes visible to the next worker.
+"""
+
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+
+from db import get_database
+from config import (
+    VERIFICATION_QUEUE_BACKEND,
+    VERIFICATION_WORKERS,
+    VERIFICATION_VISIBILITY_TIMEOUT,
+    VERIFICATION_MAX_ATTEMPTS,
+    VERIFICATION_RETRY_BACKOFF,
+    VERIFICATION_POLL_INTERVAL,
+)
+
+JOB_QUEUED = "queued"
+JOB_PROCESSING = "processing"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+def new_job_state():
+    """Initial `job` sub-document stored with a freshly created submission"""
+    now = datetime.now(timezone.utc)
+    return {
+        "state": JOB_QUEUED,
+        "attempts": 0,
+        "available_at": now,
+        "lease_token": None,
+        "lease_expires_at": None,
+        "last_error": None,
+        "enqueued_at": now,
+        "finished_at": None,
+    }
+
+
+class QueueBackend:
+    """Interface every verification queue backend implements"""
+
+    visibility_timeout = VERIFICATION_VISIBILITY_TIMEOUT
+    max_attempts = VERIFICATION_MAX_ATTEMPTS
+
+    async def setup(self):
+        pass
+
+    async def enqueue(self, submission_id: str):
+        raise NotImplementedError
+
+    async def claim(self):
+        """Lease the next due job. Returns the job dict or None"""
+        raise NotImplementedError
+
+    async def extend(self, job: dict) -> bool:
+        raise NotImplementedError
+
+    async def ack(self, job: dict):
+        raise NotImplementedError
+
+    async def retry(self, job: dict, error: str):
+        raise NotImplementedError
+
+
+class MongoQueueBackend(QueueBackend):
+    """Queue backend that uses the `submissions` collection as the queue"""
+
+    def __init__(self, visibility_timeout=VERIFICATION_VISIBILITY_TIMEOUT,
+                 max_attempts=VERIFICATION_MAX_ATTEMPTS,
+                 retry_backoff=VERIFICATION_RETRY_BACKOFF):
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+
+    async def setup(self):
+        db = get_database()
+        await db.submissions.create_index(
+            [("job.state", ASCENDING), ("job.available_at", ASCENDING)]
+        )
+        await db.submissions.create_index(
+            [("job.state", ASCENDING), ("job.lease_expires_at", ASCENDING)]
+        )
+
+    async def enqueue(self, submission_id: str):
+        # The job state is written together with the submission document,
+        # so there is nothing else to persist here.
+        return submission_id
+
+    async def claim(self):
+        db = get_database()
+        now = datetime.now(timezone.utc)
+        token = uuid.uuid4().hex
+
+        doc = await db.submissions.find_one_and_update(
+            {
+                "$or": [
+                    {"job.state": JOB_QUEUED, "job.available_at": {"$lte": now}},
+                    {"job.state": JOB_PROCESSING, "job.lease_expires_at": {"$lte": now}},
+                ]
+            },
+            {
+                "$set": {
+                    "job.state": JOB_PROCESSING,
+                    "job.lease_token": token,
+                    "job.lease_expires_at": now + timedelta(seconds=self.visibility_timeout),
+                },
+                "$inc": {"job.attempts": 1},
+            },
+            sort=[("job.available_at", ASCENDING)],
+            projection={"job": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if not doc:
+            return None
+
+        job = doc["job"]
+        job["submission_id"] = str(doc["_id"])
+
+        # Jobs that keep killing their worker come back through lease expiry;
+        # give up on them instead of crashing workers forever.
+        if job["attempts"] > self.max_attempts:
+            await self._fail(job, job.get("last_error") or "Lease expired too many times")
+            return None
+
+        return job
+
+    async def extend(self, job: dict) -> bool:
+        db = get_database()
+        expires = datetime.now(timezone.utc) + timedelta(seconds=self.visibility_timeout)
+        result = await db.submissions.update_one(
+            {"_id": ObjectId(job["submission_id"]), "job.lease_token": job["lease_token"]},
+            {"$set": {"job.lease_expires_at": expires}},
+        )
+        return result.modified_count == 1
+
+    async def ack(self, job: dict):
+        db = get_database()
+        await db.submissions.update_one(
+            {"_id": ObjectId(job["submission_id"]), "job.lease_token": job["lease_token"]},
+            {
+                "$set": {
+                    "job.state": JOB_DONE,
+                    "job.lease_token": None,
+                    "job.lease_expires_at": None,
+                    "job.finished_at": datetime.now(timezone.utc),
+                }
+            },
+        )
+
+    async def retry(self, job: dict, error: str):
+        if job["attempts"] >= self.max_attempts:
+            await self._fail(job, error)
+            return
+
+        db = get_database()
+        delay = self.retry_backoff * (2 ** (job["attempts"] - 1))
+        await db.submissions.update_one(
+            {"_id": ObjectId(job["submission_id"]), "job.lease_token": job["lease_token"]},
+            {
+                "$set": {
+                    "job.state": JOB_QUEUED,
+                    "job.available_at": datetime.now(timezone.utc) + timedelta(seconds=delay),
+                    "job.lease_token": None,
+                    "job.lease_expires_at": None,
+                    "job.last_error": error,
+                }
+            },
+        )
+
+    async def _fail(self, job: dict, error: str):
+        """Stop retrying and hand the submission over to manual review"""
+        db = get_database()
+        await db.submissions.update_one(
+            {"_id": ObjectId(job["submission_id"])},
+            [
+                {
+                    "$set": {
+                        "status": {
+                            "$cond": [{"$eq": ["$status", "pending"]}, "pending_admin", "$status"]
+                        },
+                        "job.state": JOB_FAILED,
+                        "job.lease_token": None,
+                        "job.lease_expires_at": None,
+                        "job.last_error": {"$literal": error},
+                        "job.finished_at": datetime.now(timezone.utc),
+                    }
+                }
+            ],
+        )
+
+
+QUEUE_BACKENDS = {
+    "mongo": MongoQueueBackend,
+}
+
+
+class VerificationWorkerPool:
+    """Runs `concurrency` worker loops that drain the queue with `handler`"""
+
+    def __init__(self, backend: QueueBackend, handler, concurrency=VERIFICATION_WORKERS,
+                 poll_interval=VERIFICATION_POLL_INTERVAL):
+        self.backend = backend
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+        self._waiters = {}
+        self._stopping = False
+
+    async def start(self):
+        self._stopping = False
+        await self.backend.setup()
+        self._tasks = [
+            asyncio.create_task(self._run(i)) for i in range(self.concurrency)
+        ]
+
+    async def stop(self):
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self, submission_id: str = None):
+        """Wake idle workers instead of waiting for the next poll"""
+        self._wakeup.set()
+
+    async def wait_for(self, submission_id: str, timeout: float) -> bool:
+        """Wait until this process finishes the job. Returns False on timeout"""
+        waiter = self._waiters.setdefault(submission_id, [asyncio.Event(), 0])
+        waiter[1] += 1
+        try:
+            await asyncio.wait_for(waiter[0].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiter[1] -= 1
+            if waiter[1] == 0 and self._waiters.get(submission_id) is waiter:
+                self._waiters.pop(submission_id, None)
+
+    def _finished(self, submission_id: str):
+        waiter = self._waiters.get(submission_id)
+        if waiter:
+            waiter[0].set()
+
+    async def _run(self, worker_id: int):
+        while True:
+            try:
+                job = await self.backend.claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Verification worker {worker_id} claim error: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # A failing ack/retry must not end this worker: the lease expires and
+            # the job is claimed again
+            try:
+                await self._process(worker_id, job)
+            except asyncio.CancelledError:
+                if self._stopping:
+                    raise
+                print(f"Verification worker {worker_id} job {job['submission_id']} was cancelled")
+            except Exception as e:
+                print(f"Verification worker {worker_id} job {job['submission_id']} bookkeeping error: {e}")
+
+    async def _process(self, worker_id: int, job: dict):
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            try:
+                await self.handler(job["submission_id"])
+            except asyncio.CancelledError:
+                # Shutting down: leave the lease to expire so another worker retries
+                if self._stopping:
+                    raise
+                # Otherwise something the job awaited was cancelled: a normal failure
+                raise RuntimeError("verification task was cancelled")
+        except Exception as e:
+            print(f"Verification worker {worker_id} job {job['submission_id']} failed: {e}")
+            await self.backend.retry(job, str(e))
+            if job["attempts"] >= self.backend.max_attempts:
+                self._finished(job["submission_id"])
+        else:
+            await self.backend.ack(job)
+            self._finished(job["submission_id"])
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, job: dict):
+        interval = self.backend.visibility_timeout / 3
+        while True:
+            await asyncio.sleep(interval)
+            if not await self.backend.extend(job):
+                return
+
+
+worker_pool = None
+
+
+def get_worker_pool():
+    return worker_pool
+
+
+async def start_verification_workers():
+    """Create the queue backend and start the worker pool"""
+    global worker_pool
+    from jobs.verification import verify_submission
+
+    backend = QUEUE_BACKENDS[VERIFICATION_QUEUE_BACKEND]()
+    worker_pool = VerificationWorkerPool(backend, verify_submission)
+    await worker_pool.start()
+    return worker_pool
+
+
+async def stop_verification_workers():
+    global worker_pool
+    if worker_pool:
+        await worker_pool.stop()
+        worker_pool = None
+
+
+async def enqueue_verification(submission_id: str):
+    """Queue a stored submission for background verification"""
+    if worker_pool is None:
+        return
+    await worker_pool.backend.enqueue(submission_id)
+    worker_pool.notify(submission_id)
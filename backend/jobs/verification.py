@@ -0,0 +1,302 @@
+import asyncio
+import hashlib
+from datetime import datetime, timezone
+from bson import ObjectId
+
+from db import get_database
+from utils.gps import is_gps_valid, nearest_checkpoint
+from utils.fuzzy import is_ocr_match, match_checkpoints
+from ml.ocr import extract_text, extract_text_cascade, OCR_CACHE_VERSION
+from ml.liveness import LIVENESS_CACHE_VERSION
+from ml.tasks import analyze_selfie
+from ml.face_match import match_faces, EMBEDDING_CACHE_VERSION
+from ml.image import VerificationImage
+from ml.executor import run_ml
+from ml.cache import result_cache, cached_result, is_miss
+from ml.face_index import get_face_index
+from utils.storage import blob_path, read_blob, ingest_image, release_blob
+from config import (
+    BASE_DIR,
+    OCR_THRESHOLD,
+    OCR_CASCADE,
+    LIVENESS_THRESHOLD,
+    FACE_MATCH_THRESHOLD,
+    FACE_SEARCH_TOP_K,
+)
+
+async def _load_images(submission: dict):
+    """
+    VerificationImages for the photo and selfie: the normalized working copy when
+    ingest produced one, else the original. Blob ids are their SHA-256.
+    """
+    async def image_for(kind):
+        blob_id = submission.get(f"{kind}_work_blob") or submission.get(f"{kind}_blob")
+        if blob_id:
+            path = blob_path(blob_id)
+            if path is not None:
+                return VerificationImage(path=path, digest=blob_id)
+            # Object storage: fetch once, the ML pool receives the bytes
+            return VerificationImage(data=await read_blob(blob_id), digest=blob_id)
+        # Stored before the blob store existed
+        return VerificationImage(path=BASE_DIR / submission[f"{kind}_path"])
+
+    photo = await image_for("photo")
+    selfie = await image_for("selfie") if submission.get("selfie_path") else None
+
+    # Reading (and hashing older submissions) happens off the event loop
+    await asyncio.to_thread(lambda: [(image.data, image.digest) for image in (photo, selfie) if image])
+    return photo, selfie
+
+
+async def _analyze_selfie(image: VerificationImage, need_liveness: bool, need_embedding: bool):
+    """Liveness and embedding for a selfie, running ML only for uncached parts"""
+    results = {"liveness_score": None, "embedding": None}
+    missing_liveness = missing_embedding = False
+
+    if need_liveness:
+        results["liveness_score"] = await result_cache.get("liveness", image.digest, LIVENESS_CACHE_VERSION)
+        missing_liveness = is_miss(results["liveness_score"])
+    if need_embedding:
+        results["embedding"] = await result_cache.get("embedding", image.digest, EMBEDDING_CACHE_VERSION)
+        missing_embedding = is_miss(results["embedding"])
+
+    if missing_liveness or missing_embedding:
+        computed = await run_ml(analyze_selfie, image, missing_liveness, missing_embedding)
+        if missing_liveness:
+            results["liveness_score"] = computed["liveness_score"]
+            await result_cache.set("liveness", image.digest, LIVENESS_CACHE_VERSION, computed["liveness_score"])
+        if missing_embedding:
+            results["embedding"] = computed["embedding"]
+            await result_cache.set("embedding", image.digest, EMBEDDING_CACHE_VERSION, computed["embedding"])
+
+    return results
+
+
+async def _ingest_derivatives(submission: dict):
+    """
+    Working copy and thumbnail of the photo and selfie (ml/ingest.py), made here
+    rather than on the upload request. Updates `submission` in place.
+    """
+    db = get_database()
+    for kind in ("photo", "selfie"):
+        blob_id = submission.get(f"{kind}_blob")
+        if not blob_id or submission.get(f"{kind}_work_blob"):
+            continue
+        derived = await ingest_image(blob_id)
+        if not derived:
+            continue  # not a readable image: the stages read the original
+        result = await db.submissions.update_one(
+            {"_id": submission["_id"], f"{kind}_work_blob": None},
+            {"$set": {f"{kind}_work_blob": derived["work"], f"{kind}_thumb_blob": derived["thumb"]}},
+        )
+        if result.modified_count == 0:
+            # An earlier attempt of this job stored its derivatives first
+            for derived_id in derived.values():
+                await release_blob(derived_id)
+            continue
+        submission[f"{kind}_work_blob"] = derived["work"]
+        submission[f"{kind}_thumb_blob"] = derived["thumb"]
+
+
+async def verify_submission(submission_id: str):
+    """Run verification pipeline for a queued submission"""
+    db = get_database()
+    submission = await db.submissions.find_one({"_id": ObjectId(submission_id)})
+
+    if submission and submission.get("points_pending"):
+        # Verdict stored by an earlier attempt that did not get to the points
+        await _award_points(submission_id, submission["user_id"], submission["points_awarded"])
+        return
+    if not submission or submission["status"] != "pending":
+        return
+
+    challenge = await db.challenges.find_one({"_id": ObjectId(submission["challenge_id"])})
+    if not challenge:
+        raise ValueError("Challenge not found")
+
+    checkpoint = None
+    for cp in challenge["checkpoints"]:
+        if cp["checkpoint_id"] == submission["checkpoint_id"]:
+            checkpoint = cp
+            break
+
+    if not checkpoint:
+        raise ValueError("Checkpoint not found")
+
+    user = await db.users.find_one({"_id": ObjectId(submission["user_id"])})
+    if not user:
+        raise ValueError("User not found")
+
+    await _ingest_derivatives(submission)
+    photo_image, selfie_image = await _load_images(submission)
+
+    verification_results = {
+        "ocr": None,
+        "gps": None,
+        "face": None,
+        "status": "pending",
+        "points_awarded": 0
+    }
+
+    # 1. GPS Validation
+    if checkpoint.get("gps_required", True):
+        is_valid, distance = is_gps_valid(
+            checkpoint["latitude"],
+            checkpoint["longitude"],
+            submission["gps_latitude"],
+            submission["gps_longitude"],
+            checkpoint.get("gps_radius", 50.0)
+        )
+        verification_results["gps"] = {
+            "distance": distance,
+            "is_valid": is_valid
+        }
+
+        if not is_valid:
+            # Tell the hiker which checkpoint they are actually close to
+            nearest = submission.get("nearest_checkpoint")
+            if not nearest:
+                cp, cp_distance = nearest_checkpoint(
+                    submission["gps_latitude"], submission["gps_longitude"], challenge["checkpoints"]
+                )
+                nearest = cp and {"checkpoint_id": cp["checkpoint_id"], "distance": cp_distance}
+            if nearest:
+                verification_results["gps"]["nearest_checkpoint_id"] = nearest["checkpoint_id"]
+                verification_results["gps"]["nearest_checkpoint_distance"] = nearest["distance"]
+            verification_results["status"] = "rejected"
+            await _save_results(submission_id, verification_results)
+            return
+
+    # 2. OCR Validation
+    if checkpoint.get("require_photo", True):
+        expected_text = checkpoint["expected_sign_text"]
+        if OCR_CASCADE:
+            # The cascade's early exit depends on the expected text, so it is part of the key
+            target = hashlib.sha1(f"{expected_text}|{OCR_THRESHOLD}".encode()).hexdigest()[:12]
+            cascade = await cached_result(
+                "ocr_cascade", photo_image, f"{OCR_CACHE_VERSION}:{target}",
+                lambda: run_ml(extract_text_cascade, photo_image, expected_text, OCR_THRESHOLD),
+            )
+            extracted_text, stage = cascade["text"], cascade["stage"]
+        else:
+            extracted_text = await cached_result(
+                "ocr", photo_image, OCR_CACHE_VERSION,
+                lambda: run_ml(extract_text, photo_image),
+            )
+            stage = "denoised"
+        is_match, score = is_ocr_match(extracted_text, expected_text, OCR_THRESHOLD)
+
+        verification_results["ocr"] = {
+            "extracted_text": extracted_text,
+            "match_score": score,
+            "stage": stage
+        }
+
+        if not is_match:
+            verification_results["status"] = "pending_admin"
+
+        # Right photo, wrong checkpoint: the text fits another sign of this challenge better
+        checkpoint_match = match_checkpoints(extracted_text, challenge)
+        best_id = checkpoint_match["best_checkpoint_id"]
+        if (
+            best_id
+            and best_id != checkpoint["checkpoint_id"]
+            and checkpoint_match["best_score"] >= OCR_THRESHOLD
+            and checkpoint_match["best_score"] > checkpoint_match["scores"].get(checkpoint["checkpoint_id"], 0.0)
+        ):
+            verification_results["ocr"]["best_checkpoint_id"] = best_id
+            verification_results["ocr"]["best_checkpoint_score"] = checkpoint_match["best_score"]
+            verification_results["ocr"]["wrong_checkpoint"] = True
+            verification_results["status"] = "pending_admin"
+
+    # Liveness and embedding share one selfie decode in a single ML task
+    need_liveness = bool(checkpoint.get("require_selfie", False) and selfie_image)
+    need_embedding = bool(user.get("face_consent") and selfie_image and user.get("face_embedding"))
+    selfie_analysis = {}
+    if need_liveness or need_embedding:
+        selfie_analysis = await _analyze_selfie(selfie_image, need_liveness, need_embedding)
+
+    # 3. Liveness Validation (if selfie required)
+    if need_liveness:
+        liveness_score = selfie_analysis["liveness_score"]
+        is_valid = liveness_score >= LIVENESS_THRESHOLD
+
+        verification_results["face"] = {
+            "liveness_score": liveness_score,
+            "is_valid": is_valid
+        }
+
+        if not is_valid:
+            verification_results["status"] = "pending_admin"
+
+    # 4. Face Matching (if user consented)
+    if need_embedding:
+        new_embedding = selfie_analysis["embedding"]
+        if new_embedding:
+            is_match, match_score = match_faces(
+                user["face_embedding"],
+                new_embedding,
+                FACE_MATCH_THRESHOLD
+            )
+            if verification_results["face"]:
+                verification_results["face"]["match_score"] = match_score
+            else:
+                verification_results["face"] = {
+                    "liveness_score": 0.0,
+                    "is_valid": False,
+                    "match_score": match_score
+                }
+
+            # A selfie that matches another account is sent to manual review
+            other_matches = get_face_index().search(
+                new_embedding, k=FACE_SEARCH_TOP_K,
+                threshold=FACE_MATCH_THRESHOLD, exclude=str(user["_id"])
+            )
+            if other_matches:
+                verification_results["face"]["other_matches"] = [
+                    {"user_id": other_id, "score": score} for other_id, score in other_matches
+                ]
+                verification_results["status"] = "pending_admin"
+
+    # 5. Final decision
+    if verification_results["status"] == "pending":
+        verification_results["status"] = "verified"
+        verification_results["points_awarded"] = challenge.get("points_per_checkpoint", 10)
+        verification_results["verified_at"] = datetime.now(timezone.utc)
+        # Cleared once the user has the points; a retried job completes the award
+        verification_results["points_pending"] = True
+
+    updated = await _save_results(submission_id, verification_results)
+
+    if updated and verification_results["points_awarded"]:
+        await _award_points(submission_id, submission["user_id"], verification_results["points_awarded"])
+
+
+# Submissions remembered per user to make awards idempotent; an award is retried within seconds
+AWARDED_SUBMISSIONS_KEPT = 50
+
+
+async def _award_points(submission_id: str, user_id: str, points: int):
+    """Give the user the points of a verified submission exactly once"""
+    db = get_database()
+    await db.users.update_one(
+        {"_id": ObjectId(user_id), "awarded_submissions": {"$ne": submission_id}},
+        {
+            "$inc": {"points": points},
+            "$push": {"awarded_submissions": {"$each": [submission_id], "$slice": -AWARDED_SUBMISSIONS_KEPT}},
+        },
+    )
+    await db.submissions.update_one(
+        {"_id": ObjectId(submission_id), "points_pending": True},
+        {"$set": {"points_pending": False}},
+    )
+
+
+async def _save_results(submission_id: str, verification_results: dict) -> bool:
+    """Store the verdict unless another worker or an admin already decided"""
+    db = get_database()
+    result = await db.submissions.update_one(
+        {"_id": ObjectId(submission_id), "status": "pending"},
+        {"$set": verification_results}
+    )
+    return result.modified_count == 1
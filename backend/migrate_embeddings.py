@@ -0,0 +1,61 @@
+"""
+Migration script: convert face embeddings stored as BSON arrays of doubles
+into compact binary (see ml.face_match.encode_embedding).
+Run with: python migrate_embeddings.py
+"""
+import asyncio
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+
+from db import connect_db, get_database
+from ml.face_match import encode_embedding
+from config import DATABASE_NAME, FACE_EMBEDDING_FORMAT
+
+BATCH_SIZE = 500
+
+
+async def migrate_embeddings():
+    """Rewrite every array embedding as binary, in batches"""
+    db = get_database()
+    query = {"face_embedding": {"$type": "array"}}
+
+    total = await db.users.count_documents(query)
+    if total == 0:
+        print("✅ No embeddings left to migrate")
+        return 0
+
+    print(f"🔄 Migrating {total} embedding(s) to {FACE_EMBEDDING_FORMAT} binary...")
+    migrated = 0
+    batch = []
+    async for user in db.users.find(query, {"face_embedding": 1}):
+        batch.append(UpdateOne(
+            # Match the array again so a concurrent re-enrollment is not overwritten
+            {"_id": user["_id"], "face_embedding": {"$type": "array"}},
+            # face_enrolled_at makes running API nodes pick up the new encoding (ml.face_index)
+            {"$set": {
+                "face_embedding": encode_embedding(user["face_embedding"]),
+                "face_enrolled_at": datetime.now(timezone.utc),
+            }},
+        ))
+        if len(batch) >= BATCH_SIZE:
+            result = await db.users.bulk_write(batch, ordered=False)
+            migrated += result.modified_count
+            batch = []
+            print(f"   {migrated}/{total}")
+
+    if batch:
+        result = await db.users.bulk_write(batch, ordered=False)
+        migrated += result.modified_count
+
+    print(f"✅ Migrated {migrated} embedding(s)")
+    return migrated
+
+
+async def main():
+    await connect_db()
+    print(f"✅ Connected to database: {DATABASE_NAME}")
+    await migrate_embeddings()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
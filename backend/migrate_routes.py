@@ -0,0 +1,44 @@
+"""
+Migration script: store simplified route levels (see utils.polyline.route_fields)
+on challenges written before they existed.
+Run with: python migrate_routes.py
+"""
+import asyncio
+
+from db import connect_db, get_database
+from utils.polyline import route_fields
+from config import DATABASE_NAME
+
+
+async def migrate_routes():
+    """Compute route_levels and route_length_m for every challenge missing them"""
+    db = get_database()
+    query = {"route_levels": {"$exists": False}}
+
+    total = await db.challenges.count_documents(query)
+    if total == 0:
+        print("✅ No challenge routes left to migrate")
+        return 0
+
+    print(f"🔄 Simplifying {total} challenge route(s)...")
+    migrated = 0
+    async for challenge in db.challenges.find(query, {"route_points": 1}):
+        fields = route_fields(challenge.get("route_points") or [])
+        result = await db.challenges.update_one(
+            {"_id": challenge["_id"], "route_levels": {"$exists": False}},
+            {"$set": fields},
+        )
+        migrated += result.modified_count
+
+    print(f"✅ Migrated {migrated} challenge route(s)")
+    return migrated
+
+
+async def main():
+    await connect_db()
+    print(f"✅ Connected to database: {DATABASE_NAME}")
+    await migrate_routes()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
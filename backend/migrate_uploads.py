@@ -0,0 +1,83 @@
+"""
+Migration script: move uploads stored as uploads/photos|selfies/{user}_{uuid}.ext
+into the content-addressed blob store (see utils.storage) and point submissions
+at the blob ids. Duplicate files collapse into one blob. Files go to the
+configured STORAGE_BACKEND, so this also uploads them to object storage.
+Run with: python migrate_uploads.py
+"""
+import asyncio
+import hashlib
+import shutil
+import uuid
+
+from db import connect_db, get_database
+from utils.storage import acquire_blob, release_blob, blob_location
+from utils.storage_backends import blob_key, get_storage_backend
+from config import BASE_DIR, DATABASE_NAME, UPLOAD_CHUNK_SIZE, BLOB_TMP_DIR
+
+
+def _hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _copy_into_store(path, blob_id):
+    """Copy a legacy file to its blob location unless the blob exists; the file stays"""
+    backend = get_storage_backend()
+    if backend.exists(blob_key(blob_id)):
+        return
+    # put_file consumes its input
+    tmp_path = BLOB_TMP_DIR / f"{uuid.uuid4().hex}.part"
+    shutil.copyfile(path, tmp_path)
+    backend.put_file(blob_key(blob_id), tmp_path)
+
+
+async def migrate_field(kind: str):
+    """
+    Migrate `{kind}_path` of every submission without a `{kind}_blob`.
+    The legacy file is removed only once the submission points at its blob,
+    so an interrupted run can simply be started again.
+    """
+    db = get_database()
+    query = {f"{kind}_path": {"$regex": f"^uploads/{kind}s/"}, f"{kind}_blob": None}
+    migrated = missing = 0
+    async for submission in db.submissions.find(query, {f"{kind}_path": 1}):
+        path = BASE_DIR / submission[f"{kind}_path"]
+        if not path.exists():
+            missing += 1
+            continue
+        blob_id = await asyncio.to_thread(_hash_file, path)
+        size = path.stat().st_size
+        ext = path.suffix.lstrip(".").lower() or "jpg"
+        await asyncio.to_thread(_copy_into_store, path, blob_id)
+        await acquire_blob(blob_id, size, ext)
+        result = await db.submissions.update_one(
+            {"_id": submission["_id"], f"{kind}_blob": None},
+            {"$set": {
+                f"{kind}_path": blob_location(blob_id),
+                f"{kind}_blob": blob_id,
+                f"{kind}_size": size,
+            }},
+        )
+        if result.modified_count == 0:
+            # Migrated by a concurrent run
+            await release_blob(blob_id)
+            continue
+        await asyncio.to_thread(path.unlink, True)
+        migrated += 1
+    print(f"✅ Migrated {migrated} {kind}(s), {missing} file(s) missing")
+    return migrated
+
+
+async def main():
+    await connect_db()
+    print(f"✅ Connected to database: {DATABASE_NAME}")
+    await migrate_field("photo")
+    await migrate_field("selfie")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
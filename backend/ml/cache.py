@@ -0,0 +1,170 @@
+"""
+Result cache for the ML stages.
+
+Retried uploads and re-reviews send the same image bytes through OCR and
+liveness again. Results are cached under the SHA-256 of the image bytes plus
+the stage name and the engine/parameter version of that stage, so a repeated
+image skips the ML work entirely while an engine or preprocessing change
+invalidates old entries. Lookups go through an in-memory LRU first and the
+`ml_results` collection second. Face embeddings are biometric data and stay in
+memory only, so nothing outlives the user's consent in the database.
+"""
+
+import pickle
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING
+
+from db import get_database
+from config import (
+    ML_CACHE_ENABLED,
+    ML_CACHE_MAX_ENTRIES,
+    ML_CACHE_MAX_BYTES,
+    ML_CACHE_PERSIST,
+    ML_CACHE_TTL_DAYS,
+)
+
+_MISSING = object()
+
+# Stages never written to ml_results
+MEMORY_ONLY_STAGES = frozenset({"embedding"})
+
+
+class LRUCache:
+    """Size-bounded LRU map; evicts by entry count and by approximate byte size"""
+
+    def __init__(self, max_entries=ML_CACHE_MAX_ENTRIES, max_bytes=ML_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def get(self, key, default=None):
+        item = self._items.get(key)
+        if item is None:
+            return default
+        self._items.move_to_end(key)
+        return item[0]
+
+    def set(self, key, value):
+        size = len(pickle.dumps(value))
+        if size > self.max_bytes:
+            return
+        if key in self._items:
+            self._bytes -= self._items.pop(key)[1]
+        self._items[key] = (value, size)
+        self._bytes += size
+        while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, old_size) = self._items.popitem(last=False)
+            self._bytes -= old_size
+
+    def clear(self):
+        self._items.clear()
+        self._bytes = 0
+
+
+class ResultCache:
+    """Two-tier (memory, Mongo) cache with per-stage hit/miss counters"""
+
+    def __init__(self, enabled=ML_CACHE_ENABLED, persist=ML_CACHE_PERSIST):
+        self.enabled = enabled
+        self.persist = persist
+        self.memory = LRUCache()
+        self.stats = {}
+
+    @staticmethod
+    def make_key(stage: str, digest: str, version: str) -> str:
+        return f"{stage}:{version}:{digest}"
+
+    def _count(self, stage: str, outcome: str):
+        counters = self.stats.setdefault(stage, {"memory_hits": 0, "persistent_hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+    async def setup(self):
+        if not (self.enabled and self.persist):
+            return
+        db = get_database()
+        await db.ml_results.create_index(
+            [("created_at", ASCENDING)],
+            expireAfterSeconds=int(ML_CACHE_TTL_DAYS * 24 * 3600),
+        )
+        # Written before these stages were kept out of the collection
+        await db.ml_results.delete_many({"stage": {"$in": list(MEMORY_ONLY_STAGES)}})
+
+    def _persists(self, stage: str) -> bool:
+        return self.persist and stage not in MEMORY_ONLY_STAGES
+
+    async def get(self, stage: str, digest: str, version: str):
+        """Cached result or the module-level _MISSING sentinel"""
+        if not self.enabled:
+            return _MISSING
+
+        key = self.make_key(stage, digest, version)
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            self._count(stage, "memory_hits")
+            return value
+
+        if self._persists(stage):
+            doc = await get_database().ml_results.find_one({"_id": key})
+            if doc:
+                self.memory.set(key, doc["value"])
+                self._count(stage, "persistent_hits")
+                return doc["value"]
+
+        self._count(stage, "misses")
+        return _MISSING
+
+    async def set(self, stage: str, digest: str, version: str, value):
+        if not self.enabled or value is None:
+            return
+        key = self.make_key(stage, digest, version)
+        self.memory.set(key, value)
+        if self._persists(stage):
+            await get_database().ml_results.replace_one(
+                {"_id": key},
+                {"_id": key, "stage": stage, "value": value, "created_at": datetime.now(timezone.utc)},
+                upsert=True,
+            )
+
+    def report(self):
+        stages = {}
+        for stage, counters in self.stats.items():
+            lookups = sum(counters.values())
+            hits = counters["memory_hits"] + counters["persistent_hits"]
+            stages[stage] = {**counters, "hit_rate": round(hits / lookups, 3) if lookups else 0.0}
+        return {
+            "enabled": self.enabled,
+            "persistent": self.persist,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.size_bytes,
+            "stages": stages,
+        }
+
+
+result_cache = ResultCache()
+
+
+def is_miss(value) -> bool:
+    return value is _MISSING
+
+
+async def cached_result(stage: str, image, version: str, compute):
+    """
+    Return the cached `stage` result for `image`, or await `compute()` and cache it.
+    `image` is a VerificationImage; `version` identifies engine and parameters.
+    """
+    value = await result_cache.get(stage, image.digest, version)
+    if not is_miss(value):
+        return value
+    value = await compute()
+    await result_cache.set(stage, image.digest, version, value)
+    return value
@@ -0,0 +1,64 @@
+"""
+Per-process registry of loaded ML engines.
+
+Model-backed engines (PaddleOCR, face detectors, ...) are expensive to build, so
+each one is loaded once per worker process and reused for every call. Load time
+and the memory the load added are recorded for the readiness report, which lets
+warm workers be told apart from cold ones.
+"""
+
+import os
+import resource
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+_engines = {}
+_reports = {}
+_lock = threading.Lock()
+
+
+def _rss_bytes():
+    """Current resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # No procfs (macOS): fall back to peak RSS, reported in bytes there
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_engine(name, loader):
+    """Return the engine registered as `name`, loading it with `loader()` on first use"""
+    engine = _engines.get(name)
+    if engine is not None:
+        return engine
+
+    with _lock:
+        engine = _engines.get(name)
+        if engine is None:
+            rss_before = _rss_bytes()
+            started = time.perf_counter()
+            engine = loader()
+            _reports[name] = {
+                "load_seconds": round(time.perf_counter() - started, 3),
+                "memory_bytes": max(_rss_bytes() - rss_before, 0),
+                "loaded_at": datetime.now(timezone.utc).isoformat(),
+            }
+            _engines[name] = engine
+    return engine
+
+
+def is_loaded(name):
+    return name in _engines
+
+
+def readiness_report():
+    """Engines loaded in this process with their load cost"""
+    return {
+        "pid": os.getpid(),
+        "rss_bytes": _rss_bytes(),
+        "engines": {name: dict(report) for name, report in _reports.items()},
+    }
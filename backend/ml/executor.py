@@ -0,0 +1,164 @@
+"""
+Process pool for the CPU-bound ML stages.
+
+OCR, liveness and face embedding are plain synchronous functions that can take
+seconds per image. Awaiting them through run_ml() runs them in a pool of worker
+processes, so the event loop keeps serving requests and a single API process
+can use every core. Workers are warmed up (models loaded) when the pool starts
+and report what they loaded back to the parent for /health/ready. A task that
+exceeds ML_TASK_TIMEOUT is cancelled by recycling the pool, and a crashed
+worker is replaced transparently.
+"""
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import ML_WORKERS, ML_TASK_TIMEOUT, ML_WARMUP, ML_START_METHOD
+
+
+class MLTaskTimeout(Exception):
+    """Raised when an ML task does not finish within its timeout"""
+
+
+_executor = None
+_report_queue = None
+_worker_reports = {}
+
+
+def warm_up_worker():
+    """Import the ML modules and load their models in the current process"""
+    from ml import ocr, liveness, face_match
+
+    for module in (ocr, liveness, face_match):
+        try:
+            module.warm_up()
+        except Exception as e:
+            print(f"ML warm-up error in {module.__name__}: {e}")
+
+
+def _init_worker(warmup, report_queue):
+    from ml.engines import readiness_report
+
+    if warmup:
+        warm_up_worker()
+    report_queue.put(readiness_report())
+
+
+def _ping():
+    return True
+
+
+def _create_executor():
+    global _report_queue
+    context = multiprocessing.get_context(ML_START_METHOD)
+    _report_queue = context.SimpleQueue()
+    _worker_reports.clear()
+    return ProcessPoolExecutor(
+        max_workers=ML_WORKERS,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(ML_WARMUP, _report_queue),
+    )
+
+
+def worker_reports():
+    """Readiness reports of the live pool's workers, one per process"""
+    if _executor is None:
+        from ml.engines import readiness_report
+        return [readiness_report()]
+
+    while not _report_queue.empty():
+        report = _report_queue.get()
+        _worker_reports[report["pid"]] = report
+    return list(_worker_reports.values())
+
+
+def is_ready():
+    """True once every worker process has finished warming up"""
+    if _executor is None:
+        return True
+    return len(worker_reports()) >= ML_WORKERS
+
+
+def _restart_executor(broken):
+    """Replace `broken` with a fresh pool, killing its worker processes"""
+    global _executor
+    if _executor is not broken:
+        # Another task already recycled this pool
+        return
+
+    # ProcessPoolExecutor cannot cancel a running task, so hung workers are
+    # terminated. Other callers' tasks on the old pool (running or queued) are
+    # not cancelled: they fail with BrokenProcessPool and run_ml() retries them
+    # on the new pool.
+    processes = list((getattr(broken, "_processes", None) or {}).values())
+    broken.shutdown(wait=False, cancel_futures=False)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+    _executor = _create_executor()
+    # Spawn and warm the replacement workers now rather than on the next request
+    for _ in range(ML_WORKERS):
+        _executor.submit(_ping)
+
+
+async def start_ml_executor():
+    """Start the pool and wait until every worker has warmed up"""
+    global _executor
+    if ML_WORKERS <= 0:
+        # In-process mode: tasks run on the default thread pool
+        if ML_WARMUP:
+            await asyncio.to_thread(warm_up_worker)
+        return
+
+    _executor = _create_executor()
+    loop = asyncio.get_running_loop()
+    # Submitting one task per worker makes the pool spawn all of them now
+    await asyncio.gather(*[
+        loop.run_in_executor(_executor, _ping) for _ in range(ML_WORKERS)
+    ])
+
+
+async def shutdown_ml_executor():
+    global _executor
+    if _executor:
+        executor = _executor
+        _executor = None
+        await asyncio.to_thread(executor.shutdown, True, cancel_futures=True)
+
+
+async def run_ml(fn, *args, timeout=None):
+    """
+    Run `fn(*args)` in the ML pool and return its result.
+    `fn` and its arguments must be picklable (module-level functions).
+    """
+    timeout = ML_TASK_TIMEOUT if timeout is None else timeout
+
+    if _executor is None:
+        try:
+            return await asyncio.wait_for(asyncio.to_thread(fn, *args), timeout)
+        except asyncio.TimeoutError:
+            raise MLTaskTimeout(f"{fn.__name__} exceeded {timeout}s")
+
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        executor = _executor
+        try:
+            future = loop.run_in_executor(executor, fn, *args)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            _restart_executor(executor)
+            raise MLTaskTimeout(f"{fn.__name__} exceeded {timeout}s")
+        except BrokenProcessPool:
+            # A worker died (segfault, OOM kill); retry once on a fresh pool
+            _restart_executor(executor)
+            if attempt:
+                raise
+        except asyncio.CancelledError:
+            # Our own task being cancelled propagates; a pool future cancelled
+            # by a recycled pool is retried like a broken pool
+            if asyncio.current_task().cancelling() or executor is _executor or attempt:
+                raise
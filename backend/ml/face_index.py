@@ -0,0 +1,251 @@
+"""
+1:N face search over every consented user's enrolled embedding.
+
+Embeddings live in one contiguous float32 matrix (unit rows), so a search is a
+single matrix-vector product followed by a top-k partition. As the population
+grows, FACE_INDEX_MODE="ivf" adds an inverted-file layer: rows are clustered
+around k-means centroids and a query only scores the FACE_INDEX_NPROBE closest
+clusters. The index is updated incrementally on enrollment, refreshed from
+Mongo in the background (for enrollments on other API nodes, and to drop users
+who withdrew consent or lost their embedding) and snapshotted to disk so a
+restart does not rebuild it from scratch.
+"""
+
+import asyncio
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+from db import get_database
+from ml.face_match import decode_embedding, normalize_embedding, INT8_SCALE
+from config import (
+    FACE_INDEX_MODE,
+    FACE_INDEX_NLIST,
+    FACE_INDEX_NPROBE,
+    FACE_INDEX_IVF_MIN_SIZE,
+    FACE_INDEX_PATH,
+    FACE_INDEX_REFRESH_SECONDS,
+)
+
+EMBEDDING_DIM = 512
+
+
+def _as_unit_vector(embedding):
+    vec = decode_embedding(embedding)
+    if vec.dtype == np.int8:
+        vec = vec.astype(np.float32) / INT8_SCALE
+    return normalize_embedding(vec)
+
+
+class FaceIndex:
+    def __init__(self, dim=EMBEDDING_DIM, mode=FACE_INDEX_MODE):
+        self.dim = dim
+        self.mode = mode
+        self._matrix = np.empty((64, dim), dtype=np.float32)
+        self._size = 0
+        self._ids = []
+        self._rows = {}
+        # IVF state: centroids, per-row cluster assignment, size when trained
+        self._centroids = None
+        self._assignments = np.empty(64, dtype=np.int32)
+        self._trained_size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, user_id):
+        return user_id in self._rows
+
+    def user_ids(self):
+        return list(self._ids)
+
+    def _grow(self):
+        capacity = self._matrix.shape[0] * 2
+        matrix = np.empty((capacity, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        assignments = np.empty(capacity, dtype=np.int32)
+        assignments[:self._size] = self._assignments[:self._size]
+        self._matrix, self._assignments = matrix, assignments
+
+    def add(self, user_id: str, embedding):
+        """Insert or replace the embedding of `user_id`"""
+        vec = _as_unit_vector(embedding)
+        if vec.shape != (self.dim,):
+            return
+        row = self._rows.get(user_id)
+        if row is None:
+            if self._size == self._matrix.shape[0]:
+                self._grow()
+            row = self._size
+            self._size += 1
+            self._ids.append(user_id)
+            self._rows[user_id] = row
+        self._matrix[row] = vec
+        if self._centroids is not None:
+            self._assignments[row] = int(np.argmax(self._centroids @ vec))
+        self._maybe_train()
+
+    def remove(self, user_id: str):
+        row = self._rows.pop(user_id, None)
+        if row is None:
+            return
+        last = self._size - 1
+        if row != last:
+            # Move the last row into the gap to keep the matrix dense
+            moved = self._ids[last]
+            self._matrix[row] = self._matrix[last]
+            self._assignments[row] = self._assignments[last]
+            self._ids[row] = moved
+            self._rows[moved] = row
+        self._ids.pop()
+        self._size -= 1
+
+    def _maybe_train(self):
+        if self.mode != "ivf" or self._size < FACE_INDEX_IVF_MIN_SIZE:
+            return
+        # Retrain when the population has doubled since the last training
+        if self._centroids is None or self._size >= 2 * self._trained_size:
+            self.train()
+
+    def train(self, iterations=10, seed=0):
+        """Cluster the current rows with spherical k-means for IVF search"""
+        data = self._matrix[:self._size]
+        nlist = min(FACE_INDEX_NLIST, max(self._size // 39, 1))
+        rng = np.random.default_rng(seed)
+        centroids = data[rng.choice(self._size, nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(data @ centroids.T, axis=1)
+            for cluster in range(nlist):
+                members = data[assignments == cluster]
+                if len(members):
+                    centroids[cluster] = normalize_embedding(members.sum(axis=0))
+        self._centroids = centroids
+        self._assignments[:self._size] = np.argmax(data @ centroids.T, axis=1)
+        self._trained_size = self._size
+
+    def _candidate_rows(self, query):
+        if self.mode != "ivf" or self._centroids is None:
+            return None
+        nprobe = min(FACE_INDEX_NPROBE, len(self._centroids))
+        probes = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+        return np.flatnonzero(np.isin(self._assignments[:self._size], probes))
+
+    def search(self, embedding, k=5, threshold=None, exclude=None):
+        """
+        Users whose embedding is most similar to `embedding`.
+        Returns [(user_id, similarity)] best first, at most `k`, skipping
+        `exclude` and anything below `threshold`.
+        """
+        if self._size == 0:
+            return []
+        query = _as_unit_vector(embedding)
+        if query.shape != (self.dim,):
+            return []
+
+        rows = self._candidate_rows(query)
+        if rows is None:
+            scores = self._matrix[:self._size] @ query
+            rows = np.arange(self._size)
+        else:
+            scores = self._matrix[rows] @ query
+
+        # One extra candidate so excluding the query user still leaves k results
+        top = min(k + 1, len(scores))
+        if top == 0:
+            return []
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best])]
+
+        results = []
+        for position in best:
+            user_id = self._ids[rows[position]]
+            score = float(scores[position])
+            if user_id == exclude or (threshold is not None and score < threshold):
+                continue
+            results.append((user_id, score))
+        return results[:k]
+
+    def save(self, path=FACE_INDEX_PATH, synced_at=None):
+        """Write a snapshot atomically (temp file + rename)"""
+        path = str(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            matrix=self._matrix[:self._size],
+            ids=np.array(self._ids, dtype=str),
+            synced_at=np.array((synced_at or datetime.now(timezone.utc)).isoformat()),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=FACE_INDEX_PATH):
+        """Restore a snapshot; returns (index, synced_at)"""
+        snapshot = np.load(str(path))
+        index = cls()
+        for user_id, vec in zip(snapshot["ids"], snapshot["matrix"]):
+            index.add(str(user_id), vec)
+        return index, datetime.fromisoformat(str(snapshot["synced_at"]))
+
+
+face_index = FaceIndex()
+_synced_at = None
+_refresh_task = None
+
+
+def get_face_index():
+    return face_index
+
+
+async def sync_face_index(full=False):
+    """
+    Add consented users enrolled since the last sync (or all users when `full`)
+    and remove indexed users that are no longer consented and enrolled
+    """
+    global _synced_at
+    db = get_database()
+    started = datetime.now(timezone.utc)
+    query = {"face_consent": True, "face_embedding": {"$ne": None}}
+
+    # Only ids are read here; a user enrolled meanwhile is re-added below or on the next sync
+    searchable = {str(user["_id"]) async for user in db.users.find(query, {"_id": 1})}
+    for user_id in face_index.user_ids():
+        if user_id not in searchable:
+            face_index.remove(user_id)
+
+    if _synced_at and not full:
+        query["face_enrolled_at"] = {"$gte": _synced_at}
+    async for user in db.users.find(query, {"face_embedding": 1}):
+        face_index.add(str(user["_id"]), user["face_embedding"])
+    _synced_at = started
+
+
+async def _refresh_loop():
+    while True:
+        await asyncio.sleep(FACE_INDEX_REFRESH_SECONDS)
+        try:
+            await sync_face_index()
+        except Exception as e:
+            print(f"Face index refresh error: {e}")
+
+
+async def start_face_index():
+    """Restore the snapshot (or build from Mongo) and keep the index fresh"""
+    global face_index, _synced_at, _refresh_task
+    if os.path.exists(str(FACE_INDEX_PATH)):
+        try:
+            face_index, _synced_at = await asyncio.to_thread(FaceIndex.load)
+        except Exception as e:
+            print(f"Face index snapshot unreadable, rebuilding: {e}")
+    await sync_face_index(full=_synced_at is None)
+    _refresh_task = asyncio.create_task(_refresh_loop())
+
+
+async def stop_face_index():
+    global _refresh_task
+    if _refresh_task:
+        _refresh_task.cancel()
+        _refresh_task = None
+    if _synced_at:
+        await asyncio.to_thread(face_index.save, FACE_INDEX_PATH, _synced_at)
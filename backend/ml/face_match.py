@@ -1,6 +1,19 @@
+from pathlib import Path
 import cv2
 import numpy as np
+from ml.image import as_verification_image
+from ml.engines import get_engine
+from bson.binary import Binary
+from config import (
+    FACE_EMBEDDING_FORMAT,
+    FACE_MODEL_DIR,
+    FACE_MODEL_NAME,
+    FACE_DET_SIZE,
+    FACE_ORT_INTRA_OP_THREADS,
+    FACE_ORT_INTER_OP_THREADS,
+)
 try:
+    import onnxruntime as ort
     from insightface import app as face_app
     from insightface.utils import face_align
     INSIGHTFACE_AVAILABLE = True
@@ -8,63 +21,163 @@ except ImportError:
     INSIGHTFACE_AVAILABLE = False
 
 face_model = None
+face_model_error = None
 
-def init_face_model():
-    """Initialize face recognition model"""
-    global face_model
-    if INSIGHTFACE_AVAILABLE and face_model is None:
-        try:
-            # Initialize InsightFace model
-            # Note: You need to download the model files
-            # face_model = face_app.FaceAnalysis(providers=['CPUExecutionProvider'])
-            # face_model.prepare(ctx_id=0, det_size=(640, 640))
-            pass
-        except Exception as e:
-            print(f"Face model initialization error: {e}")
+# BSON binary subtypes (user-defined range) marking the embedding encoding
+EMBEDDING_SUBTYPE_FLOAT32 = 0x80
+EMBEDDING_SUBTYPE_INT8 = 0x81
+INT8_SCALE = 127.0
 
-def extract_face_embedding(image_path):
-    """
-    Extract face embedding from image
-    Returns 512-dimensional embedding vector or None
-    """
-    if not INSIGHTFACE_AVAILABLE:
+# Result cache version: bump when the recognition model changes
+EMBEDDING_CACHE_VERSION = f"insightface:{FACE_MODEL_NAME}:3:{FACE_EMBEDDING_FORMAT}"
+
+def _model_files_present():
+    model_path = Path(FACE_MODEL_DIR) / "models" / FACE_MODEL_NAME
+    return model_path.is_dir() and any(model_path.glob("*.onnx"))
+
+def _load_face_model():
+    # ONNX Runtime on CPU; keep per-process threads low when several ML workers share the box
+    sess_options = ort.SessionOptions()
+    sess_options.intra_op_num_threads = FACE_ORT_INTRA_OP_THREADS
+    sess_options.inter_op_num_threads = FACE_ORT_INTER_OP_THREADS
+    model = face_app.FaceAnalysis(
+        name=FACE_MODEL_NAME,
+        root=str(FACE_MODEL_DIR),
+        allowed_modules=["detection", "recognition"],
+        providers=["CPUExecutionProvider"],
+        sess_options=sess_options,
+    )
+    model.prepare(ctx_id=-1, det_size=(FACE_DET_SIZE, FACE_DET_SIZE))
+    # Warm-up inference so the first selfie does not pay for graph initialization
+    model.get(np.zeros((FACE_DET_SIZE, FACE_DET_SIZE, 3), dtype=np.uint8))
+    return model
+
+def init_face_model():
+    """Initialize face recognition model from FACE_MODEL_DIR (never downloads)"""
+    global face_model, face_model_error
+    if not INSIGHTFACE_AVAILABLE or face_model is not None or face_model_error:
+        return face_model
+    
+    if not _model_files_present():
+        face_model_error = f"Face model '{FACE_MODEL_NAME}' not found in {FACE_MODEL_DIR}/models"
+        print(f"Face model initialization error: {face_model_error}")
         return None
     
+    try:
+        face_model = get_engine("insightface", _load_face_model)
+    except Exception as e:
+        face_model_error = str(e)
+        print(f"Face model initialization error: {e}")
+    return face_model
+
+def warm_up():
+    """Load the face recognition model in this process"""
     init_face_model()
-    
-    if face_model is None:
+
+def _largest_face(img):
+    """Bounding box and landmarks of the largest face, or None"""
+    bboxes, kpss = face_model.det_model.detect(img, max_num=1, metric="default")
+    if bboxes is None or len(bboxes) == 0 or kpss is None:
         return None
+    return bboxes[0], kpss[0]
+
+def extract_face_embeddings(images):
+    """
+    Extract embeddings for several images with one recognition inference.
+    Faces are detected per image, aligned, and the crops are embedded as a
+    single batch. Returns a list matching `images`: an encoded embedding
+    (see encode_embedding) per image, or None where no face was found.
+    """
+    embeddings = [None] * len(images)
+    if not INSIGHTFACE_AVAILABLE or init_face_model() is None:
+        return embeddings
     
-    img = cv2.imread(image_path)
-    if img is None:
-        return None
+    crops, owners = [], []
+    for index, image in enumerate(images):
+        img = as_verification_image(image).bgr
+        if img is None:
+            continue
+        try:
+            face = _largest_face(img)
+        except Exception as e:
+            print(f"Face detection error: {e}")
+            continue
+        if face is None:
+            continue
+        crops.append(face_align.norm_crop(img, landmark=face[1], image_size=112))
+        owners.append(index)
+    
+    if not crops:
+        return embeddings
     
     try:
-        faces = face_model.get(img)
-        if faces and len(faces) > 0:
-            # Return embedding of first detected face
-            return faces[0].embedding.tolist()
+        features = face_model.models["recognition"].get_feat(crops)
     except Exception as e:
         print(f"Face embedding extraction error: {e}")
+        return embeddings
     
-    return None
+    for index, feature in zip(owners, np.asarray(features)):
+        embeddings[index] = encode_embedding(feature)
+    return embeddings
+
+def extract_face_embedding(image):
+    """
+    Extract face embedding from image
+    Returns the encoded 512-dimensional embedding or None
+    """
+    return extract_face_embeddings([image])[0]
+
+def normalize_embedding(embedding):
+    """L2-normalized float32 copy of an embedding"""
+    vec = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+def encode_embedding(embedding, fmt=FACE_EMBEDDING_FORMAT):
+    """
+    Pack an embedding as BSON binary: L2-normalized float32 (2 KB for 512
+    dimensions) or int8 scaled by 127 (512 bytes). The binary subtype records
+    which one so decode_embedding can tell them apart.
+    """
+    vec = normalize_embedding(embedding)
+    if fmt == "int8":
+        quantized = np.clip(np.round(vec * INT8_SCALE), -INT8_SCALE, INT8_SCALE).astype(np.int8)
+        return Binary(quantized.tobytes(), EMBEDDING_SUBTYPE_INT8)
+    return Binary(vec.tobytes(), EMBEDDING_SUBTYPE_FLOAT32)
+
+def decode_embedding(value):
+    """
+    NumPy view of a stored embedding. Binary values are read in place
+    (zero-copy, read-only); int8 values keep their quantized dtype. Legacy
+    float lists are normalized into a new float32 array.
+    """
+    if value is None:
+        return None
+    if isinstance(value, Binary):
+        if value.subtype == EMBEDDING_SUBTYPE_INT8:
+            return np.frombuffer(value, dtype=np.int8)
+        return np.frombuffer(value, dtype=np.float32)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return np.frombuffer(value, dtype=np.float32)
+    return normalize_embedding(value)
+
+def _unit_vector(value):
+    vec = decode_embedding(value)
+    if vec is None or vec.size == 0:
+        return None
+    if vec.dtype == np.int8:
+        return vec.astype(np.float32) / INT8_SCALE
+    return vec
 
 def cosine_similarity(embedding1, embedding2):
     """Calculate cosine similarity between two embeddings"""
-    if embedding1 is None or embedding2 is None:
-        return 0.0
-    
-    vec1 = np.array(embedding1)
-    vec2 = np.array(embedding2)
-    
-    dot_product = np.dot(vec1, vec2)
-    norm1 = np.linalg.norm(vec1)
-    norm2 = np.linalg.norm(vec2)
-    
-    if norm1 == 0 or norm2 == 0:
+    vec1 = _unit_vector(embedding1)
+    vec2 = _unit_vector(embedding2)
+    if vec1 is None or vec2 is None or vec1.shape != vec2.shape:
         return 0.0
     
-    return float(dot_product / (norm1 * norm2))
+    # Stored embeddings are unit length, so similarity is a single dot product
+    return float(np.dot(vec1, vec2))
 
 def match_faces(embedding1, embedding2, threshold=0.7):
     """
@@ -0,0 +1,120 @@
+"""
+Decode-once image shared by every verification stage.
+
+A VerificationImage wraps the encoded bytes of an upload. The image is decoded
+the first time a stage needs pixels and derived forms (grayscale, RGB,
+downscaled copies) are cached on the object, so OCR, liveness and face
+matching never decode or read the same file twice. Only the encoded bytes are
+pickled, which keeps hand-off to the ML process pool cheap.
+"""
+
+import hashlib
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+
+class VerificationImage:
+    def __init__(self, data: bytes = None, path=None, digest: str = None):
+        if data is None and path is None:
+            raise ValueError("VerificationImage needs bytes or a path")
+        self._data = data
+        self.path = str(path) if path is not None else None
+        # Known SHA-256 (e.g. computed while the upload was streamed to disk)
+        self._digest = digest
+        self._cache = {}
+
+    @classmethod
+    def from_path(cls, path):
+        return cls(path=path)
+
+    @property
+    def data(self) -> bytes:
+        """Encoded image bytes, read from `path` only if none were given"""
+        if self._data is None:
+            try:
+                self._data = Path(self.path).read_bytes()
+            except OSError:
+                # Same outcome as cv2.imread on a missing file: no pixels
+                self._data = b""
+        return self._data
+
+    @property
+    def digest(self) -> str:
+        """SHA-256 of the encoded bytes, used as the result cache key"""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.data).hexdigest()
+        return self._digest
+
+    def _cached(self, key, build):
+        value = self._cache.get(key)
+        if value is None:
+            value = build()
+            self._cache[key] = value
+        return value
+
+    @property
+    def bgr(self):
+        """Decoded BGR pixels, or None if the bytes are not a readable image"""
+        if "bgr" not in self._cache:
+            buffer = np.frombuffer(self.data, dtype=np.uint8)
+            self._cache["bgr"] = cv2.imdecode(buffer, cv2.IMREAD_COLOR) if buffer.size else None
+        return self._cache["bgr"]
+
+    @property
+    def is_valid(self) -> bool:
+        return self.bgr is not None
+
+    @property
+    def shape(self):
+        return self.bgr.shape if self.is_valid else None
+
+    @property
+    def gray(self):
+        if not self.is_valid:
+            return None
+        return self._cached("gray", lambda: cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY))
+
+    @property
+    def rgb(self):
+        if not self.is_valid:
+            return None
+        return self._cached("rgb", lambda: cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB))
+
+    def downscaled(self, max_side: int, form: str = "bgr"):
+        """`form` ("bgr", "gray" or "rgb") resized so its longest side is at most `max_side`"""
+        source = getattr(self, form)
+        if source is None:
+            return None
+        height, width = source.shape[:2]
+        scale = max_side / max(height, width)
+        if scale >= 1.0:
+            return source
+        return self._cached(
+            (form, max_side),
+            lambda: cv2.resize(
+                source,
+                (max(int(width * scale), 1), max(int(height * scale), 1)),
+                interpolation=cv2.INTER_AREA,
+            ),
+        )
+
+    def __getstate__(self):
+        # Ship encoded bytes only; the receiving process decodes on demand
+        return {"_data": self.data, "path": self.path, "_digest": self._digest}
+
+    def __setstate__(self, state):
+        self._data = state["_data"]
+        self.path = state["path"]
+        self._digest = state["_digest"]
+        self._cache = {}
+
+
+def as_verification_image(image):
+    """Accept a VerificationImage, encoded bytes or a file path"""
+    if isinstance(image, VerificationImage):
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return VerificationImage(data=bytes(image))
+    return VerificationImage.from_path(image)
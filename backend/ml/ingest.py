@@ -0,0 +1,59 @@
+"""
+Ingest-time normalization of uploaded images.
+
+Runs once per distinct upload (in the ML pool) and produces:
+- a working copy: EXIF orientation applied, metadata stripped, longest side
+  capped at INGEST_WORK_MAX_SIDE, re-encoded as JPEG; the ML stages read this
+- a WebP thumbnail of at most INGEST_THUMB_MAX_SIDE for admin lists
+
+HEIC files (often uploaded renamed as .jpg) are read when pillow-heif is installed.
+"""
+
+import io
+
+from PIL import Image, ImageOps
+from config import (
+    INGEST_WORK_MAX_SIDE,
+    INGEST_WORK_QUALITY,
+    INGEST_THUMB_MAX_SIDE,
+    INGEST_THUMB_QUALITY,
+)
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    HEIF_AVAILABLE = True
+except ImportError:
+    HEIF_AVAILABLE = False
+
+# Derivatives are cached per original; bump when the parameters above change
+INGEST_VERSION = f"1:{INGEST_WORK_MAX_SIDE}:{INGEST_WORK_QUALITY}:{INGEST_THUMB_MAX_SIDE}:{INGEST_THUMB_QUALITY}"
+
+
+def _encode(image, fmt, quality):
+    buffer = io.BytesIO()
+    # No exif/icc arguments: the re-encoded file carries no metadata
+    image.save(buffer, fmt, quality=quality, optimize=(fmt == "JPEG"))
+    return buffer.getvalue()
+
+
+def normalize_upload(source_file):
+    """
+    (working JPEG bytes, thumbnail WebP bytes), or None if not a readable image.
+    `source_file` is a path, or the bytes of a blob kept in object storage.
+    """
+    if isinstance(source_file, bytes):
+        source_file = io.BytesIO(source_file)
+    try:
+        with Image.open(source_file) as source:
+            # JPEG: let the decoder downscale by powers of two instead of decoding full size
+            source.draft("RGB", (INGEST_WORK_MAX_SIDE, INGEST_WORK_MAX_SIDE))
+            image = ImageOps.exif_transpose(source).convert("RGB")
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+    image.thumbnail((INGEST_WORK_MAX_SIDE, INGEST_WORK_MAX_SIDE), Image.LANCZOS)
+    work = _encode(image, "JPEG", INGEST_WORK_QUALITY)
+
+    image.thumbnail((INGEST_THUMB_MAX_SIDE, INGEST_THUMB_MAX_SIDE), Image.LANCZOS)
+    thumb = _encode(image, "WEBP", INGEST_THUMB_QUALITY)
+    return work, thumb
@@ -1,5 +1,11 @@
+import queue
+import threading
+from contextlib import contextmanager
 import cv2
 import numpy as np
+from ml.image import as_verification_image
+from ml.engines import get_engine
+from config import LIVENESS_DETECTOR_POOL_SIZE, LIVENESS_DETECTION_MAX_SIDE
 try:
     import mediapipe as mp
     MEDIAPIPE_AVAILABLE = True
@@ -9,6 +15,9 @@ except ImportError:
 mp_face_detection = None
 mp_drawing = None
 
+# Result cache version: bump when scoring changes
+LIVENESS_CACHE_VERSION = f"{'mediapipe' if MEDIAPIPE_AVAILABLE else 'quality'}:2:{LIVENESS_DETECTION_MAX_SIDE}"
+
 if MEDIAPIPE_AVAILABLE:
     mp_face_detection = mp.solutions.face_detection
     mp_drawing = mp.solutions.drawing_utils
@@ -22,20 +31,79 @@ def calculate_eye_aspect_ratio(landmarks, eye_indices):
     # In real implementation, use proper facial landmarks
     return 0.3  # Placeholder
 
-def detect_face(image_path):
+class DetectorPool:
+    """
+    MediaPipe FaceDetection graphs built once and reused across selfies.
+    A graph must not process two images at once, so callers borrow one;
+    up to `size` graphs exist, which covers ML running on threads.
+    """
+
+    def __init__(self, size=LIVENESS_DETECTOR_POOL_SIZE):
+        self.size = max(size, 1)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _create(self):
+        return mp_face_detection.FaceDetection(
+            model_selection=0, min_detection_confidence=0.5
+        )
+
+    def warm_up(self):
+        """Build every graph and run it once so none is cold on the hot path"""
+        blank = np.zeros((32, 32, 3), dtype=np.uint8)
+        while self._created < self.size:
+            with self._lock:
+                detector = self._create()
+                self._created += 1
+            detector.process(blank)
+            self._idle.put(detector)
+
+    @contextmanager
+    def borrow(self):
+        try:
+            detector = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                grow = self._created < self.size
+                if grow:
+                    self._created += 1
+            if grow:
+                try:
+                    detector = self._create()
+                except BaseException:
+                    # Give the slot back, or the pool shrinks for good
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                detector = self._idle.get()
+        try:
+            yield detector
+        finally:
+            self._idle.put(detector)
+
+def _load_detector_pool():
+    pool = DetectorPool()
+    pool.warm_up()
+    return pool
+
+def get_detector_pool():
+    """Face detector pool of this process"""
+    return get_engine("mediapipe_face_detection", _load_detector_pool)
+
+def detect_face(image):
     """Detect face in image using MediaPipe"""
     if not MEDIAPIPE_AVAILABLE:
         return None, 0.0
     
-    img = cv2.imread(image_path)
-    if img is None:
+    image = as_verification_image(image)
+    if image.rgb is None:
         return None, 0.0
     
-    rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    
-    with mp_face_detection.FaceDetection(
-        model_selection=0, min_detection_confidence=0.5
-    ) as face_detection:
+    # Detect on a capped resolution; the bbox is relative so it maps back as is
+    rgb_img = image.downscaled(LIVENESS_DETECTION_MAX_SIDE, "rgb")
+    with get_detector_pool().borrow() as face_detection:
         results = face_detection.process(rgb_img)
         
         if results.detections:
@@ -44,7 +112,7 @@ def detect_face(image_path):
             
             # Calculate bounding box
             bbox = detection.location_data.relative_bounding_box
-            h, w, _ = img.shape
+            h, w, _ = image.rgb.shape
             x = int(bbox.xmin * w)
             y = int(bbox.ymin * h)
             width = int(bbox.width * w)
@@ -54,14 +122,12 @@ def detect_face(image_path):
     
     return None, 0.0
 
-def check_image_quality(image_path):
+def check_image_quality(image):
     """Check image quality metrics"""
-    img = cv2.imread(image_path)
-    if img is None:
+    gray = as_verification_image(image).gray
+    if gray is None:
         return 0.0
     
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
     # Laplacian variance for blur detection
     laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
     
@@ -70,16 +136,17 @@ def check_image_quality(image_path):
     
     return quality_score
 
-def calculate_liveness_score(image_path):
+def calculate_liveness_score(image):
     """
     Calculate liveness score for selfie
     Returns score between 0-1
     """
+    image = as_verification_image(image)
     if not MEDIAPIPE_AVAILABLE:
         # Fallback: basic quality check
-        return check_image_quality(image_path)
+        return check_image_quality(image)
     
-    face_bbox, face_confidence = detect_face(image_path)
+    face_bbox, face_confidence = detect_face(image)
     
     if face_bbox is None:
         return 0.0
@@ -88,10 +155,14 @@ def calculate_liveness_score(image_path):
     liveness_score = face_confidence
     
     # Add quality score
-    quality_score = check_image_quality(image_path)
+    quality_score = check_image_quality(image)
     
     # Combined score (weighted average)
     final_score = (liveness_score * 0.7) + (quality_score * 0.3)
     
     return float(final_score)
 
+def warm_up():
+    """Build and warm the face detection graphs of this process"""
+    if MEDIAPIPE_AVAILABLE:
+        get_detector_pool()
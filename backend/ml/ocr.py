@@ -1,38 +1,180 @@
+import threading
 import cv2
 import numpy as np
+from ml.engines import get_engine
+from ml.image import as_verification_image
+from utils.fuzzy import is_ocr_match
+from config import (
+    OCR_ENGINE,
+    TESSDATA_PATH,
+    OCR_THRESHOLD,
+    OCR_CASCADE_MAX_SIDE,
+    OCR_ROI_ENABLED,
+    OCR_ROI_MAX_REGIONS,
+    OCR_ROI_LINE_HEIGHT,
+    OCR_EAST_MODEL,
+)
 try:
     import pytesseract
     TESSERACT_AVAILABLE = True
 except ImportError:
     TESSERACT_AVAILABLE = False
-    try:
-        from paddleocr import PaddleOCR
-        PADDLE_AVAILABLE = True
-    except ImportError:
-        PADDLE_AVAILABLE = False
+try:
+    from tesserocr import PyTessBaseAPI
+    TESSEROCR_AVAILABLE = True
+except ImportError:
+    TESSEROCR_AVAILABLE = False
+try:
+    from paddleocr import PaddleOCR
+    PADDLE_AVAILABLE = True
+except ImportError:
+    PADDLE_AVAILABLE = False
 
-def preprocess_image(image_path):
-    """Preprocess image for better OCR results"""
-    img = cv2.imread(image_path)
-    if img is None:
+# Cascade stages, cheapest first; "denoised" is the full preprocessing
+CASCADE_STAGES = ("roi", "downscaled", "threshold", "denoised") if OCR_ROI_ENABLED \
+    else ("downscaled", "threshold", "denoised")
+
+def _load_east():
+    model = cv2.dnn_TextDetectionModel_EAST(OCR_EAST_MODEL)
+    model.setConfidenceThreshold(0.5)
+    model.setNMSThreshold(0.4)
+    model.setInputParams(1.0, (320, 320), (123.68, 116.78, 103.94), True)
+    return model
+
+def _east_boxes(bgr):
+    """Word boxes from the EAST text detector (OpenCV DNN, CPU)"""
+    model = get_engine("east", _load_east)
+    rotated, _ = model.detectTextRectangles(bgr)
+    boxes = []
+    for rect in rotated:
+        points = cv2.boxPoints(rect).astype(np.int32)
+        boxes.append(cv2.boundingRect(points))
+    return boxes
+
+def _mser_boxes(gray):
+    """Character-like blobs from MSER, filtered by size and aspect ratio"""
+    height, width = gray.shape[:2]
+    mser = cv2.MSER_create()
+    mser.setMinArea(30)
+    mser.setMaxArea(int(height * width * 0.05))
+    _, bboxes = mser.detectRegions(gray)
+    boxes = []
+    for x, y, w, h in bboxes:
+        if h < 8 or h > height * 0.5:
+            continue
+        if not 0.1 <= w / float(h) <= 10:
+            continue
+        boxes.append((x, y, w, h))
+    return boxes
+
+def detect_text_regions(image, max_regions=OCR_ROI_MAX_REGIONS):
+    """
+    Locate candidate sign text lines. Character or word boxes (EAST when
+    OCR_EAST_MODEL is set, MSER otherwise) are found on a downscaled copy and
+    merged into lines. Returns (x, y, w, h) boxes in full-resolution pixels,
+    largest first.
+    """
+    image = as_verification_image(image)
+    if not image.is_valid:
+        return []
+    
+    small = image.downscaled(OCR_CASCADE_MAX_SIDE, "gray")
+    scale = image.gray.shape[1] / float(small.shape[1])
+    
+    if OCR_EAST_MODEL:
+        boxes = _east_boxes(cv2.cvtColor(small, cv2.COLOR_GRAY2BGR))
+    else:
+        boxes = _mser_boxes(small)
+    if not boxes:
+        return []
+    
+    # Merge neighbouring boxes into lines: paint them and close gaps horizontally
+    mask = np.zeros(small.shape[:2], dtype=np.uint8)
+    for x, y, w, h in boxes:
+        cv2.rectangle(mask, (x, y), (x + w, y + h), 255, -1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (25, 5))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    
+    regions = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w < 2 * h or w * h < 400:
+            # Text lines are wide; tall or tiny blobs are rocks, foliage, faces
+            continue
+        pad = int(h * 0.25)
+        regions.append((
+            int(max(x - pad, 0) * scale),
+            int(max(y - pad, 0) * scale),
+            int((w + 2 * pad) * scale),
+            int((h + 2 * pad) * scale),
+        ))
+    
+    regions.sort(key=lambda r: r[2] * r[3], reverse=True)
+    return regions[:max_regions]
+
+def crop_text_regions(image, regions, line_height=OCR_ROI_LINE_HEIGHT):
+    """
+    Crop `regions`, normalize each to `line_height` pixels tall, binarize and
+    stack them into one image so all regions go through a single OCR call.
+    """
+    gray = as_verification_image(image).gray
+    crops = []
+    for x, y, w, h in regions:
+        crop = gray[y:y + h, x:x + w]
+        if crop.size == 0:
+            continue
+        factor = min(line_height / float(crop.shape[0]), 4.0)
+        crop = cv2.resize(
+            crop, (max(int(crop.shape[1] * factor), 1), max(int(crop.shape[0] * factor), 1)),
+            interpolation=cv2.INTER_AREA if factor < 1 else cv2.INTER_CUBIC,
+        )
+        _, crop = cv2.threshold(crop, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        crops.append(crop)
+    
+    if not crops:
         return None
     
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gap = line_height // 2
+    width = max(crop.shape[1] for crop in crops) + 2 * gap
+    rows = [np.full((gap, width), 255, dtype=np.uint8)]
+    for crop in crops:
+        row = np.full((crop.shape[0], width), 255, dtype=np.uint8)
+        row[:, gap:gap + crop.shape[1]] = crop
+        rows.extend([row, np.full((gap, width), 255, dtype=np.uint8)])
+    return np.vstack(rows)
+
+def preprocess_variant(image, stage):
+    """Grayscale OCR input for one cascade stage, or None if it does not apply"""
+    image = as_verification_image(image)
+    if image.gray is None:
+        return None
+    
+    if stage == "roi":
+        regions = detect_text_regions(image)
+        return crop_text_regions(image, regions) if regions else None
+    
+    if stage == "downscaled":
+        return image.downscaled(OCR_CASCADE_MAX_SIDE, "gray")
     
     # Apply thresholding
-    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    _, thresh = cv2.threshold(image.gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    if stage == "threshold":
+        return thresh
     
     # Denoise
-    denoised = cv2.fastNlMeansDenoising(thresh, None, 10, 7, 21)
-    
-    return denoised
+    return cv2.fastNlMeansDenoising(thresh, None, 10, 7, 21)
+
+def preprocess_image(image):
+    """Preprocess image for better OCR results"""
+    return preprocess_variant(image, "denoised")
 
-def extract_text_tesseract(image_path):
+def extract_text_tesseract(image):
     """Extract text using Tesseract OCR"""
     if not TESSERACT_AVAILABLE:
         return ""
     
-    processed_img = preprocess_image(image_path)
+    processed_img = preprocess_image(image)
     if processed_img is None:
         return ""
     
@@ -43,14 +185,66 @@ def extract_text_tesseract(image_path):
         print(f"Tesseract OCR error: {e}")
         return ""
 
-def extract_text_paddle(image_path):
+def _load_tesserocr():
+    # One TessBaseAPI per process keeps eng.traineddata loaded between calls;
+    # the lock serializes callers when ML runs on threads (ML_WORKERS=0).
+    if TESSDATA_PATH:
+        api = PyTessBaseAPI(path=TESSDATA_PATH, lang='eng')
+    else:
+        api = PyTessBaseAPI(lang='eng')
+    return api, threading.Lock()
+
+def get_tesserocr_engine():
+    """Long-lived Tesseract API handle of this process"""
+    return get_engine("tesserocr", _load_tesserocr)
+
+def ocr_array_tesserocr(img):
+    """Run the in-process Tesseract API on a grayscale uint8 array"""
+    api, lock = get_tesserocr_engine()
+    img = np.ascontiguousarray(img, dtype=np.uint8)
+    height, width = img.shape[:2]
+    with lock:
+        # Raw pixel buffer straight into Tesseract: no temp file, no encoding
+        api.SetImageBytes(img.tobytes(), width, height, 1, width)
+        text = api.GetUTF8Text()
+        api.Clear()
+    return text
+
+def extract_text_tesserocr(image):
+    """Extract text using the in-process Tesseract binding, falling back to pytesseract"""
+    image = as_verification_image(image)
+    if not TESSEROCR_AVAILABLE:
+        return extract_text_tesseract(image)
+    
+    processed_img = preprocess_image(image)
+    if processed_img is None:
+        return ""
+    
+    try:
+        return ocr_array_tesserocr(processed_img).strip()
+    except Exception as e:
+        print(f"tesserocr error, falling back to pytesseract: {e}")
+        return extract_text_tesseract(image)
+
+def _load_paddle():
+    return PaddleOCR(use_angle_cls=True, lang='en', use_gpu=False)
+
+def get_paddle_engine():
+    """PaddleOCR engine of this process, loaded on first use"""
+    return get_engine("paddleocr", _load_paddle)
+
+def extract_text_paddle(image):
     """Extract text using PaddleOCR"""
     if not PADDLE_AVAILABLE:
         return ""
     
+    img = as_verification_image(image).bgr
+    if img is None:
+        return ""
+    
     try:
-        ocr = PaddleOCR(use_angle_cls=True, lang='en', use_gpu=False)
-        result = ocr.ocr(image_path, cls=True)
+        ocr = get_paddle_engine()
+        result = ocr.ocr(img, cls=True)
         
         if not result or not result[0]:
             return ""
@@ -65,17 +259,104 @@ def extract_text_paddle(image_path):
         print(f"PaddleOCR error: {e}")
         return ""
 
-def extract_text(image_path):
+def resolve_ocr_engine(preferred=OCR_ENGINE):
+    """Name of the OCR engine to use: the configured one, or the best installed"""
+    available = {
+        "tesserocr": TESSEROCR_AVAILABLE,
+        "pytesseract": TESSERACT_AVAILABLE,
+        "paddle": PADDLE_AVAILABLE,
+    }
+    if available.get(preferred):
+        return preferred
+    if preferred == "tesserocr" and TESSERACT_AVAILABLE:
+        return "pytesseract"
+    for name in ("tesserocr", "pytesseract", "paddle"):
+        if available[name]:
+            return name
+    return None
+
+ACTIVE_OCR_ENGINE = resolve_ocr_engine()
+
+# Result cache version: bump when preprocessing or engine settings change
+OCR_CACHE_VERSION = f"{ACTIVE_OCR_ENGINE}:2:{OCR_CASCADE_MAX_SIDE}:{'+'.join(CASCADE_STAGES)}"
+
+def warm_up():
+    """Load the active OCR engine so the first request is not cold"""
+    blank = np.full((32, 32), 255, dtype=np.uint8)
+    if OCR_ROI_ENABLED and OCR_EAST_MODEL:
+        get_engine("east", _load_east)
+    if ACTIVE_OCR_ENGINE == "tesserocr":
+        ocr_array_tesserocr(blank)
+    elif ACTIVE_OCR_ENGINE == "pytesseract":
+        pytesseract.image_to_string(blank, lang='eng')
+    elif ACTIVE_OCR_ENGINE == "paddle":
+        get_paddle_engine().ocr(cv2.cvtColor(blank, cv2.COLOR_GRAY2BGR), cls=True)
+
+def ocr_array(img):
+    """Run the active OCR engine on a preprocessed grayscale array"""
+    if ACTIVE_OCR_ENGINE == "tesserocr":
+        try:
+            return ocr_array_tesserocr(img).strip()
+        except Exception as e:
+            print(f"tesserocr error, falling back to pytesseract: {e}")
+            if not TESSERACT_AVAILABLE:
+                return ""
+    if ACTIVE_OCR_ENGINE in ("tesserocr", "pytesseract"):
+        return pytesseract.image_to_string(img, lang='eng').strip()
+    if ACTIVE_OCR_ENGINE == "paddle":
+        result = get_paddle_engine().ocr(cv2.cvtColor(img, cv2.COLOR_GRAY2BGR), cls=True)
+        if not result or not result[0]:
+            return ""
+        return " ".join(line[1][0] for line in result[0] if line and len(line) > 1)
+    return ""
+
+def extract_text_cascade(image, expected_text, threshold=OCR_THRESHOLD):
+    """
+    OCR cheap preprocessing variants first and stop at the first one whose text
+    matches `expected_text`. Returns {text, score, is_match, stage}; when no
+    stage matches, the best-scoring stage is returned.
+    """
+    image = as_verification_image(image)
+    best = {"text": "", "score": 0.0, "is_match": False, "stage": None}
+    if not image.is_valid:
+        return best
+    
+    for stage in CASCADE_STAGES:
+        try:
+            processed_img = preprocess_variant(image, stage)
+        except cv2.error as e:
+            print(f"OCR preprocessing error at cascade stage {stage}: {e}")
+            continue
+        if processed_img is None:
+            continue
+        try:
+            text = ocr_array(processed_img)
+        except Exception as e:
+            print(f"OCR error at cascade stage {stage}: {e}")
+            continue
+        
+        is_match, score = is_ocr_match(text, expected_text, threshold)
+        if best["stage"] is None or score > best["score"]:
+            best = {"text": text, "score": score, "is_match": is_match, "stage": stage}
+        if is_match:
+            break
+    
+    return best
+
+def extract_text(image):
     """
-    Extract text from image using available OCR engine
+    Extract text from image using the configured OCR engine
+    `image` is a VerificationImage, encoded bytes or a file path
     Returns extracted text string
     """
-    if TESSERACT_AVAILABLE:
-        return extract_text_tesseract(image_path)
-    elif PADDLE_AVAILABLE:
-        return extract_text_paddle(image_path)
+    if ACTIVE_OCR_ENGINE == "tesserocr":
+        return extract_text_tesserocr(image)
+    elif ACTIVE_OCR_ENGINE == "pytesseract":
+        return extract_text_tesseract(image)
+    elif ACTIVE_OCR_ENGINE == "paddle":
+        return extract_text_paddle(image)
     else:
         # Fallback: return empty string
-        print("Warning: No OCR engine available. Install pytesseract or paddleocr")
+        print("Warning: No OCR engine available. Install tesserocr, pytesseract or paddleocr")
         return ""
 
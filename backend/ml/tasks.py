@@ -0,0 +1,19 @@
+"""
+Entry points the verification pipeline runs in the ML process pool.
+
+Tasks take a VerificationImage, so every stage that looks at the same upload
+shares one decode inside the worker process.
+"""
+
+from ml.image import as_verification_image
+from ml.liveness import calculate_liveness_score
+from ml.face_match import extract_face_embedding
+
+
+def analyze_selfie(image, with_liveness=True, with_embedding=False):
+    """Liveness score and face embedding of one selfie from a single decode"""
+    image = as_verification_image(image)
+    return {
+        "liveness_score": calculate_liveness_score(image) if with_liveness else None,
+        "embedding": extract_face_embedding(image) if with_embedding else None,
+    }
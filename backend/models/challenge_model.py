@@ -26,6 +26,8 @@ class Challenge(BaseModel):
     description: str
     checkpoints: List[Checkpoint]
     route_points: List[RoutePoint] = []
+    route_length_m: float = 0.0  # computed from route_points
+    route_levels: List[dict] = []  # Douglas-Peucker levels per zoom (encoded polylines)
     created_by: str
     created_at: datetime = datetime.utcnow()
     is_active: bool = True
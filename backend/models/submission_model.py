@@ -1,37 +1,55 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from datetime import datetime
 from bson import ObjectId
 
 class OCRResult(BaseModel):
     extracted_text: str
     match_score: float
+    stage: Optional[str] = None  # preprocessing variant that produced the text
+    best_checkpoint_id: Optional[str] = None  # set when the text matches another checkpoint better
+    best_checkpoint_score: Optional[float] = None
+    wrong_checkpoint: bool = False
 
 class GPSResult(BaseModel):
     distance: float
     is_valid: bool
+    nearest_checkpoint_id: Optional[str] = None
+    nearest_checkpoint_distance: Optional[float] = None
 
 class FaceResult(BaseModel):
     liveness_score: float
     is_valid: bool
     match_score: Optional[float] = None
+    other_matches: Optional[List[dict]] = None  # other accounts this face matches
 
 class Submission(BaseModel):
     id: Optional[str] = None
     user_id: str
     challenge_id: str
     checkpoint_id: str
-    photo_path: str
+    photo_path: Optional[str] = None  # None for GPS pre-check rejections (unless kept for audit)
     selfie_path: Optional[str] = None
+    photo_blob: Optional[str] = None  # blob id (SHA-256) in the upload store
+    photo_size: Optional[int] = None
+    photo_work_blob: Optional[str] = None  # oriented, metadata-free, size-capped copy read by ML
+    photo_thumb_blob: Optional[str] = None  # WebP thumbnail for admin lists
+    selfie_blob: Optional[str] = None
+    selfie_size: Optional[int] = None
+    selfie_work_blob: Optional[str] = None
+    selfie_thumb_blob: Optional[str] = None
     gps_latitude: float
     gps_longitude: float
+    nearest_checkpoint: Optional[dict] = None  # {checkpoint_id, distance} at submission time
     status: str = "pending"  # pending, verified, rejected, pending_admin
+    rejection_stage: Optional[str] = None  # "gps_precheck" when rejected before storage/ML
     ocr: Optional[OCRResult] = None
     gps: Optional[GPSResult] = None
     face: Optional[FaceResult] = None
     points_awarded: int = 0
     created_at: datetime = datetime.utcnow()
     verified_at: Optional[datetime] = None
+    job: Optional[dict] = None  # verification queue state
 
 class SubmissionCreate(BaseModel):
     challenge_id: str
@@ -39,3 +57,13 @@ class SubmissionCreate(BaseModel):
     gps_latitude: float
     gps_longitude: float
 
+class DirectUploadRequest(BaseModel):
+    sha256: str = Field(pattern="^[0-9a-f]{64}$")  # hex SHA-256 of the exact bytes to upload
+    size: int = Field(gt=0)
+    ext: str = Field("jpg", pattern="^(jpg|jpeg|png|webp|heic)$")
+
+class GPSPrecheckRequest(BaseModel):
+    challenge_id: str
+    checkpoint_id: str
+    gps_latitude: float
+    gps_longitude: float
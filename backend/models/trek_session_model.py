@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 
@@ -14,6 +14,11 @@ class TrekSession(BaseModel):
     cancel_reason: Optional[str] = None
     checkpoints_completed: int = 0
     total_checkpoints: int = 0
+    track_points: int = 0
+    track_distance_m: float = 0.0
+    pace_s_per_km: Optional[float] = None
+    last_position: Optional[dict] = None  # {latitude, longitude}
+    last_fix_at: Optional[datetime] = None
 
 
 class TrekSessionStart(BaseModel):
@@ -22,3 +27,8 @@ class TrekSessionStart(BaseModel):
 
 class TrekSessionCancel(BaseModel):
     reason: Optional[str] = None
+
+
+class TrekTrackBatch(BaseModel):
+    # [t (epoch seconds), latitude, longitude, accuracy?, altitude?] per fix
+    fixes: List[List[Optional[float]]]
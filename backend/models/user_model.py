@@ -18,7 +18,7 @@ class User(BaseModel):
     password_hash: str
     role: str = "user"  # "user" or "admin"
     face_consent: bool = False
-    face_embedding: Optional[list] = None
+    face_embedding: Optional[bytes] = None  # BSON binary, see ml.face_match.encode_embedding
     created_at: datetime = datetime.utcnow()
     points: int = 0
     badges: List[dict] = []  # list of { badge_id, earned_at, challenge_id?, challenge_title? }
@@ -7,6 +7,13 @@ from pydantic import BaseModel
 from models.challenge_model import Challenge, ChallengeCreate, ChallengeUpdate
 from routers.auth import get_current_user
 from db import get_database
+from utils.polyline import route_fields
+from utils.geo_index import sync_challenge_checkpoints, remove_challenge_checkpoints
+from utils.storage import release_submission_blobs
+from ml.cache import result_cache
+from routers.media import media_url
+from ml.face_index import get_face_index
+from config import FACE_MATCH_THRESHOLD, FACE_SEARCH_TOP_K
 
 class RejectRequest(BaseModel):
     reason: Optional[str] = None
@@ -37,6 +44,11 @@ async def get_admin_stats(admin_user: dict = Depends(verify_admin)):
         "verified_submissions": verified_submissions,
     }
 
+@router.get("/ml/cache")
+async def get_ml_cache_stats(admin_user: dict = Depends(verify_admin)):
+    """ML result cache size and hit/miss counters for this API process"""
+    return result_cache.report()
+
 @router.get("/users")
 async def get_all_users(admin_user: dict = Depends(verify_admin)):
     """Get all users"""
@@ -47,9 +59,41 @@ async def get_all_users(admin_user: dict = Depends(verify_admin)):
         user["_id"] = str(user["_id"])
         # Remove password hash
         user.pop("password_hash", None)
+        user["face_enrolled"] = user.pop("face_embedding", None) is not None
         users.append(user)
     return users
 
+@router.get("/users/{user_id}/face-matches")
+async def get_face_matches(
+    user_id: str,
+    k: int = Query(FACE_SEARCH_TOP_K, ge=1, le=50),
+    threshold: float = Query(FACE_MATCH_THRESHOLD, ge=0.0, le=1.0),
+    admin_user: dict = Depends(verify_admin)
+):
+    """Other accounts whose enrolled face matches this user's (duplicate accounts)"""
+    db = get_database()
+    
+    if not ObjectId.is_valid(user_id):
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+    
+    user = await db.users.find_one({"_id": ObjectId(user_id)}, {"face_embedding": 1})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if user.get("face_embedding") is None:
+        raise HTTPException(status_code=400, detail="User has no enrolled face")
+    
+    matches = get_face_index().search(user["face_embedding"], k=k, threshold=threshold, exclude=user_id)
+    
+    results = []
+    for other_id, score in matches:
+        other = await db.users.find_one({"_id": ObjectId(other_id)}, {"username": 1})
+        results.append({
+            "user_id": other_id,
+            "username": other["username"] if other else "Unknown",
+            "score": score,
+        })
+    return results
+
 @router.get("/submissions")
 async def get_all_submissions(
     status: Optional[str] = None,
@@ -72,10 +116,42 @@ async def get_all_submissions(
         submission["id"] = str(submission["_id"])
         submission["_id"] = str(submission["_id"])
         submission["username"] = user["username"] if user else "Unknown"
+        # Lists load thumbnails; the full image is one variant away
+        submission["photo_thumb_url"] = media_url(submission["id"], "photo") if submission.get("photo_path") else None
+        submission["selfie_thumb_url"] = media_url(submission["id"], "selfie") if submission.get("selfie_path") else None
         submissions.append(submission)
     
     return submissions
 
+@router.get("/trek-events")
+async def get_trek_events(
+    since: Optional[datetime] = None,
+    session_id: Optional[str] = None,
+    type: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    admin_user: dict = Depends(verify_admin)
+):
+    """
+    Live trek alerts (off_route, geofence_enter/exit, stalled, ...), newest first.
+    Poll with `since` set to the newest `created_at` already seen.
+    """
+    db = get_database()
+    
+    query = {}
+    if since:
+        query["created_at"] = {"$gt": since}
+    if session_id:
+        query["session_id"] = session_id
+    if type:
+        query["type"] = type
+    
+    events = []
+    async for event in db.trek_events.find(query).sort("created_at", -1).limit(limit):
+        event["id"] = str(event["_id"])
+        event["_id"] = str(event["_id"])
+        events.append(event)
+    return events
+
 @router.put("/submissions/{submission_id}/approve")
 async def approve_submission(
     submission_id: str,
@@ -155,6 +231,33 @@ async def reject_submission(
     updated["_id"] = str(updated["_id"])
     return updated
 
+@router.delete("/submissions/{submission_id}")
+async def delete_submission(
+    submission_id: str,
+    admin_user: dict = Depends(verify_admin)
+):
+    """Delete a submission, its points and its images (once no other submission shares them)"""
+    db = get_database()
+    
+    if not ObjectId.is_valid(submission_id):
+        raise HTTPException(status_code=400, detail="Invalid submission ID")
+    
+    # The queue job lives on the document, so this also drops a pending verification
+    submission = await db.submissions.find_one_and_delete({"_id": ObjectId(submission_id)})
+    if not submission:
+        raise HTTPException(status_code=404, detail="Submission not found")
+    
+    # points_pending: the verification job had not handed the points out yet
+    if submission.get("points_awarded") and not submission.get("points_pending"):
+        await db.users.update_one(
+            {"_id": ObjectId(submission["user_id"])},
+            {"$inc": {"points": -submission["points_awarded"]}}
+        )
+    
+    # Blobs are collected after BLOB_GC_GRACE_SECONDS once unreferenced
+    await release_submission_blobs(submission)
+    return {"message": "Submission deleted successfully"}
+
 @router.post("/challenges", response_model=dict)
 async def create_challenge(
     challenge_data: ChallengeCreate,
@@ -184,6 +287,7 @@ async def create_challenge(
             "description": challenge_data.description,
             "checkpoints": checkpoints_list,
             "route_points": route_points_list,
+            **route_fields(route_points_list),
             "created_by": str(admin_user["_id"]),
             "created_at": datetime.now(timezone.utc),
             "is_active": True,
@@ -192,6 +296,7 @@ async def create_challenge(
         
         result = await db.challenges.insert_one(challenge_dict)
         challenge_dict["_id"] = result.inserted_id
+        await sync_challenge_checkpoints(challenge_dict)
         
         # Convert ObjectId to string for JSON serialization
         challenge_dict["id"] = str(result.inserted_id)
@@ -243,6 +348,7 @@ async def update_challenge(
             else:
                 route_points_list.append(rp.dict())
         update_dict["route_points"] = route_points_list
+        update_dict.update(route_fields(route_points_list))
     if challenge_data.is_active is not None:
         update_dict["is_active"] = challenge_data.is_active
     if challenge_data.points_per_checkpoint is not None:
@@ -254,6 +360,8 @@ async def update_challenge(
     )
     
     updated = await db.challenges.find_one({"_id": ObjectId(challenge_id)})
+    if "checkpoints" in update_dict or "is_active" in update_dict:
+        await sync_challenge_checkpoints(updated)
     updated["id"] = str(updated["_id"])
     updated["_id"] = str(updated["_id"])
     return updated
@@ -272,6 +380,7 @@ async def delete_challenge(
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Challenge not found")
     
+    await remove_challenge_checkpoints(challenge_id)
     return {"message": "Challenge deleted successfully"}
 
 @router.get("/challenges")
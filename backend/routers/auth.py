@@ -1,15 +1,17 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 import bcrypt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from bson import ObjectId
 
 from models.user_model import User, UserCreate, UserLogin, UserResponse
 from pydantic import BaseModel
 from db import get_database
-from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, MAX_UPLOAD_BYTES
 from ml.face_match import extract_face_embedding
+from ml.executor import run_ml
+from ml.face_index import get_face_index
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
@@ -166,3 +168,26 @@ async def award_badge(
     )
     return {"awarded": True, "badge_id": badge_id}
 
+
+@router.post("/me/face", response_model=dict)
+async def enroll_face(
+    selfie: UploadFile = File(...),
+    current_user: dict = Depends(get_current_user),
+):
+    """Enroll (or replace) the reference face used to match checkpoint selfies."""
+    if not current_user.get("face_consent"):
+        raise HTTPException(status_code=400, detail="Face matching consent required")
+    # Not stored, only embedded; still bounded like stored uploads
+    content = await selfie.read(MAX_UPLOAD_BYTES + 1)
+    if len(content) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+    embedding = await run_ml(extract_face_embedding, content)
+    if embedding is None:
+        raise HTTPException(status_code=422, detail="No face detected or face model unavailable")
+    db = get_database()
+    await db.users.update_one(
+        {"_id": current_user["_id"]},
+        {"$set": {"face_embedding": embedding, "face_enrolled_at": datetime.now(timezone.utc)}},
+    )
+    get_face_index().add(str(current_user["_id"]), embedding)
+    return {"enrolled": True}
@@ -1,5 +1,5 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import List, Optional
 from datetime import datetime, timezone
 from bson import ObjectId
 
@@ -7,17 +7,45 @@ from models.challenge_model import Challenge, ChallengeCreate
 from routers.auth import get_current_user
 from db import get_database
 from utils.badges import get_badges_to_award, BADGE_CATALOG
+from utils.geo_index import checkpoints_near
+from utils.polyline import apply_route_encoding, route_fields, ROUTE_ENCODINGS
+from config import NEARBY_DEFAULT_RADIUS, NEARBY_MAX_RADIUS
 
 router = APIRouter(prefix="/api/challenges", tags=["challenges"])
 
 
+ROUTE_ENCODING_PATTERN = f"^({'|'.join(ROUTE_ENCODINGS)})$"
+
+
+async def _backfill_route_levels(db, challenge_id):
+    """Store levels for a challenge written before they existed (see migrate_routes.py)"""
+    stored = await db.challenges.find_one({"_id": challenge_id}, {"route_points": 1})
+    fields = route_fields((stored or {}).get("route_points") or [])
+    await db.challenges.update_one(
+        {"_id": challenge_id, "route_levels": {"$exists": False}},
+        {"$set": fields},
+    )
+    return fields
+
+
 @router.get("", response_model=List[dict])
-async def get_challenges():
+async def get_challenges(
+    route_encoding: Optional[str] = Query(None, pattern=ROUTE_ENCODING_PATTERN),
+    zoom: Optional[int] = Query(None, ge=0, le=22),
+):
+    """
+    Active challenges. Routes come back simplified for `zoom` (coarsest level by
+    default) as an encoded polyline unless `route_encoding` asks otherwise.
+    """
     db = get_database()
     challenges = []
-    async for challenge in db.challenges.find({"is_active": True}):
+    # The full track is never needed for a list; simplified levels are stored
+    async for challenge in db.challenges.find({"is_active": True}, {"route_points": 0}):
+        if "route_levels" not in challenge:
+            challenge.update(await _backfill_route_levels(db, challenge["_id"]))
         challenge["id"] = str(challenge["_id"])
         challenge["_id"] = str(challenge["_id"])
+        apply_route_encoding(challenge, route_encoding or "polyline", zoom)
         challenges.append(challenge)
     return challenges
 
@@ -28,8 +56,47 @@ async def get_badges_catalog():
     return BADGE_CATALOG
 
 
+@router.get("/nearby", response_model=List[dict])
+async def get_nearby_challenges(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius: float = Query(NEARBY_DEFAULT_RADIUS, gt=0, le=NEARBY_MAX_RADIUS),
+):
+    """Active challenges with a checkpoint within `radius` meters, nearest first"""
+    db = get_database()
+
+    # Checkpoints come back nearest first, so the first hit per challenge is its closest
+    nearest = {}
+    for entry, distance in await checkpoints_near(lat, lon, radius):
+        nearest.setdefault(entry["challenge_id"], (entry, distance))
+    if not nearest:
+        return []
+
+    ids = [ObjectId(challenge_id) for challenge_id in nearest if ObjectId.is_valid(challenge_id)]
+    challenges = []
+    async for challenge in db.challenges.find(
+        {"_id": {"$in": ids}, "is_active": True},
+        {"route_points": 0, "route_levels": 0},
+    ):
+        entry, distance = nearest[str(challenge["_id"])]
+        challenge["id"] = str(challenge["_id"])
+        challenge["_id"] = str(challenge["_id"])
+        challenge["nearest_checkpoint"] = {
+            "checkpoint_id": entry["checkpoint_id"],
+            "title": entry["title"],
+            "distance": distance,
+        }
+        challenges.append(challenge)
+    challenges.sort(key=lambda c: c["nearest_checkpoint"]["distance"])
+    return challenges
+
+
 @router.get("/{challenge_id}", response_model=dict)
-async def get_challenge(challenge_id: str):
+async def get_challenge(
+    challenge_id: str,
+    route_encoding: Optional[str] = Query(None, pattern=ROUTE_ENCODING_PATTERN),
+    zoom: Optional[int] = Query(None, ge=0, le=22),
+):
     db = get_database()
     
     if not ObjectId.is_valid(challenge_id):
@@ -41,7 +108,8 @@ async def get_challenge(challenge_id: str):
     
     challenge["id"] = str(challenge["_id"])
     challenge["_id"] = str(challenge["_id"])
-    return challenge
+    # Full route_points by default; `zoom`/`route_encoding` return a simplified level
+    return apply_route_encoding(challenge, route_encoding or "points", zoom, full=True)
 
 
 @router.post("/{challenge_id}/safe-exit", response_model=dict)
@@ -0,0 +1,180 @@
+"""
+Authenticated access to submission photos and selfies.
+
+Files are served by blob id, so the content behind a URL never changes: the
+ETag is the blob's SHA-256, responses are cacheable forever (private, since
+they need a token) and a matching If-None-Match gets 304 without touching the
+disk. Full responses go through FileResponse, which hands the file to the
+server's zero-copy path when it offers one; single byte ranges are streamed
+in chunks from a worker thread. With object storage the client is redirected
+to a short-lived presigned GET, so image bytes never pass through the API node.
+"""
+
+import asyncio
+import mimetypes
+import os
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse, RedirectResponse
+from bson import ObjectId
+
+from routers.auth import get_current_user
+from db import get_database
+from utils.storage import blob_path
+from utils.storage_backends import blob_key, get_storage_backend
+from config import BASE_DIR, UPLOAD_CHUNK_SIZE
+
+router = APIRouter(prefix="/api/media", tags=["media"])
+
+MEDIA_KINDS = ("photo", "selfie")
+# Preferred blob field per variant, with fallbacks when a derivative is missing
+VARIANT_FIELDS = {
+    "thumb": ("thumb_blob", "work_blob", "blob"),
+    "work": ("work_blob", "blob"),
+    "original": ("blob",),
+}
+VARIANT_TYPES = {"thumb": "image/webp", "work": "image/jpeg"}
+IMMUTABLE = "private, max-age=31536000, immutable"
+
+
+def media_url(submission_id: str, kind: str, variant: str = "thumb") -> str:
+    return f"/api/media/submissions/{submission_id}/{kind}?variant={variant}"
+
+
+def _resolve(submission: dict, kind: str, variant: str):
+    """(blob id or None, file path, variant actually served) for the requested variant"""
+    for field in VARIANT_FIELDS[variant]:
+        blob_id = submission.get(f"{kind}_{field}")
+        if blob_id:
+            served = "original" if field == "blob" else field.split("_")[0]
+            return blob_id, blob_path(blob_id), served
+    # Stored before the blob store existed
+    if submission.get(f"{kind}_path"):
+        return None, BASE_DIR / submission[f"{kind}_path"], "original"
+    return None, None, None
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def _parse_range(header: str, size: int):
+    """(start, end) inclusive for a single `bytes=` range, None if unsupported, raises 416"""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(size - int(last), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+
+def _read_chunk(path, offset: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+async def _stream_range(path, start: int, end: int):
+    offset = start
+    while offset <= end:
+        chunk = await asyncio.to_thread(_read_chunk, path, offset, min(UPLOAD_CHUNK_SIZE, end - offset + 1))
+        if not chunk:
+            break
+        offset += len(chunk)
+        yield chunk
+
+
+@router.get("/submissions/{submission_id}/{kind}")
+async def get_submission_media(
+    submission_id: str,
+    kind: str,
+    request: Request,
+    variant: str = Query("original", pattern="^(thumb|work|original)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Photo or selfie of a submission: `variant` thumb (WebP), work (normalized JPEG) or original"""
+    db = get_database()
+
+    if kind not in MEDIA_KINDS:
+        raise HTTPException(status_code=404, detail="Unknown media kind")
+    if not ObjectId.is_valid(submission_id):
+        raise HTTPException(status_code=400, detail="Invalid submission ID")
+
+    submission = await db.submissions.find_one({"_id": ObjectId(submission_id)})
+    if not submission:
+        raise HTTPException(status_code=404, detail="Submission not found")
+
+    if submission["user_id"] != str(current_user["_id"]) and current_user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    blob_id, path, served = _resolve(submission, kind, variant)
+    if path is None and blob_id is None:
+        raise HTTPException(status_code=404, detail="No such media")
+
+    if blob_id is None:
+        media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        # Legacy file: no content hash, let FileResponse derive validators from mtime/size
+        if not path.exists():
+            raise HTTPException(status_code=404, detail="Media file missing")
+        return FileResponse(path, media_type=media_type)
+
+    etag = f'"{blob_id}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE, "Accept-Ranges": "bytes"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    media_type = VARIANT_TYPES.get(served)
+    if media_type is None:
+        # Originals keep the extension they were uploaded with
+        blob = await db.blobs.find_one({"_id": blob_id}, {"ext": 1})
+        media_type = mimetypes.guess_type(f"file.{(blob or {}).get('ext', 'jpg')}")[0] or "application/octet-stream"
+
+    if path is None:
+        # Object storage serves the bytes (and ranges) itself; the redirect must not be cached
+        url = await asyncio.to_thread(get_storage_backend().presign_get, blob_key(blob_id), media_type)
+        return RedirectResponse(url, status_code=307, headers={"Cache-Control": "no-store"})
+
+    try:
+        size = (await asyncio.to_thread(os.stat, path)).st_size
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Media file missing")
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = _parse_range(range_header, size)
+        if byte_range:
+            start, end = byte_range
+            return StreamingResponse(
+                _stream_range(path, start, end),
+                status_code=206,
+                media_type=media_type,
+                headers={
+                    **headers,
+                    "Content-Range": f"bytes {start}-{end}/{size}",
+                    "Content-Length": str(end - start + 1),
+                },
+            )
+
+    return FileResponse(path, media_type=media_type, headers=headers)
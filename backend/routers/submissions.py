@@ -1,34 +1,66 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, Query
+import asyncio
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, Query, Response
 from typing import Optional, List
 from datetime import datetime, timezone
 from bson import ObjectId
 
-from models.submission_model import Submission, SubmissionCreate
+from models.submission_model import Submission, SubmissionCreate, DirectUploadRequest, GPSPrecheckRequest
 from routers.auth import get_current_user
 from db import get_database
-from utils.storage import save_photo, save_selfie
+from utils.storage import (
+    save_photo,
+    save_selfie,
+    release_blob,
+    presign_upload,
+    adopt_uploaded_blob,
+    blob_location,
+)
+from utils.resumable import finish_upload, discard_upload
+from utils.geo_index import nearest_checkpoint_lookup
 from utils.gps import is_gps_valid
-from utils.fuzzy import is_ocr_match
-from ml.ocr import extract_text
-from ml.liveness import calculate_liveness_score
-from ml.face_match import extract_face_embedding, match_faces
-from config import OCR_THRESHOLD, LIVENESS_THRESHOLD, FACE_MATCH_THRESHOLD
+from jobs.queue import new_job_state, enqueue_verification, get_worker_pool
+from config import VERIFICATION_MAX_WAIT, VERIFICATION_POLL_INTERVAL, KEEP_REJECTED_UPLOADS
 
 router = APIRouter(prefix="/api/submissions", tags=["submissions"])
 
-@router.post("", response_model=dict)
-async def create_submission(
-    challenge_id: str = Form(...),
-    checkpoint_id: str = Form(...),
-    gps_latitude: float = Form(...),
-    gps_longitude: float = Form(...),
-    photo: UploadFile = File(...),
-    selfie: Optional[UploadFile] = File(None),
+@router.post("/uploads", response_model=dict)
+async def create_direct_upload(
+    request: DirectUploadRequest,
     current_user: dict = Depends(get_current_user)
 ):
+    """
+    Presigned PUT for uploading an image straight to object storage.
+    Pass the returned `blob_id` as `photo_blob_id`/`selfie_blob_id` to POST /api/submissions
+    once the PUT is done.
+    """
+    return await presign_upload(request.sha256, request.size, request.ext, str(current_user["_id"]))
+
+def _public_submission(submission: dict):
+    """Client view of a submission: of its queue job, only the state"""
+    submission["id"] = str(submission["_id"])
+    submission["_id"] = str(submission["_id"])
+    job = submission.get("job")
+    submission["job"] = {"state": job["state"]} if job else None
+    return submission
+
+async def _store_image(
+    file: Optional[UploadFile], blob_id: Optional[str], upload_id: Optional[str], user_id: str, save
+):
+    """
+    (path, blob id, size) of an image sent in the form, uploaded directly to
+    object storage, or finished through a resumable upload (/api/uploads)
+    """
+    if upload_id:
+        blob_id, size, _ = await finish_upload(upload_id, user_id)
+        return blob_location(blob_id), blob_id, size
+    if blob_id:
+        blob_id, size = await adopt_uploaded_blob(blob_id, user_id)
+        return blob_location(blob_id), blob_id, size
+    return await save(file, user_id)
+
+async def _find_checkpoint(challenge_id: str, checkpoint_id: str):
+    """Checkpoint of a challenge, or 400/404"""
     db = get_database()
-    
-    # Validate challenge and checkpoint
     if not ObjectId.is_valid(challenge_id):
         raise HTTPException(status_code=400, detail="Invalid challenge ID")
     
@@ -36,158 +68,214 @@ async def create_submission(
     if not challenge:
         raise HTTPException(status_code=404, detail="Challenge not found")
     
-    checkpoint = None
     for cp in challenge["checkpoints"]:
         if cp["checkpoint_id"] == checkpoint_id:
-            checkpoint = cp
-            break
-    
-    if not checkpoint:
-        raise HTTPException(status_code=404, detail="Checkpoint not found")
-    
-    user_id = str(current_user["_id"])
-    
-    # Save files
-    photo_path = await save_photo(photo, user_id)
-    selfie_path = None
-    if selfie:
-        selfie_path = await save_selfie(selfie, user_id)
-    
-    # Create submission document
-    submission_dict = {
-        "user_id": user_id,
-        "challenge_id": challenge_id,
-        "checkpoint_id": checkpoint_id,
-        "photo_path": photo_path,
-        "selfie_path": selfie_path,
-        "gps_latitude": gps_latitude,
-        "gps_longitude": gps_longitude,
-        "status": "pending",
-        "ocr": None,
-        "gps": None,
-        "face": None,
-        "points_awarded": 0,
-        "created_at": datetime.now(timezone.utc),
-        "verified_at": None
-    }
-    
-    result = await db.submissions.insert_one(submission_dict)
-    submission_id = str(result.inserted_id)
-    
-    # Run verification immediately
-    await verify_submission(submission_id, checkpoint, current_user, challenge)
-    
-    # Fetch updated submission
-    updated = await db.submissions.find_one({"_id": ObjectId(submission_id)})
-    updated["id"] = str(updated["_id"])
-    updated["_id"] = str(updated["_id"])
+            return cp
+    raise HTTPException(status_code=404, detail="Checkpoint not found")
+
+@router.post("/precheck", response_model=dict)
+async def precheck_submission(
+    request: GPSPrecheckRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    The GPS pre-check of POST /api/submissions, without uploading anything.
+    Clients run it before uploading images so out-of-radius attempts cost no upload.
+    """
+    checkpoint = await _find_checkpoint(request.challenge_id, request.checkpoint_id)
+    if not checkpoint.get("gps_required", True):
+        return {"is_valid": True, "distance": None, "gps_radius": None}
     
-    return updated
+    radius = checkpoint.get("gps_radius", 50.0)
+    is_valid, distance = is_gps_valid(
+        checkpoint["latitude"],
+        checkpoint["longitude"],
+        request.gps_latitude,
+        request.gps_longitude,
+        radius
+    )
+    return {"is_valid": bool(is_valid), "distance": float(distance), "gps_radius": radius}
 
-async def verify_submission(submission_id: str, checkpoint: dict, user: dict, challenge: dict):
-    """Run verification pipeline for submission"""
+@router.post("", response_model=dict, status_code=202)
+async def create_submission(
+    response: Response,
+    challenge_id: str = Form(...),
+    checkpoint_id: str = Form(...),
+    gps_latitude: float = Form(...),
+    gps_longitude: float = Form(...),
+    photo: Optional[UploadFile] = File(None),
+    selfie: Optional[UploadFile] = File(None),
+    photo_blob_id: Optional[str] = Form(None),  # from POST /api/submissions/uploads
+    selfie_blob_id: Optional[str] = Form(None),
+    photo_upload_id: Optional[str] = Form(None),  # finished resumable upload
+    selfie_upload_id: Optional[str] = Form(None),
+    current_user: dict = Depends(get_current_user)
+):
     db = get_database()
-    submission = await db.submissions.find_one({"_id": ObjectId(submission_id)})
     
-    if not submission:
-        return
-    
-    from config import BASE_DIR
+    checkpoint = await _find_checkpoint(challenge_id, checkpoint_id)
     
-    photo_full_path = BASE_DIR / submission["photo_path"]
-    selfie_full_path = BASE_DIR / submission["selfie_path"] if submission.get("selfie_path") else None
+    user_id = str(current_user["_id"])
     
-    verification_results = {
-        "ocr": None,
-        "gps": None,
-        "face": None,
-        "status": "pending",
-        "points_awarded": 0
-    }
+    # Closest checkpoint of this challenge to the reported position (2dsphere index)
+    nearest = await nearest_checkpoint_lookup(gps_latitude, gps_longitude, challenge_id=challenge_id)
+    nearest = nearest and {"checkpoint_id": nearest["checkpoint_id"], "distance": nearest["distance"]}
     
-    # 1. GPS Validation
+    # GPS pre-check: out-of-radius attempts never reach storage or ML
     if checkpoint.get("gps_required", True):
         is_valid, distance = is_gps_valid(
             checkpoint["latitude"],
             checkpoint["longitude"],
-            submission["gps_latitude"],
-            submission["gps_longitude"],
+            gps_latitude,
+            gps_longitude,
             checkpoint.get("gps_radius", 50.0)
         )
-        verification_results["gps"] = {
-            "distance": distance,
-            "is_valid": is_valid
-        }
-        
         if not is_valid:
-            verification_results["status"] = "rejected"
-            await db.submissions.update_one(
-                {"_id": ObjectId(submission_id)},
-                {"$set": verification_results}
+            response.status_code = 200
+            return await record_rejected_attempt(
+                user_id, challenge_id, checkpoint_id, gps_latitude, gps_longitude,
+                distance, nearest, photo, selfie, photo_blob_id, selfie_blob_id,
+                photo_upload_id, selfie_upload_id,
             )
-            return
     
-    # 2. OCR Validation
-    if checkpoint.get("require_photo", True):
-        extracted_text = extract_text(str(photo_full_path))
-        is_match, score = is_ocr_match(extracted_text, checkpoint["expected_sign_text"], OCR_THRESHOLD)
-        
-        verification_results["ocr"] = {
-            "extracted_text": extracted_text,
-            "match_score": score
-        }
-        
-        if not is_match:
-            verification_results["status"] = "pending_admin"
+    # Checked after the GPS pre-check: clients that ran POST /precheck send
+    # out-of-radius attempts without images
+    if not photo and not photo_blob_id and not photo_upload_id:
+        raise HTTPException(status_code=400, detail="Photo is required")
     
-    # 3. Liveness Validation (if selfie required)
-    if checkpoint.get("require_selfie", False) and selfie_full_path:
-        liveness_score = calculate_liveness_score(str(selfie_full_path))
-        is_valid = liveness_score >= LIVENESS_THRESHOLD
+    # Save files into the content-addressed store (identical images share a blob).
+    # The working copy and thumbnail are made by the verification job.
+    taken = []
+    try:
+        photo_path, photo_blob, photo_size = await _store_image(photo, photo_blob_id, photo_upload_id, user_id, save_photo)
+        taken.append(photo_blob)
         
-        verification_results["face"] = {
-            "liveness_score": liveness_score,
-            "is_valid": is_valid
-        }
-        
-        if not is_valid:
-            verification_results["status"] = "pending_admin"
-    
-    # 4. Face Matching (if user consented)
-    if user.get("face_consent") and selfie_full_path and user.get("face_embedding"):
-        new_embedding = extract_face_embedding(str(selfie_full_path))
-        if new_embedding:
-            is_match, match_score = match_faces(
-                user["face_embedding"],
-                new_embedding,
-                FACE_MATCH_THRESHOLD
+        selfie_path, selfie_blob, selfie_size = None, None, None
+        if selfie or selfie_blob_id or selfie_upload_id:
+            selfie_path, selfie_blob, selfie_size = await _store_image(
+                selfie, selfie_blob_id, selfie_upload_id, user_id, save_selfie
             )
-            if verification_results["face"]:
-                verification_results["face"]["match_score"] = match_score
-            else:
-                verification_results["face"] = {
-                    "liveness_score": 0.0,
-                    "is_valid": False,
-                    "match_score": match_score
-                }
-    
-    # 5. Final decision
-    if verification_results["status"] == "pending":
-        verification_results["status"] = "verified"
-        verification_results["points_awarded"] = challenge.get("points_per_checkpoint", 10)
-        verification_results["verified_at"] = datetime.now(timezone.utc)
+            taken.append(selfie_blob)
         
-        # Update user points
-        await db.users.update_one(
-            {"_id": ObjectId(user["_id"])},
-            {"$inc": {"points": verification_results["points_awarded"]}}
-        )
+        # Create submission document
+        submission_dict = {
+            "user_id": user_id,
+            "challenge_id": challenge_id,
+            "checkpoint_id": checkpoint_id,
+            "photo_path": photo_path,
+            "selfie_path": selfie_path,
+            "photo_blob": photo_blob,
+            "photo_size": photo_size,
+            "photo_work_blob": None,  # set by the verification job
+            "photo_thumb_blob": None,
+            "selfie_blob": selfie_blob,
+            "selfie_size": selfie_size,
+            "selfie_work_blob": None,
+            "selfie_thumb_blob": None,
+            "gps_latitude": gps_latitude,
+            "gps_longitude": gps_longitude,
+            "nearest_checkpoint": nearest,
+            "status": "pending",
+            "ocr": None,
+            "gps": None,
+            "face": None,
+            "points_awarded": 0,
+            "created_at": datetime.now(timezone.utc),
+            "verified_at": None,
+            "job": new_job_state()
+        }
+        
+        result = await db.submissions.insert_one(submission_dict)
+    except Exception:
+        for blob_id in taken:
+            await release_blob(blob_id)
+        raise
+    submission_id = str(result.inserted_id)
     
-    # Update submission
-    await db.submissions.update_one(
-        {"_id": ObjectId(submission_id)},
-        {"$set": verification_results}
-    )
+    # Verification runs in the background; clients poll GET /api/submissions/{id}
+    await enqueue_verification(submission_id)
+    
+    return _public_submission(submission_dict)
+
+async def record_rejected_attempt(
+    user_id: str,
+    challenge_id: str,
+    checkpoint_id: str,
+    gps_latitude: float,
+    gps_longitude: float,
+    distance: float,
+    nearest: Optional[dict],
+    photo: Optional[UploadFile],
+    selfie: Optional[UploadFile],
+    photo_blob_id: Optional[str] = None,
+    selfie_blob_id: Optional[str] = None,
+    photo_upload_id: Optional[str] = None,
+    selfie_upload_id: Optional[str] = None,
+):
+    """
+    Store a submission rejected by the GPS pre-check: one insert, no queue job,
+    and no images unless KEEP_REJECTED_UPLOADS asks for them
+    """
+    db = get_database()
+    now = datetime.now(timezone.utc)
+    
+    photo_path = selfie_path = photo_blob = selfie_blob = None
+    taken = []
+    if KEEP_REJECTED_UPLOADS:
+        try:
+            if photo or photo_blob_id or photo_upload_id:
+                photo_path, photo_blob, _ = await _store_image(photo, photo_blob_id, photo_upload_id, user_id, save_photo)
+                taken.append(photo_blob)
+            if selfie or selfie_blob_id or selfie_upload_id:
+                selfie_path, selfie_blob, _ = await _store_image(
+                    selfie, selfie_blob_id, selfie_upload_id, user_id, save_selfie
+                )
+                taken.append(selfie_blob)
+        except Exception:
+            for blob_id in taken:
+                await release_blob(blob_id)
+            raise
+    else:
+        # Resumable uploads are not needed anymore; free their partial files now
+        for upload_id in (photo_upload_id, selfie_upload_id):
+            if upload_id:
+                await discard_upload(upload_id, user_id)
+    
+    gps = {"distance": distance, "is_valid": False}
+    if nearest:
+        gps["nearest_checkpoint_id"] = nearest["checkpoint_id"]
+        gps["nearest_checkpoint_distance"] = nearest["distance"]
+    
+    attempt = {
+        "user_id": user_id,
+        "challenge_id": challenge_id,
+        "checkpoint_id": checkpoint_id,
+        "photo_path": photo_path,
+        "selfie_path": selfie_path,
+        "photo_blob": photo_blob,
+        "selfie_blob": selfie_blob,
+        "gps_latitude": gps_latitude,
+        "gps_longitude": gps_longitude,
+        "nearest_checkpoint": nearest,
+        "status": "rejected",
+        "rejection_stage": "gps_precheck",
+        "ocr": None,
+        "gps": gps,
+        "face": None,
+        "points_awarded": 0,
+        "created_at": now,
+        "verified_at": now,
+        "job": None
+    }
+    try:
+        result = await db.submissions.insert_one(attempt)
+    except Exception:
+        for blob_id in taken:
+            await release_blob(blob_id)
+        raise
+    attempt["id"] = str(result.inserted_id)
+    attempt["_id"] = str(result.inserted_id)
+    return attempt
 
 @router.get("", response_model=List[dict])
 async def get_submissions(
@@ -206,17 +294,17 @@ async def get_submissions(
     
     submissions = []
     async for submission in db.submissions.find(query).sort("created_at", -1):
-        submission["id"] = str(submission["_id"])
-        submission["_id"] = str(submission["_id"])
-        submissions.append(submission)
+        submissions.append(_public_submission(submission))
     
     return submissions
 
 @router.get("/{submission_id}", response_model=dict)
 async def get_submission(
     submission_id: str,
+    wait: float = Query(0, ge=0, le=VERIFICATION_MAX_WAIT),
     current_user: dict = Depends(get_current_user)
 ):
+    """Get a submission. With `wait`, long-poll until verification finishes"""
     db = get_database()
     
     if not ObjectId.is_valid(submission_id):
@@ -230,7 +318,33 @@ async def get_submission(
     if submission["user_id"] != str(current_user["_id"]) and current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Access denied")
     
-    submission["id"] = str(submission["_id"])
-    submission["_id"] = str(submission["_id"])
-    return submission
+    if wait and submission["status"] == "pending":
+        submission = await wait_for_verification(submission_id, wait) or submission
+    
+    return _public_submission(submission)
 
+
+async def wait_for_verification(submission_id: str, timeout: float):
+    """
+    Wait for the verification job of a submission to finish.
+    Jobs finished by this process wake the waiter immediately; jobs handled by
+    another API node are picked up by re-reading the document periodically.
+    """
+    db = get_database()
+    pool = get_worker_pool()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return None
+        step = min(remaining, VERIFICATION_POLL_INTERVAL * 2)
+        if pool:
+            await pool.wait_for(submission_id, step)
+        else:
+            await asyncio.sleep(step)
+        
+        submission = await db.submissions.find_one({"_id": ObjectId(submission_id)})
+        if not submission or submission["status"] != "pending":
+            return submission
@@ -3,9 +3,11 @@ from typing import List, Optional
 from datetime import datetime, timezone
 from bson import ObjectId
 
-from models.trek_session_model import TrekSession, TrekSessionStart, TrekSessionCancel
+from models.trek_session_model import TrekSession, TrekSessionStart, TrekSessionCancel, TrekTrackBatch
 from routers.auth import get_current_user
 from db import get_database
+from utils.tracks import record_track, TRACK_STATE_FIELDS, TrackUpdateConflict
+from config import TRACK_MAX_FIXES_PER_BATCH
 
 router = APIRouter(prefix="/api/trek-sessions", tags=["trek-sessions"])
 
@@ -109,6 +111,55 @@ async def cancel_trek(
     return updated
 
 
+@router.post("/{session_id}/track", response_model=dict)
+async def upload_track(
+    session_id: str,
+    batch: TrekTrackBatch,
+    current_user: dict = Depends(get_current_user)
+):
+    """Record a batch of GPS fixes for an active trek session"""
+    db = get_database()
+    user_id = str(current_user["_id"])
+
+    if not ObjectId.is_valid(session_id):
+        raise HTTPException(status_code=400, detail="Invalid session ID")
+
+    if len(batch.fixes) > TRACK_MAX_FIXES_PER_BATCH:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {TRACK_MAX_FIXES_PER_BATCH} fixes per batch",
+        )
+
+    session = await db.trek_sessions.find_one({"_id": ObjectId(session_id)}, TRACK_STATE_FIELDS)
+    if not session:
+        raise HTTPException(status_code=404, detail="Trek session not found")
+
+    if session["user_id"] != user_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    if session["status"] != "active":
+        raise HTTPException(status_code=400, detail="Trek session is not active")
+
+    try:
+        updated, accepted, rejected, duplicates, events = await record_track(session, batch.fixes)
+    except TrackUpdateConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if updated is None:
+        raise HTTPException(status_code=400, detail="Trek session is not active")
+
+    return {
+        "accepted": accepted,
+        "rejected": rejected,
+        "duplicates": duplicates,  # already stored, e.g. a retried batch
+        "track_points": updated.get("track_points", 0),
+        "track_distance_m": updated.get("track_distance_m", 0.0),
+        "pace_s_per_km": updated.get("pace_s_per_km"),
+        "last_position": updated.get("last_position"),
+        "last_fix_at": updated.get("last_fix_at"),
+        "events": [event["type"] for event in events],
+    }
+
+
 @router.get("/active", response_model=Optional[dict])
 async def get_active_trek(
     challenge_id: Optional[str] = None,
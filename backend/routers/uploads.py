@@ -0,0 +1,91 @@
+"""
+Resumable photo uploads, following the tus 1.0 core protocol:
+
+- POST /api/uploads with `Upload-Length` creates an upload (201, `Location`)
+- PATCH /api/uploads/{id} with `Upload-Offset` and a
+  `application/offset+octet-stream` body appends bytes (204, new `Upload-Offset`)
+- HEAD /api/uploads/{id} returns the current `Upload-Offset` to resume from
+- DELETE /api/uploads/{id} abandons it
+
+Finished uploads are used by passing their id to POST /api/submissions.
+"""
+
+from datetime import timezone
+from email.utils import format_datetime
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request, Response
+
+from routers.auth import get_current_user
+from utils.resumable import create_upload, get_upload, append_chunk, discard_upload
+
+router = APIRouter(prefix="/api/uploads", tags=["uploads"])
+
+TUS_VERSION = "1.0.0"
+OFFSET_CONTENT_TYPE = "application/offset+octet-stream"
+
+
+def _upload_headers(upload: dict):
+    # Mongo returns naive datetimes in UTC
+    expires_at = upload["expires_at"].replace(tzinfo=timezone.utc)
+    return {
+        "Tus-Resumable": TUS_VERSION,
+        "Upload-Offset": str(upload["offset"]),
+        "Upload-Length": str(upload["length"]),
+        "Upload-Expires": format_datetime(expires_at, usegmt=True),
+        "Cache-Control": "no-store",
+    }
+
+
+@router.post("", status_code=201)
+async def create_resumable_upload(
+    response: Response,
+    upload_length: int = Header(...),
+    ext: str = Query("jpg", pattern="^(jpg|jpeg|png|webp|heic)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Start a resumable upload of `Upload-Length` bytes"""
+    upload = await create_upload(str(current_user["_id"]), upload_length, ext)
+    response.headers.update(_upload_headers(upload))
+    response.headers["Location"] = f"/api/uploads/{upload['_id']}"
+    return {
+        "upload_id": upload["_id"],
+        "offset": 0,
+        "length": upload["length"],
+        "expires_at": upload["expires_at"],
+    }
+
+
+@router.head("/{upload_id}")
+async def get_upload_offset(
+    upload_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Offset to resume from"""
+    upload = await get_upload(upload_id, str(current_user["_id"]))
+    return Response(status_code=200, headers=_upload_headers(upload))
+
+
+@router.patch("/{upload_id}")
+async def append_upload(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(...),
+    content_type: str = Header(...),
+    current_user: dict = Depends(get_current_user)
+):
+    """Append the body at `Upload-Offset`; bytes received before a dropped connection are kept"""
+    if content_type.split(";")[0].strip() != OFFSET_CONTENT_TYPE:
+        raise HTTPException(status_code=415, detail=f"Content-Type must be {OFFSET_CONTENT_TYPE}")
+
+    upload = await get_upload(upload_id, str(current_user["_id"]))
+    upload = await append_chunk(upload, upload_offset, request.stream())
+    return Response(status_code=204, headers=_upload_headers(upload))
+
+
+@router.delete("/{upload_id}", status_code=204)
+async def delete_upload(
+    upload_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    if not await discard_upload(upload_id, str(current_user["_id"])):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return Response(status_code=204, headers={"Tus-Resumable": TUS_VERSION})
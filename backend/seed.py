@@ -8,6 +8,7 @@ from bson import ObjectId
 
 from db import connect_db, get_database
 from routers.auth import get_password_hash
+from utils.polyline import route_fields
 from config import DATABASE_NAME
 
 
@@ -254,6 +255,9 @@ async def create_sample_challenges():
         }
     ]
     
+    for challenge in challenges_data:
+        challenge.update(route_fields(challenge.get("route_points") or []))
+
     # Insert challenges
     result = await db.challenges.insert_many(challenges_data)
     print(f"✅ Created {len(result.inserted_ids)} challenges:")
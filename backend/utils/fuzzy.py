@@ -1,4 +1,10 @@
-from rapidfuzz import fuzz
+from collections import OrderedDict
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
+
+# Preprocessed sign texts per challenge: challenge_id -> (signature, checkpoint_ids, choices)
+_sign_tables = OrderedDict()
+SIGN_TABLE_CACHE_SIZE = 256
 
 def token_set_ratio(text1, text2):
     """
@@ -15,7 +21,50 @@ def is_ocr_match(extracted_text, expected_text, threshold=70.0):
     score = token_set_ratio(extracted_text, expected_text)
     return score >= threshold, score
 
+def get_sign_table(challenge):
+    """
+    Checkpoint ids and preprocessed sign texts of a challenge, cached per
+    challenge and rebuilt when its sign texts change
+    """
+    signature = tuple(
+        (cp["checkpoint_id"], cp.get("expected_sign_text", ""))
+        for cp in challenge.get("checkpoints", [])
+    )
+    key = str(challenge.get("_id") or challenge.get("id"))
+    cached = _sign_tables.get(key)
+    if cached and cached[0] == signature:
+        _sign_tables.move_to_end(key)
+        return cached[1], cached[2]
+
+    checkpoint_ids = [cp_id for cp_id, _ in signature]
+    choices = [default_process(text) for _, text in signature]
+    _sign_tables[key] = (signature, checkpoint_ids, choices)
+    if len(_sign_tables) > SIGN_TABLE_CACHE_SIZE:
+        _sign_tables.popitem(last=False)
+    return checkpoint_ids, choices
 
+def match_checkpoints(extracted_text, challenge):
+    """
+    Score the OCR text against every checkpoint sign of a challenge in one
+    vectorized call. Each OCR line and the whole text are compared with every
+    sign text; a checkpoint's score is its best line.
+    Returns {best_checkpoint_id, best_score, scores: {checkpoint_id: score}}
+    """
+    checkpoint_ids, choices = get_sign_table(challenge)
+    result = {"best_checkpoint_id": None, "best_score": 0.0, "scores": {}}
+    if not choices or not extracted_text:
+        return result
 
+    queries = [default_process(line) for line in extracted_text.splitlines() if line.strip()]
+    queries.append(default_process(extracted_text))
 
+    matrix = process.cdist(queries, choices, scorer=fuzz.token_set_ratio, processor=None)
+    best_per_checkpoint = matrix.max(axis=0)
+    best = int(best_per_checkpoint.argmax())
 
+    result["best_checkpoint_id"] = checkpoint_ids[best]
+    result["best_score"] = float(best_per_checkpoint[best])
+    result["scores"] = {
+        cp_id: float(score) for cp_id, score in zip(checkpoint_ids, best_per_checkpoint)
+    }
+    return result
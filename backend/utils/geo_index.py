@@ -0,0 +1,234 @@
+"""
+Spatial index of every challenge checkpoint.
+
+Checkpoints are flattened into the `checkpoint_locations` collection (one
+GeoJSON point per checkpoint, 2dsphere indexed) whenever a challenge is
+written. Each API process also keeps an in-memory grid of the same points,
+reloaded periodically, so "challenges near me" and nearest-checkpoint lookups
+only look at the few grid cells around the query instead of scanning every
+challenge document.
+"""
+
+import math
+import time
+from collections import defaultdict
+
+import numpy as np
+from pymongo import ASCENDING, GEOSPHERE
+
+from db import get_database
+from utils.gps import distances_to_points, EARTH_RADIUS
+from config import GEO_GRID_CELL_DEGREES, GEO_GRID_MAX_QUERY_CELLS, GEO_INDEX_REFRESH_SECONDS
+
+
+class GridIndex:
+    """
+    Points bucketed into fixed lat/lon cells for radius queries.
+    Longitude cells wrap around the date line.
+    """
+
+    def __init__(self, cell_degrees=GEO_GRID_CELL_DEGREES, max_query_cells=GEO_GRID_MAX_QUERY_CELLS):
+        self.cell_degrees = cell_degrees
+        self.max_query_cells = max_query_cells
+        self._lon_cells = int(math.ceil(360.0 / cell_degrees))
+        self._cells = defaultdict(list)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _cell(self, lat, lon):
+        lon_cell = int(math.floor(lon / self.cell_degrees)) % self._lon_cells
+        return int(math.floor(lat / self.cell_degrees)), lon_cell
+
+    def add(self, lat, lon, item):
+        self._cells[self._cell(lat, lon)].append((lat, lon, item))
+        self._size += 1
+
+    def query_radius(self, lat, lon, radius):
+        """
+        [(item, distance)] within `radius` meters, nearest first, or None when
+        the lookup would scan more than `max_query_cells` (near the poles)
+        """
+        lat_span = math.degrees(radius / EARTH_RADIUS)
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        lon_span = min(lat_span / cos_lat, 180.0)
+        lat_min = int(math.floor((lat - lat_span) / self.cell_degrees))
+        lat_max = int(math.floor((lat + lat_span) / self.cell_degrees))
+        lon_min = int(math.floor((lon - lon_span) / self.cell_degrees))
+        lon_max = int(math.floor((lon + lon_span) / self.cell_degrees))
+        lon_count = min(lon_max - lon_min + 1, self._lon_cells)
+        if (lat_max - lat_min + 1) * lon_count > self.max_query_cells:
+            return None
+
+        candidates = []
+        for cell_lat in range(lat_min, lat_max + 1):
+            for cell_lon in range(lon_min, lon_min + lon_count):
+                candidates.extend(self._cells.get((cell_lat, cell_lon % self._lon_cells), ()))
+        if not candidates:
+            return []
+
+        lats = np.fromiter((c[0] for c in candidates), dtype=np.float64, count=len(candidates))
+        lons = np.fromiter((c[1] for c in candidates), dtype=np.float64, count=len(candidates))
+        distances = distances_to_points(lat, lon, lats, lons)
+        order = np.argsort(distances)
+        return [
+            (candidates[i][2], float(distances[i])) for i in order if distances[i] <= radius
+        ]
+
+
+def checkpoint_location_docs(challenge):
+    """Flattened checkpoint documents for one challenge"""
+    challenge_id = str(challenge["_id"])
+    return [
+        {
+            "_id": f"{challenge_id}:{cp['checkpoint_id']}",
+            "challenge_id": challenge_id,
+            "checkpoint_id": cp["checkpoint_id"],
+            "title": cp.get("title", ""),
+            "gps_radius": cp.get("gps_radius", 50.0),
+            "is_active": challenge.get("is_active", True),
+            "location": {"type": "Point", "coordinates": [cp["longitude"], cp["latitude"]]},
+        }
+        for cp in challenge.get("checkpoints", [])
+    ]
+
+
+_grid = None
+_loaded_at = 0.0
+
+
+async def setup_checkpoint_index():
+    """Create indexes and reconcile the flattened collection with the challenges"""
+    db = get_database()
+    await db.checkpoint_locations.create_index([("location", GEOSPHERE)])
+    await db.checkpoint_locations.create_index([("challenge_id", ASCENDING)])
+    repaired = await reconcile_checkpoint_locations()
+    if repaired:
+        print(f"Checkpoint index: repaired {repaired} challenge(s)")
+    await reload_checkpoint_grid()
+
+
+async def _write_challenge_checkpoints(db, challenge):
+    challenge_id = str(challenge["_id"])
+    await db.checkpoint_locations.delete_many({"challenge_id": challenge_id})
+    docs = checkpoint_location_docs(challenge)
+    if docs:
+        await db.checkpoint_locations.insert_many(docs)
+
+
+async def reconcile_checkpoint_locations():
+    """
+    Rewrite the flattened checkpoints of every challenge whose documents differ
+    from its challenge (e.g. an edit that died between the two writes, or
+    challenges written by another tool) and drop those of deleted challenges.
+    Returns the number of challenges repaired.
+    """
+    db = get_database()
+    stored = defaultdict(dict)
+    async for doc in db.checkpoint_locations.find({}):
+        stored[doc["challenge_id"]][doc["_id"]] = doc
+
+    repaired = 0
+    async for challenge in db.challenges.find({}, {"checkpoints": 1, "is_active": 1}):
+        expected = {doc["_id"]: doc for doc in checkpoint_location_docs(challenge)}
+        if stored.pop(str(challenge["_id"]), {}) != expected:
+            await _write_challenge_checkpoints(db, challenge)
+            repaired += 1
+
+    if stored:
+        await db.checkpoint_locations.delete_many({"challenge_id": {"$in": list(stored)}})
+        repaired += len(stored)
+    return repaired
+
+
+async def sync_challenge_checkpoints(challenge):
+    """Rewrite the flattened checkpoints of a created or updated challenge"""
+    await _write_challenge_checkpoints(get_database(), challenge)
+    await reload_checkpoint_grid()
+
+
+async def remove_challenge_checkpoints(challenge_id: str):
+    db = get_database()
+    await db.checkpoint_locations.delete_many({"challenge_id": challenge_id})
+    await reload_checkpoint_grid()
+
+
+async def reload_checkpoint_grid():
+    """Rebuild this process's grid from the flattened collection"""
+    global _grid, _loaded_at
+    db = get_database()
+    grid = GridIndex()
+    projection = {"challenge_id": 1, "checkpoint_id": 1, "title": 1, "is_active": 1, "location": 1}
+    async for doc in db.checkpoint_locations.find({}, projection):
+        lon, lat = doc["location"]["coordinates"]
+        grid.add(lat, lon, {
+            "challenge_id": doc["challenge_id"],
+            "checkpoint_id": doc["checkpoint_id"],
+            "title": doc.get("title", ""),
+            "is_active": doc.get("is_active", True),
+        })
+    _grid = grid
+    _loaded_at = time.monotonic()
+    return grid
+
+
+async def get_checkpoint_grid():
+    """The in-process grid, reloaded when older than GEO_INDEX_REFRESH_SECONDS"""
+    if _grid is None or time.monotonic() - _loaded_at > GEO_INDEX_REFRESH_SECONDS:
+        return await reload_checkpoint_grid()
+    return _grid
+
+
+async def _checkpoints_near_index(lat, lon, radius, active_only):
+    """checkpoints_near through `$geoNear`, for lookups too wide for the grid"""
+    db = get_database()
+    geo_near = {
+        "near": {"type": "Point", "coordinates": [lon, lat]},
+        "distanceField": "distance",
+        "spherical": True,
+        "maxDistance": radius,
+    }
+    if active_only:
+        geo_near["query"] = {"is_active": True}
+    results = []
+    async for doc in db.checkpoint_locations.aggregate([{"$geoNear": geo_near}]):
+        results.append(({
+            "challenge_id": doc["challenge_id"],
+            "checkpoint_id": doc["checkpoint_id"],
+            "title": doc.get("title", ""),
+            "is_active": doc.get("is_active", True),
+        }, doc["distance"]))
+    return results
+
+
+async def checkpoints_near(lat, lon, radius, active_only=True):
+    """[(checkpoint entry, distance)] within `radius` meters, nearest first"""
+    grid = await get_checkpoint_grid()
+    nearby = grid.query_radius(lat, lon, radius)
+    if nearby is None:
+        return await _checkpoints_near_index(lat, lon, radius, active_only)
+    return [
+        (entry, distance) for entry, distance in nearby
+        if entry["is_active"] or not active_only
+    ]
+
+
+async def nearest_checkpoint_lookup(lat, lon, challenge_id=None, max_distance=None):
+    """
+    Nearest checkpoint from the 2dsphere index, optionally within one challenge
+    Returns the flattened checkpoint document with `distance` in meters, or None
+    """
+    db = get_database()
+    geo_near = {
+        "near": {"type": "Point", "coordinates": [lon, lat]},
+        "distanceField": "distance",
+        "spherical": True,
+    }
+    if challenge_id:
+        geo_near["query"] = {"challenge_id": challenge_id}
+    if max_distance is not None:
+        geo_near["maxDistance"] = max_distance
+    async for doc in db.checkpoint_locations.aggregate([{"$geoNear": geo_near}, {"$limit": 1}]):
+        return doc
+    return None
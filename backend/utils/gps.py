@@ -1,4 +1,7 @@
 import math
+import numpy as np
+
+EARTH_RADIUS = 6371000  # meters
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     """
@@ -19,13 +22,121 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     
     return R * c
 
+def haversine_many(lat1, lon1, lat2, lon2):
+    """
+    Vectorized haversine over NumPy arrays (any broadcastable shapes)
+    Returns distances in meters
+    """
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    delta_phi = phi2 - phi1
+    delta_lambda = np.radians(np.asarray(lon2) - np.asarray(lon1))
+
+    a = np.sin(delta_phi / 2) ** 2 + \
+        np.cos(phi1) * np.cos(phi2) * np.sin(delta_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def distances_to_points(lat, lon, lats, lons):
+    """Distances in meters from one point to N points"""
+    return haversine_many(lat, lon, np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64))
+
+def pairwise_distances(lats1, lons1, lats2, lons2):
+    """N x M matrix of distances between two point sets"""
+    lats1 = np.asarray(lats1, dtype=np.float64)[:, None]
+    lons1 = np.asarray(lons1, dtype=np.float64)[:, None]
+    return haversine_many(lats1, lons1, np.asarray(lats2, dtype=np.float64)[None, :],
+                          np.asarray(lons2, dtype=np.float64)[None, :])
+
+def segment_lengths(lats, lons):
+    """Distances between consecutive track points (N-1 values)"""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if lats.size < 2:
+        return np.zeros(0)
+    return haversine_many(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+def cumulative_distance(lats, lons):
+    """Distance along the track at every point, starting at 0"""
+    return np.concatenate(([0.0], np.cumsum(segment_lengths(lats, lons))))
+
+def path_length(lats, lons):
+    """Total length of a track in meters"""
+    return float(segment_lengths(lats, lons).sum())
+
+def to_local_xy(lats, lons, ref_lat, ref_lon):
+    """
+    Equirectangular projection to meters around a reference point.
+    Accurate to well under a meter over the few kilometers of a trail section.
+    """
+    scale = np.radians(1.0) * EARTH_RADIUS
+    x = (np.asarray(lons, dtype=np.float64) - ref_lon) * scale * math.cos(math.radians(ref_lat))
+    y = (np.asarray(lats, dtype=np.float64) - ref_lat) * scale
+    return x, y
+
+def point_to_polyline_distance(lat, lon, lats, lons):
+    """
+    Shortest distance from a point to a polyline, projecting onto every segment at once
+    Returns (distance_m, segment_index, fraction_along_segment)
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if lats.size == 0:
+        return float("inf"), -1, 0.0
+    if lats.size == 1:
+        return float(distances_to_points(lat, lon, lats, lons)[0]), 0, 0.0
+
+    x, y = to_local_xy(lats, lons, lat, lon)
+    ax, ay = x[:-1], y[:-1]
+    dx, dy = x[1:] - ax, y[1:] - ay
+    length_sq = dx * dx + dy * dy
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.where(length_sq > 0, -(ax * dx + ay * dy) / length_sq, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    px, py = ax + t * dx, ay + t * dy
+    dist = np.hypot(px, py)
+
+    index = int(dist.argmin())
+    return float(dist[index]), index, float(t[index])
+
+def route_arrays(route_points):
+    """Latitude and longitude arrays from [{latitude, longitude}, ...]"""
+    if not route_points:
+        return np.zeros(0), np.zeros(0)
+    coords = np.array([(p["latitude"], p["longitude"]) for p in route_points], dtype=np.float64)
+    return coords[:, 0], coords[:, 1]
+
+def route_length(route_points):
+    """Length in meters of a challenge route"""
+    return path_length(*route_arrays(route_points))
+
+def distance_from_route(lat, lon, route_points):
+    """Off-route distance in meters of a position from a challenge route"""
+    return point_to_polyline_distance(lat, lon, *route_arrays(route_points))[0]
+
+def nearest_checkpoint(lat, lon, checkpoints):
+    """
+    Closest checkpoint to a position
+    Returns (checkpoint, distance) or (None, inf)
+    """
+    if not checkpoints:
+        return None, float("inf")
+    lats = [cp["latitude"] for cp in checkpoints]
+    lons = [cp["longitude"] for cp in checkpoints]
+    distances = distances_to_points(lat, lon, lats, lons)
+    index = int(distances.argmin())
+    return checkpoints[index], float(distances[index])
+
 def is_gps_valid(checkpoint_lat, checkpoint_lon, user_lat, user_lon, radius):
     """
     Check if user is within the required radius of checkpoint
+    Accepts scalars or arrays (e.g. N checkpoints with N radii)
     Returns (is_valid, distance)
     """
-    distance = haversine_distance(checkpoint_lat, checkpoint_lon, user_lat, user_lon)
-    return distance <= radius, distance
+    if np.ndim(checkpoint_lat) == 0 and np.ndim(user_lat) == 0:
+        distance = haversine_distance(checkpoint_lat, checkpoint_lon, user_lat, user_lon)
+        return distance <= radius, distance
+    distance = haversine_many(checkpoint_lat, checkpoint_lon, user_lat, user_lon)
+    return distance <= np.asarray(radius), distance
 
 
 
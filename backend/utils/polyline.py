@@ -0,0 +1,172 @@
+"""
+Route simplification and compact encodings for challenge payloads.
+
+The full GPX-derived track stays in `route_points`; admin writes also store
+Douglas-Peucker simplified levels (one per map zoom, see ROUTE_ZOOM_LEVELS)
+as Google encoded polylines in `route_levels`. API responses pick a level and
+an encoding:
+
+- "polyline": Google encoded polyline string (1e-5 degree precision)
+- "varint": zigzag delta-varint bytes of the same integer coordinates, base64url
+- "points": [{latitude, longitude}, ...] as stored
+"""
+
+import base64
+
+import numpy as np
+
+from utils.gps import to_local_xy, route_arrays, route_length
+from config import ROUTE_ZOOM_LEVELS
+
+POLYLINE_PRECISION = 1e5
+ROUTE_ENCODINGS = ("polyline", "varint", "points", "none")
+
+
+def douglas_peucker(lats, lons, tolerance):
+    """
+    Indices of the points kept by Douglas-Peucker at `tolerance` meters.
+    Iterative, and each split scores all interior points of a span at once.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    n = lats.size
+    if n <= 2:
+        return np.arange(n)
+
+    x, y = to_local_xy(lats, lons, lats[0], lons[0])
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        px, py = x[start + 1:end], y[start + 1:end]
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        length = np.hypot(dx, dy)
+        if length > 0:
+            dist = np.abs(dy * (px - x[start]) - dx * (py - y[start])) / length
+        else:
+            dist = np.hypot(px - x[start], py - y[start])
+        index = int(dist.argmax())
+        if dist[index] > tolerance:
+            split = start + 1 + index
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.flatnonzero(keep)
+
+
+def _deltas(lats, lons):
+    coords = np.round(np.column_stack((lats, lons)) * POLYLINE_PRECISION).astype(np.int64)
+    return np.diff(coords, axis=0, prepend=0).ravel()
+
+
+def encode_polyline(lats, lons) -> str:
+    """Google encoded polyline of a track"""
+    out = []
+    for value in _deltas(lats, lons).tolist():
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            out.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        out.append(chr(value + 63))
+    return "".join(out)
+
+
+def decode_polyline(encoded: str):
+    """(lats, lons) arrays from a Google encoded polyline"""
+    values = []
+    value = shift = 0
+    for char in encoded:
+        chunk = ord(char) - 63
+        value |= (chunk & 0x1F) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    coords = np.cumsum(np.array(values, dtype=np.int64).reshape(-1, 2), axis=0) / POLYLINE_PRECISION
+    return coords[:, 0], coords[:, 1]
+
+
+def encode_varint(lats, lons) -> str:
+    """Zigzag delta-varint (LEB128) of a track, base64url without padding"""
+    out = bytearray()
+    for value in _deltas(lats, lons).tolist():
+        value = (value << 1) ^ (value >> 63)
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return base64.urlsafe_b64encode(bytes(out)).rstrip(b"=").decode("ascii")
+
+
+def build_route_levels(route_points):
+    """Simplified levels of a route, coarsest first, stored on the challenge"""
+    lats, lons = route_arrays(route_points)
+    levels = []
+    for zoom, tolerance in sorted(ROUTE_ZOOM_LEVELS.items()):
+        kept = douglas_peucker(lats, lons, tolerance)
+        levels.append({
+            "zoom": zoom,
+            "tolerance_m": tolerance,
+            "point_count": int(kept.size),
+            "polyline": encode_polyline(lats[kept], lons[kept]),
+        })
+    return levels
+
+
+def route_fields(route_points):
+    """Derived route fields written alongside `route_points`"""
+    return {
+        "route_length_m": route_length(route_points),
+        "route_levels": build_route_levels(route_points),
+    }
+
+
+def select_route_level(levels, zoom=None):
+    """The most detailed level drawn at `zoom` (coarsest when zoom is None)"""
+    if not levels:
+        return None
+    if zoom is None:
+        return levels[0]
+    eligible = [level for level in levels if level["zoom"] <= zoom]
+    return eligible[-1] if eligible else levels[0]
+
+
+def apply_route_encoding(challenge, encoding, zoom=None, full=False):
+    """
+    Replace the route fields of a challenge document in place.
+    `full` keeps the stored `route_points` for encoding="points" when no zoom
+    is given (the detail view); otherwise a simplified level is used.
+    """
+    levels = challenge.pop("route_levels", None) or []
+    if encoding == "points" and full and zoom is None:
+        return challenge
+
+    route_points = challenge.pop("route_points", None)
+    if encoding == "none":
+        return challenge
+
+    level = select_route_level(levels, zoom)
+    if level is None:
+        if not route_points:
+            return challenge
+        # Challenge written before levels existed: simplify on the fly
+        level = build_route_levels(route_points)[0]
+
+    lats, lons = decode_polyline(level["polyline"])
+    if encoding == "points":
+        challenge["route_points"] = [
+            {"latitude": float(lat), "longitude": float(lon)} for lat, lon in zip(lats, lons)
+        ]
+        challenge["route_zoom"] = level["zoom"]
+        return challenge
+
+    challenge["route"] = {
+        "encoding": encoding,
+        "zoom": level["zoom"],
+        "point_count": level["point_count"],
+        "data": level["polyline"] if encoding == "polyline" else encode_varint(lats, lons),
+    }
+    return challenge
@@ -0,0 +1,282 @@
+"""
+Resumable (tus-style) uploads for photos sent over poor connections.
+
+A client creates an upload with its total length, then PATCHes bytes at the
+current offset. Bytes are appended to `uploads/resumable/<id>.part` as they
+arrive and the offset is recorded even when the connection drops mid-PATCH,
+so after a failure the client asks for the offset (HEAD) and continues from
+there instead of from byte zero. A finished upload is passed to
+POST /api/submissions as `photo_upload_id`/`selfie_upload_id` and moved into
+the blob store (utils/storage.py). Uploads without a PATCH for
+RESUMABLE_UPLOAD_EXPIRY_SECONDS are removed with their partial files.
+"""
+
+import os
+import time
+import uuid
+import asyncio
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from fastapi import HTTPException
+from pymongo import ASCENDING, ReturnDocument
+
+from db import get_database
+from utils.storage import store_file, reference_blob
+from config import (
+    RESUMABLE_DIR,
+    MAX_UPLOAD_BYTES,
+    RESUMABLE_UPLOAD_EXPIRY_SECONDS,
+    RESUMABLE_LOCK_SECONDS,
+    RESUMABLE_SWEEP_INTERVAL_SECONDS,
+)
+
+
+def upload_file_path(upload_id: str) -> Path:
+    return RESUMABLE_DIR / f"{upload_id}.part"
+
+
+def _expires_at(now: datetime) -> datetime:
+    return now + timedelta(seconds=RESUMABLE_UPLOAD_EXPIRY_SECONDS)
+
+
+async def setup_resumable_uploads():
+    RESUMABLE_DIR.mkdir(parents=True, exist_ok=True)
+    db = get_database()
+    await db.resumable_uploads.create_index([("expires_at", ASCENDING)])
+
+
+async def create_upload(user_id: str, length: int, ext: str):
+    """Start an upload of `length` bytes; 413 above MAX_UPLOAD_BYTES"""
+    if length <= 0:
+        raise HTTPException(status_code=400, detail="Upload-Length must be positive")
+    if length > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+
+    upload_id = uuid.uuid4().hex
+    await asyncio.to_thread(upload_file_path(upload_id).touch)
+    now = datetime.now(timezone.utc)
+    upload = {
+        "_id": upload_id,
+        "user_id": user_id,
+        "length": length,
+        "offset": 0,
+        "ext": ext,
+        "created_at": now,
+        "expires_at": _expires_at(now),
+        "writer": None,
+        "writer_at": None,
+        "blob_id": None,  # set once finished into the blob store
+    }
+    await get_database().resumable_uploads.insert_one(upload)
+    return upload
+
+
+async def get_upload(upload_id: str, user_id: str):
+    upload = await get_database().resumable_uploads.find_one({"_id": upload_id, "user_id": user_id})
+    if not upload or upload["expires_at"].replace(tzinfo=timezone.utc) < datetime.now(timezone.utc):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+
+def _offset_conflict(offset: int, detail: str):
+    return HTTPException(status_code=409, detail=detail, headers={"Upload-Offset": str(offset)})
+
+
+async def _claim(upload: dict, offset: int):
+    """Hold the upload for one PATCH at `offset`; returns the writer token"""
+    now = datetime.now(timezone.utc)
+    token = uuid.uuid4().hex
+    claimed = await get_database().resumable_uploads.find_one_and_update(
+        {
+            "_id": upload["_id"],
+            "offset": offset,
+            "$or": [
+                {"writer": None},
+                # A PATCH that died with its process
+                {"writer_at": {"$lt": now - timedelta(seconds=RESUMABLE_LOCK_SECONDS)}},
+            ],
+        },
+        {"$set": {"writer": token, "writer_at": now}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if claimed is None:
+        raise _offset_conflict(upload["offset"], "Upload is busy or its offset changed")
+    return token
+
+
+def _open_at(path: Path, offset: int):
+    f = open(path, "r+b")
+    # Bytes past the recorded offset come from a PATCH that never committed them
+    f.seek(offset)
+    f.truncate()
+    return f
+
+
+def _close(f):
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+
+async def append_chunk(upload: dict, offset: int, chunks):
+    """
+    Append the PATCH body (`chunks`, an async iterator of bytes) at `offset`.
+    Whatever arrived is kept and recorded even if the body is cut off, so the
+    client resumes from there. Returns the updated upload.
+    """
+    if upload.get("blob_id"):
+        raise _offset_conflict(upload["offset"], "Upload is already finished")
+    if offset != upload["offset"]:
+        raise _offset_conflict(upload["offset"], "Upload-Offset does not match the upload")
+    token = await _claim(upload, offset)
+
+    db = get_database()
+    remaining = upload["length"] - offset
+    written = 0
+    too_long = False
+    renewed = time.monotonic()
+    updated = f = None
+    try:
+        f = await asyncio.to_thread(_open_at, upload_file_path(upload["_id"]), offset)
+        async for chunk in chunks:
+            if written + len(chunk) > remaining:
+                chunk = chunk[:remaining - written]
+                too_long = True
+            if chunk:
+                await asyncio.to_thread(f.write, chunk)
+                written += len(chunk)
+            if too_long:
+                break
+            # Slow links: keep the claim while data is still arriving
+            if time.monotonic() - renewed > RESUMABLE_LOCK_SECONDS / 2:
+                result = await db.resumable_uploads.update_one(
+                    {"_id": upload["_id"], "writer": token},
+                    {"$set": {"writer_at": datetime.now(timezone.utc)}},
+                )
+                if result.matched_count == 0:
+                    raise _offset_conflict(offset, "Upload was taken over by another request")
+                renewed = time.monotonic()
+    finally:
+        if f is not None:
+            await asyncio.to_thread(_close, f)
+        now = datetime.now(timezone.utc)
+        updated = await db.resumable_uploads.find_one_and_update(
+            {"_id": upload["_id"], "writer": token},
+            {"$set": {
+                "offset": offset + written,
+                "expires_at": _expires_at(now),
+                "writer": None,
+                "writer_at": None,
+            }},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    if too_long:
+        raise HTTPException(status_code=413, detail="Body exceeds Upload-Length")
+    if updated is None:
+        raise _offset_conflict(offset, "Upload was taken over by another request")
+    return updated
+
+
+async def finish_upload(upload_id: str, user_id: str):
+    """
+    Move a complete upload into the blob store and take a reference.
+    Returns (blob_id, size, ext); 409 while bytes are still missing. The upload
+    remembers its blob until it expires, so a retried submission with the same
+    upload id takes another reference instead of failing. If storing fails the
+    upload is removed, and the client uploads the file again.
+    """
+    db = get_database()
+    upload = await get_upload(upload_id, user_id)
+    if upload.get("blob_id"):
+        if not await reference_blob(upload["blob_id"]):
+            raise HTTPException(status_code=404, detail="Upload not found")
+        return upload["blob_id"], upload["length"], upload["ext"]
+    if upload["offset"] != upload["length"]:
+        raise _offset_conflict(upload["offset"], "Upload is incomplete")
+
+    # Hold the upload like a PATCH does, so nothing else touches the file
+    token = await _claim(upload, upload["offset"])
+    try:
+        blob_id, size, ext = await store_file(upload_file_path(upload_id), upload["ext"])
+    except BaseException:
+        # store_file consumes the file even when it fails, so the upload can
+        # never be finished: drop it and let the client start a new one
+        await db.resumable_uploads.delete_one({"_id": upload_id, "writer": token})
+        await asyncio.to_thread(upload_file_path(upload_id).unlink, True)
+        raise
+    await db.resumable_uploads.update_one(
+        {"_id": upload_id, "writer": token},
+        {"$set": {"blob_id": blob_id, "writer": None, "writer_at": None}},
+    )
+    return blob_id, size, ext
+
+
+async def discard_upload(upload_id: str, user_id: str):
+    result = await get_database().resumable_uploads.delete_one({"_id": upload_id, "user_id": user_id})
+    if result.deleted_count:
+        await asyncio.to_thread(upload_file_path(upload_id).unlink, True)
+    return result.deleted_count == 1
+
+
+def _remove_orphan_files(cutoff: float, live_ids: set):
+    removed = 0
+    for path in RESUMABLE_DIR.glob("*.part"):
+        try:
+            if path.stem not in live_ids and path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+async def expire_uploads():
+    """Remove uploads idle past their expiry, and partial files with no upload. Returns the count."""
+    db = get_database()
+    now = datetime.now(timezone.utc)
+    expired = 0
+    async for upload in db.resumable_uploads.find({"expires_at": {"$lt": now}}, {"_id": 1}):
+        result = await db.resumable_uploads.delete_one({
+            "_id": upload["_id"],
+            "expires_at": {"$lt": now},
+            "$or": [
+                {"writer": None},
+                {"writer_at": {"$lt": now - timedelta(seconds=RESUMABLE_LOCK_SECONDS)}},
+            ],
+        })
+        if result.deleted_count:
+            await asyncio.to_thread(upload_file_path(upload["_id"]).unlink, True)
+            expired += 1
+
+    # Files left behind by a crash between deleting a document and its file
+    live_ids = {upload["_id"] async for upload in db.resumable_uploads.find({}, {"_id": 1})}
+    await asyncio.to_thread(_remove_orphan_files, time.time() - RESUMABLE_UPLOAD_EXPIRY_SECONDS, live_ids)
+    return expired
+
+
+_sweep_task = None
+
+
+async def _sweep_loop():
+    while True:
+        await asyncio.sleep(RESUMABLE_SWEEP_INTERVAL_SECONDS)
+        try:
+            expired = await expire_uploads()
+            if expired:
+                print(f"Resumable uploads: expired {expired} upload(s)")
+        except Exception as e:
+            print(f"Resumable upload sweep error: {e}")
+
+
+async def start_upload_sweeper():
+    global _sweep_task
+    await setup_resumable_uploads()
+    _sweep_task = asyncio.create_task(_sweep_loop())
+
+
+async def stop_upload_sweeper():
+    global _sweep_task
+    if _sweep_task:
+        _sweep_task.cancel()
+        _sweep_task = None
@@ -1,34 +1,464 @@
+"""
+Content-addressed upload store.
+
+Every upload is streamed to a temp file while its SHA-256 is computed, then
+handed to the storage backend (utils/storage_backends.py: local disk, S3 or an
+in-process fake) under the key `<aa>/<bb>/<sha256>`. Identical images
+(retries, re-submissions) share one object. The `blobs` collection tracks each blob's size,
+extension and reference count; submissions point at blob ids (the SHA-256) and
+release their reference when they go away. `collect_garbage` deletes blobs
+whose count has been zero for BLOB_GC_GRACE_SECONDS.
+
+With object storage, phones can also upload directly: `presign_upload`
+returns a presigned PUT pinned to the image's SHA-256 (to a staging key of
+the user) and `adopt_uploaded_blob` moves it into the store and takes the
+reference once the object is there.
+
+Images are also normalized at ingest (ml/ingest.py): the working copy and
+thumbnail are blobs of their own, remembered on the original's metadata so a
+duplicate upload reuses them instead of decoding the original again.
+"""
+
 import os
 import uuid
+import asyncio
+import hashlib
+import time
+from datetime import datetime, timezone, timedelta
 from pathlib import Path
-from fastapi import UploadFile
-from config import PHOTOS_DIR, SELFIES_DIR
+from fastapi import UploadFile, HTTPException
+from pymongo import ASCENDING, ReturnDocument
+
+from db import get_database
+from ml.executor import run_ml, MLTaskTimeout
+from ml.ingest import normalize_upload, INGEST_VERSION
+from utils.storage_backends import blob_key, get_storage_backend
+from config import (
+    BLOB_TMP_DIR,
+    UPLOAD_CHUNK_SIZE,
+    MAX_UPLOAD_BYTES,
+    BLOB_GC_GRACE_SECONDS,
+    BLOB_GC_INTERVAL_SECONDS,
+)
+
+
+IMAGE_CONTENT_TYPES = {
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+    "heic": "image/heic",
+}
+
+
+def blob_path(blob_id: str):
+    """Local file of a blob, or None when the backend keeps it elsewhere"""
+    return get_storage_backend().local_path(blob_key(blob_id))
+
+
+def blob_location(blob_id: str) -> str:
+    """What submissions record as `photo_path`/`selfie_path`"""
+    return get_storage_backend().location(blob_key(blob_id))
+
+
+async def read_blob(blob_id: str) -> bytes:
+    return await asyncio.to_thread(get_storage_backend().get_bytes, blob_key(blob_id))
+
+
+def _copy_upload(source, target: Path, max_bytes: int):
+    """
+    Copy a file object to `target` in UPLOAD_CHUNK_SIZE chunks, hashing as it goes.
+    Returns (sha256, size) or None (and no file) if over `max_bytes`.
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with open(target, "wb") as out:
+            while True:
+                chunk = source.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    break
+                hasher.update(chunk)
+                out.write(chunk)
+        if size > max_bytes:
+            os.remove(target)
+            return None
+    except BaseException:
+        if target.exists():
+            os.remove(target)
+        raise
+    return hasher.hexdigest(), size
+
+
+def _place_blob(tmp_path: Path, blob_id: str, ext: str):
+    """Hand a finished temp file to the backend, or drop it if the blob already exists"""
+    backend = get_storage_backend()
+    key = blob_key(blob_id)
+    if backend.exists(key):
+        os.remove(tmp_path)
+        return
+    backend.put_file(key, tmp_path, IMAGE_CONTENT_TYPES.get(ext))
+
+
+async def acquire_blob(blob_id: str, size: int, ext: str):
+    """Add one reference to a blob, creating its metadata on first use"""
+    now = datetime.now(timezone.utc)
+    await get_database().blobs.update_one(
+        {"_id": blob_id},
+        {
+            "$inc": {"refcount": 1},
+            "$set": {"last_referenced_at": now, "released_at": None, "size": size},
+            "$setOnInsert": {"ext": ext, "created_at": now},
+        },
+        upsert=True,
+    )
+
+
+async def reference_blob(blob_id: str) -> bool:
+    """Add one reference to an existing blob; False if it no longer exists"""
+    result = await get_database().blobs.update_one(
+        {"_id": blob_id},
+        {
+            "$inc": {"refcount": 1},
+            "$set": {"last_referenced_at": datetime.now(timezone.utc), "released_at": None},
+        },
+    )
+    return result.matched_count == 1
+
+
+async def release_blob(blob_id: str):
+    """Drop one reference; the file is collected once unreferenced for the grace period"""
+    if not blob_id:
+        return
+    db = get_database()
+    blob = await db.blobs.find_one_and_update(
+        {"_id": blob_id, "refcount": {"$gt": 0}},
+        {"$inc": {"refcount": -1}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if blob and blob["refcount"] == 0:
+        await db.blobs.update_one(
+            {"_id": blob_id, "refcount": 0},
+            {"$set": {"released_at": datetime.now(timezone.utc)}},
+        )
+
+
+# Blob references a submission holds: originals plus their ingest derivatives
+SUBMISSION_BLOB_FIELDS = tuple(
+    f"{kind}_{field}" for kind in ("photo", "selfie") for field in ("blob", "work_blob", "thumb_blob")
+)
+
+
+async def release_submission_blobs(submission: dict):
+    """Drop every blob reference of a deleted submission"""
+    for field in SUBMISSION_BLOB_FIELDS:
+        await release_blob(submission.get(field))
+
+
+async def store_blob(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES):
+    """
+    Store an upload in the blob store and take a reference to it.
+    The copy runs in a worker thread so concurrent uploads do not block the event loop.
+    Returns (blob_id, size, ext); raises 413 when the upload exceeds `max_bytes`.
+    """
+    ext = file.filename.split('.')[-1].lower() if file.filename and '.' in file.filename else 'jpg'
+    tmp_path = BLOB_TMP_DIR / f"{uuid.uuid4()}.part"
+
+    await file.seek(0)
+    stored = await asyncio.to_thread(_copy_upload, file.file, tmp_path, max_bytes)
+    if stored is None:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Upload exceeds {max_bytes // (1024 * 1024)} MB",
+        )
+    blob_id, size = stored
+
+    # Reference first, then place the file: a concurrent collect_garbage either
+    # sees the reference and keeps the blob, or has already removed the file
+    try:
+        await acquire_blob(blob_id, size, ext)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    await asyncio.to_thread(_place_blob, tmp_path, blob_id, ext)
+    return blob_id, size, ext
+
+
+def _write_bytes(data: bytes):
+    tmp_path = BLOB_TMP_DIR / f"{uuid.uuid4()}.part"
+    tmp_path.write_bytes(data)
+    return tmp_path, hashlib.sha256(data).hexdigest()
+
+
+async def store_bytes(data: bytes, ext: str):
+    """Store generated content (e.g. a derivative) and take a reference; returns its blob id"""
+    tmp_path, blob_id = await asyncio.to_thread(_write_bytes, data)
+    try:
+        await acquire_blob(blob_id, len(data), ext)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    await asyncio.to_thread(_place_blob, tmp_path, blob_id, ext)
+    return blob_id
+
+
+def _hash_file(path: Path):
+    hasher = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+            size += len(chunk)
+    return hasher.hexdigest(), size
+
+
+async def store_file(path: Path, ext: str):
+    """
+    Move a finished local file (e.g. a resumable upload) into the store and take
+    a reference; the file is consumed, also when storing fails (no reference is
+    left behind then). Returns (blob_id, size, ext).
+    """
+    blob_id, size = await asyncio.to_thread(_hash_file, path)
+    try:
+        await acquire_blob(blob_id, size, ext)
+    except BaseException:
+        os.remove(path)
+        raise
+    try:
+        await asyncio.to_thread(_place_blob, path, blob_id, ext)
+    except BaseException:
+        await release_blob(blob_id)
+        raise
+    return blob_id, size, ext
+
+
+def _direct_upload_key(user_id: str, sha256: str) -> str:
+    """Per-user staging key of a direct upload, moved into the store on adoption"""
+    return f"direct/{user_id}/{sha256}"
+
+
+def _require_presigned_backend():
+    backend = get_storage_backend()
+    if not backend.supports_presigned:
+        raise HTTPException(status_code=501, detail="Direct uploads need object storage")
+    return backend
+
+
+async def presign_upload(sha256: str, size: int, ext: str, user_id: str):
+    """
+    Direct upload of an image with the given SHA-256 to object storage.
+    Returns {"blob_id", "upload"}. The PUT goes to a staging key of the user,
+    so only a user who actually holds the bytes can adopt the blob, and the
+    answer is the same whether or not the image is already stored.
+    The `direct_uploads` record lets collect_garbage remove uploads never used.
+    """
+    backend = _require_presigned_backend()
+    if size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+
+    await get_database().direct_uploads.update_one(
+        {"_id": f"{user_id}:{sha256}"},
+        {
+            "$set": {"ext": ext, "created_at": datetime.now(timezone.utc)},
+            "$setOnInsert": {"user_id": user_id, "blob_id": sha256},
+        },
+        upsert=True,
+    )
+    content_type = IMAGE_CONTENT_TYPES.get(ext, "application/octet-stream")
+    upload = await asyncio.to_thread(
+        backend.presign_put, _direct_upload_key(user_id, sha256), sha256, content_type
+    )
+    return {"blob_id": sha256, "upload": upload}
+
+
+def _place_direct_upload(staging: str, blob_id: str):
+    backend = get_storage_backend()
+    key = blob_key(blob_id)
+    if backend.exists(key):
+        backend.delete(staging)
+    elif not backend.move(staging, key):
+        raise HTTPException(status_code=400, detail="Upload not finished")
+
+
+async def adopt_uploaded_blob(blob_id: str, user_id: str, max_bytes: int = MAX_UPLOAD_BYTES):
+    """
+    Take a reference to a blob this user uploaded directly (see presign_upload).
+    Returns (blob_id, size); 400 if it was never uploaded, 413 if too large.
+    """
+    backend = _require_presigned_backend()
+    db = get_database()
+    upload_id = f"{user_id}:{blob_id}"
+    upload = await db.direct_uploads.find_one({"_id": upload_id})
+    if upload is None:
+        raise HTTPException(status_code=400, detail="Unknown upload")
+
+    staging = _direct_upload_key(user_id, blob_id)
+    size = await asyncio.to_thread(backend.size, staging)
+    if size is None:
+        raise HTTPException(status_code=400, detail="Upload not finished")
+    if size > max_bytes:
+        await asyncio.to_thread(backend.delete, staging)
+        await db.direct_uploads.delete_one({"_id": upload_id})
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes // (1024 * 1024)} MB")
+
+    # The presigned PUT pinned the SHA-256, so the object's content matches its id
+    await acquire_blob(blob_id, size, upload["ext"])
+    try:
+        await asyncio.to_thread(_place_direct_upload, staging, blob_id)
+    except BaseException:
+        await release_blob(blob_id)
+        raise
+    await db.direct_uploads.delete_one({"_id": upload_id})
+    return blob_id, size
+
+
+async def ingest_image(blob_id: str):
+    """
+    Working copy and thumbnail of an image blob, each with a reference taken.
+    Returns {"work": blob id, "thumb": blob id}, or {} if the upload is not a readable image.
+    """
+    db = get_database()
+    blob = await db.blobs.find_one({"_id": blob_id}, {"derivatives": 1})
+    derivatives = (blob or {}).get("derivatives") or {}
+    if derivatives.get("version") == INGEST_VERSION:
+        taken = []
+        for kind in ("work", "thumb"):
+            if await reference_blob(derivatives[kind]):
+                taken.append(derivatives[kind])
+        if len(taken) == 2:
+            return {"work": derivatives["work"], "thumb": derivatives["thumb"]}
+        # A derivative was collected in the meantime: build them again
+        for derived_id in taken:
+            await release_blob(derived_id)
+
+    try:
+        # Local blobs are opened by path in the worker; remote ones are shipped as bytes
+        path = blob_path(blob_id)
+        source = str(path) if path is not None else await read_blob(blob_id)
+        encoded = await run_ml(normalize_upload, source)
+    except MLTaskTimeout:
+        encoded = None
+    if encoded is None:
+        # Consumers fall back to the original
+        return {}
+    work_bytes, thumb_bytes = encoded
+    work = await store_bytes(work_bytes, "jpg")
+    try:
+        thumb = await store_bytes(thumb_bytes, "webp")
+    except BaseException:
+        await release_blob(work)
+        raise
+
+    await db.blobs.update_one(
+        {"_id": blob_id},
+        {"$set": {"derivatives": {"version": INGEST_VERSION, "work": work, "thumb": thumb}}},
+    )
+    return {"work": work, "thumb": thumb}
+
+
+async def save_photo(file: UploadFile, user_id: str):
+    """Save photo and return (relative path, blob id, size)"""
+    blob_id, size, _ = await store_blob(file)
+    return blob_location(blob_id), blob_id, size
+
+async def save_selfie(file: UploadFile, user_id: str):
+    """Save selfie and return (relative path, blob id, size)"""
+    blob_id, size, _ = await store_blob(file)
+    return blob_location(blob_id), blob_id, size
+
+
+async def setup_blob_store():
+    BLOB_TMP_DIR.mkdir(parents=True, exist_ok=True)
+    # Fail at startup, not on the first upload, when the backend is misconfigured
+    get_storage_backend()
+    db = get_database()
+    await db.blobs.create_index([("refcount", ASCENDING), ("released_at", ASCENDING)])
+    await db.direct_uploads.create_index([("created_at", ASCENDING)])
+
+
+def _remove_stale_temp_files(cutoff: float):
+    removed = 0
+    for path in BLOB_TMP_DIR.glob("*.part"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def _restore_or_drop(trash: str, key: str):
+    backend = get_storage_backend()
+    if backend.exists(key):
+        backend.delete(trash)
+    else:
+        backend.move(trash, key)
+
+
+async def collect_garbage(grace_seconds: float = BLOB_GC_GRACE_SECONDS):
+    """
+    Delete blobs unreferenced for `grace_seconds` and stale temp files.
+    Each object is moved aside before its metadata is removed, and put back if
+    the blob was referenced again in between. Returns (blobs, bytes) freed.
+    """
+    db = get_database()
+    backend = get_storage_backend()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)
+    freed = freed_bytes = 0
+
+    async for blob in db.blobs.find({"refcount": {"$lte": 0}, "released_at": {"$lt": cutoff}}):
+        key = blob_key(blob["_id"])
+        trash = f"{key}.gc"
+        if not await asyncio.to_thread(backend.move, key, trash):
+            trash = None
+
+        result = await db.blobs.delete_one({"_id": blob["_id"], "refcount": {"$lte": 0}})
+        if result.deleted_count == 0:
+            if trash:
+                await asyncio.to_thread(_restore_or_drop, trash, key)
+            continue
+        if trash:
+            await asyncio.to_thread(backend.delete, trash)
+        freed += 1
+        freed_bytes += blob.get("size", 0)
+
+    # Direct uploads never adopted by a submission
+    async for upload in db.direct_uploads.find({"created_at": {"$lt": cutoff}}):
+        result = await db.direct_uploads.delete_one({"_id": upload["_id"], "created_at": {"$lt": cutoff}})
+        if result.deleted_count:
+            staging = _direct_upload_key(upload["user_id"], upload["blob_id"])
+            await asyncio.to_thread(backend.delete, staging)
+
+    await asyncio.to_thread(_remove_stale_temp_files, time.time() - grace_seconds)
+    return freed, freed_bytes
+
 
-async def save_photo(file: UploadFile, user_id: str) -> str:
-    """Save photo and return relative path"""
-    ext = file.filename.split('.')[-1] if '.' in file.filename else 'jpg'
-    filename = f"{user_id}_{uuid.uuid4()}.{ext}"
-    filepath = PHOTOS_DIR / filename
-    
-    with open(filepath, "wb") as f:
-        content = await file.read()
-        f.write(content)
-    
-    return f"uploads/photos/{filename}"
+_gc_task = None
 
-async def save_selfie(file: UploadFile, user_id: str) -> str:
-    """Save selfie and return relative path"""
-    ext = file.filename.split('.')[-1] if '.' in file.filename else 'jpg'
-    filename = f"{user_id}_{uuid.uuid4()}.{ext}"
-    filepath = SELFIES_DIR / filename
-    
-    with open(filepath, "wb") as f:
-        content = await file.read()
-        f.write(content)
-    
-    return f"uploads/selfies/{filename}"
 
+async def _gc_loop():
+    while True:
+        await asyncio.sleep(BLOB_GC_INTERVAL_SECONDS)
+        try:
+            freed, freed_bytes = await collect_garbage()
+            if freed:
+                print(f"Blob GC: removed {freed} blob(s), {freed_bytes} bytes")
+        except Exception as e:
+            print(f"Blob GC error: {e}")
 
 
+async def start_blob_gc():
+    global _gc_task
+    await setup_blob_store()
+    _gc_task = asyncio.create_task(_gc_loop())
 
 
+async def stop_blob_gc():
+    global _gc_task
+    if _gc_task:
+        _gc_task.cancel()
+        _gc_task = None
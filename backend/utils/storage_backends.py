@@ -0,0 +1,395 @@
+"""
+Where blob bytes live.
+
+utils/storage.py keeps the blob metadata (hash, refcount) in Mongo and moves
+bytes through a StorageBackend chosen by STORAGE_BACKEND:
+
+- "local": files under uploads/blobs on this host (single API node)
+- "s3": any S3-compatible object store (AWS S3, MinIO, R2, ...) so that API
+  nodes hold no state. Large files go up as multipart uploads, the boto3
+  client keeps a connection pool, and phones can upload directly with
+  presigned PUT URLs that pin the SHA-256 of the content.
+- "memory": the S3 backend on top of FakeS3Client, an in-process stand-in
+  with the same request semantics, for tests and local experiments
+
+Backend methods are blocking; callers run them in worker threads.
+"""
+
+import base64
+import hashlib
+import hmac
+import io
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit, parse_qs
+
+from config import (
+    BASE_DIR,
+    BLOBS_DIR,
+    STORAGE_BACKEND,
+    S3_BUCKET,
+    S3_PREFIX,
+    S3_ENDPOINT_URL,
+    S3_REGION,
+    S3_MAX_POOL_CONNECTIONS,
+    S3_MULTIPART_THRESHOLD,
+    S3_MULTIPART_CHUNK_SIZE,
+    PRESIGNED_URL_EXPIRES,
+)
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+    BOTO3_AVAILABLE = True
+except ImportError:
+    BOTO3_AVAILABLE = False
+
+
+def blob_key(blob_id: str) -> str:
+    """Sharded object key of a blob: two levels from the hash prefix"""
+    return f"{blob_id[:2]}/{blob_id[2:4]}/{blob_id}"
+
+
+class StorageBackend:
+    """Interface every blob storage backend implements"""
+
+    name = None
+    supports_presigned = False
+
+    def location(self, key: str) -> str:
+        """Human-readable location stored as `photo_path`/`selfie_path`"""
+        raise NotImplementedError
+
+    def local_path(self, key: str):
+        """Filesystem path of the object when it has one, else None"""
+        return None
+
+    def size(self, key: str):
+        """Size in bytes, or None if the object does not exist"""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        return self.size(key) is not None
+
+    def put_file(self, key: str, path: Path, content_type: str = None):
+        """Store a finished temp file under `key`; the temp file is consumed"""
+        raise NotImplementedError
+
+    def get_bytes(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    def move(self, key: str, new_key: str) -> bool:
+        """Rename an object; False if it does not exist"""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def presign_put(self, key: str, sha256: str, content_type: str, expires: int = PRESIGNED_URL_EXPIRES):
+        """{"url", "method", "headers"} for a direct upload of exactly the content hashing to `sha256`"""
+        raise NotImplementedError
+
+    def presign_get(self, key: str, content_type: str = None, expires: int = PRESIGNED_URL_EXPIRES) -> str:
+        raise NotImplementedError
+
+
+class LocalStorageBackend(StorageBackend):
+    """Files under `root` (uploads/blobs by default)"""
+
+    name = "local"
+
+    def __init__(self, root: Path = BLOBS_DIR):
+        self.root = Path(root)
+
+    def location(self, key):
+        return self.local_path(key).relative_to(BASE_DIR).as_posix()
+
+    def local_path(self, key):
+        return self.root / key
+
+    def size(self, key):
+        try:
+            return self.local_path(key).stat().st_size
+        except FileNotFoundError:
+            return None
+
+    def put_file(self, key, path, content_type=None):
+        target = self.local_path(key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, target)
+
+    def get_bytes(self, key):
+        return self.local_path(key).read_bytes()
+
+    def move(self, key, new_key):
+        try:
+            os.replace(self.local_path(key), self.local_path(new_key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def delete(self, key):
+        self.local_path(key).unlink(missing_ok=True)
+
+
+def _is_not_found(error) -> bool:
+    code = getattr(error, "response", {}).get("Error", {}).get("Code")
+    return code in ("404", "NoSuchKey", "NotFound")
+
+
+class S3StorageBackend(StorageBackend):
+    """S3-compatible object storage through a boto3 (or FakeS3Client) client"""
+
+    name = "s3"
+    supports_presigned = True
+
+    def __init__(self, client=None, bucket=S3_BUCKET, prefix=S3_PREFIX,
+                 multipart_threshold=S3_MULTIPART_THRESHOLD, chunk_size=S3_MULTIPART_CHUNK_SIZE):
+        if client is None:
+            if not BOTO3_AVAILABLE:
+                raise RuntimeError("STORAGE_BACKEND=s3 needs boto3 installed")
+            # One client per process: it is thread-safe and pools its connections
+            client = boto3.client(
+                "s3",
+                endpoint_url=S3_ENDPOINT_URL or None,
+                region_name=S3_REGION or None,
+                config=BotoConfig(
+                    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                    retries={"max_attempts": 5, "mode": "adaptive"},
+                ),
+            )
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.multipart_threshold = multipart_threshold
+        self.chunk_size = chunk_size
+
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def location(self, key):
+        return f"s3://{self.bucket}/{self._key(key)}"
+
+    def size(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))["ContentLength"]
+        except Exception as e:
+            if _is_not_found(e):
+                return None
+            raise
+
+    def put_file(self, key, path, content_type=None):
+        extra = {"ContentType": content_type} if content_type else {}
+        try:
+            if os.path.getsize(path) <= self.multipart_threshold:
+                with open(path, "rb") as f:
+                    self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=f.read(), **extra)
+            else:
+                self._put_multipart(key, path, extra)
+        finally:
+            Path(path).unlink(missing_ok=True)
+
+    def _put_multipart(self, key, path, extra):
+        upload = self.client.create_multipart_upload(Bucket=self.bucket, Key=self._key(key), **extra)
+        upload_id = upload["UploadId"]
+        parts = []
+        try:
+            with open(path, "rb") as f:
+                for number, chunk in enumerate(iter(lambda: f.read(self.chunk_size), b""), start=1):
+                    part = self.client.upload_part(
+                        Bucket=self.bucket, Key=self._key(key), UploadId=upload_id,
+                        PartNumber=number, Body=chunk,
+                    )
+                    parts.append({"PartNumber": number, "ETag": part["ETag"]})
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self._key(key), UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self._key(key), UploadId=upload_id)
+            raise
+
+    def get_bytes(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"].read()
+
+    def move(self, key, new_key):
+        try:
+            self.client.copy_object(
+                Bucket=self.bucket, Key=self._key(new_key),
+                CopySource={"Bucket": self.bucket, "Key": self._key(key)},
+            )
+        except Exception as e:
+            if _is_not_found(e):
+                return False
+            raise
+        self.delete(key)
+        return True
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def presign_put(self, key, sha256, content_type, expires=PRESIGNED_URL_EXPIRES):
+        # The checksum is part of the signature: the store rejects any other content
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode("ascii")
+        url = self.client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": self.bucket, "Key": self._key(key),
+                "ContentType": content_type, "ChecksumSHA256": checksum,
+            },
+            ExpiresIn=expires,
+        )
+        return {
+            "url": url,
+            "method": "PUT",
+            "headers": {"Content-Type": content_type, "x-amz-checksum-sha256": checksum},
+        }
+
+    def presign_get(self, key, content_type=None, expires=PRESIGNED_URL_EXPIRES):
+        params = {"Bucket": self.bucket, "Key": self._key(key)}
+        if content_type:
+            params["ResponseContentType"] = content_type
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires)
+
+
+class FakeClientError(Exception):
+    """Mimics botocore's ClientError shape (`response["Error"]["Code"]`)"""
+
+    def __init__(self, code, message=""):
+        super().__init__(f"{code}: {message}")
+        self.response = {"Error": {"Code": code, "Message": message}}
+
+
+class FakeS3Client:
+    """
+    In-process stand-in for the subset of the S3 API used by S3StorageBackend.
+    Objects live in a dict; multipart uploads enforce the 5 MB minimum part
+    size; presigned URLs are HMAC-signed and can be exercised with
+    `send_presigned_put`, which checks expiry and the pinned SHA-256 like S3 does.
+    """
+
+    MIN_PART_SIZE = 5 * 1024 * 1024
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self._secret = os.urandom(16)
+        self._lock = threading.Lock()
+
+    def _object(self, bucket, key):
+        try:
+            return self.objects[(bucket, key)]
+        except KeyError:
+            raise FakeClientError("NoSuchKey", key)
+
+    def head_object(self, Bucket, Key):
+        obj = self._object(Bucket, Key)
+        return {"ContentLength": len(obj["body"]), "ContentType": obj["content_type"]}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, ChecksumSHA256=None):
+        body = Body if isinstance(Body, bytes) else Body.read()
+        if ChecksumSHA256 and base64.b64encode(hashlib.sha256(body).digest()).decode() != ChecksumSHA256:
+            raise FakeClientError("BadDigest", "checksum mismatch")
+        with self._lock:
+            self.objects[(Bucket, Key)] = {"body": body, "content_type": ContentType}
+        return {"ETag": f'"{hashlib.md5(body).hexdigest()}"'}
+
+    def get_object(self, Bucket, Key):
+        obj = self._object(Bucket, Key)
+        return {"Body": io.BytesIO(obj["body"]), "ContentLength": len(obj["body"])}
+
+    def copy_object(self, Bucket, Key, CopySource):
+        obj = self._object(CopySource["Bucket"], CopySource["Key"])
+        with self._lock:
+            self.objects[(Bucket, Key)] = dict(obj)
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key, ContentType=None):
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self.uploads[upload_id] = {"bucket": Bucket, "key": Key, "content_type": ContentType, "parts": {}}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        upload = self.uploads.get(UploadId)
+        if upload is None:
+            raise FakeClientError("NoSuchUpload", UploadId)
+        body = Body if isinstance(Body, bytes) else Body.read()
+        upload["parts"][PartNumber] = body
+        return {"ETag": f'"{hashlib.md5(body).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        upload = self.uploads.pop(UploadId, None)
+        if upload is None:
+            raise FakeClientError("NoSuchUpload", UploadId)
+        numbers = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+        bodies = [upload["parts"][number] for number in numbers]
+        if any(len(body) < self.MIN_PART_SIZE for body in bodies[:-1]):
+            raise FakeClientError("EntityTooSmall", "parts before the last must be at least 5 MB")
+        with self._lock:
+            self.objects[(Bucket, Key)] = {"body": b"".join(bodies), "content_type": upload["content_type"]}
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+        return {}
+
+    def _signature(self, query: dict) -> str:
+        payload = urlencode(sorted(query.items())).encode()
+        return hmac.new(self._secret, payload, hashlib.sha256).hexdigest()
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        query = {"method": ClientMethod, "expires": str(int(time.time() + ExpiresIn))}
+        if Params.get("ChecksumSHA256"):
+            query["checksum"] = Params["ChecksumSHA256"]
+        query["signature"] = self._signature(query)
+        return f"fake-s3://{Params['Bucket']}/{Params['Key']}?{urlencode(query)}"
+
+    def send_presigned_put(self, url: str, body: bytes, headers: dict = None):
+        """What an S3 endpoint does with a PUT to a presigned URL"""
+        parts = urlsplit(url)
+        query = {name: values[0] for name, values in parse_qs(parts.query).items()}
+        signature = query.pop("signature", "")
+        if not hmac.compare_digest(signature, self._signature(query)) or query["method"] != "put_object":
+            raise FakeClientError("SignatureDoesNotMatch")
+        if int(query["expires"]) < time.time():
+            raise FakeClientError("AccessDenied", "Request has expired")
+        headers = {name.lower(): value for name, value in (headers or {}).items()}
+        if query.get("checksum") and headers.get("x-amz-checksum-sha256") != query["checksum"]:
+            raise FakeClientError("SignatureDoesNotMatch", "checksum header not signed")
+        self.put_object(parts.netloc, parts.path.lstrip("/"), body,
+                        ContentType=headers.get("content-type"), ChecksumSHA256=query.get("checksum"))
+
+
+def _create_backend(name: str) -> StorageBackend:
+    if name == "local":
+        return LocalStorageBackend()
+    if name == "s3":
+        return S3StorageBackend()
+    if name == "memory":
+        return S3StorageBackend(client=FakeS3Client(), bucket=S3_BUCKET or "trek-uploads")
+    raise ValueError(f"Unknown STORAGE_BACKEND {name!r}")
+
+
+STORAGE_BACKENDS = ("local", "s3", "memory")
+_backend = None
+
+
+def get_storage_backend() -> StorageBackend:
+    global _backend
+    if _backend is None:
+        _backend = _create_backend(STORAGE_BACKEND)
+    return _backend
+
+
+def set_storage_backend(backend: StorageBackend):
+    """Swap the process-wide backend (e.g. an S3StorageBackend over FakeS3Client in tests)"""
+    global _backend
+    _backend = backend
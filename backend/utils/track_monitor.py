@@ -0,0 +1,306 @@
+"""
+Streaming checks over live trek tracks.
+
+Every batch of fixes from POST /api/trek-sessions/{id}/track is run through a
+small state machine per session that flags:
+
+- off_route / back_on_route: distance from the challenge route crosses
+  TRACK_OFF_ROUTE_DISTANCE (with hysteresis on the way back)
+- geofence_enter / geofence_exit: a checkpoint's gps_radius is entered or left
+- stalled / moving: no progress beyond TRACK_STALL_RADIUS for TRACK_STALL_SECONDS
+
+Routes are indexed once per challenge (RouteIndex): segments are projected to
+meters and bucketed in a grid, and each fix first scores only a window of
+segments around the one matched last, so the work per fix does not grow with
+the route length. The session's state lives in its `monitor` field and events
+go to the `trek_events` collection polled by the admin dashboard.
+
+Fixes only arrive while the hiker moves (the app's location watch is distance
+based) or while the phone is on, so stalls are also found by a periodic sweep
+over active sessions whose last progress is older than TRACK_STALL_SECONDS.
+"""
+
+import math
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import numpy as np
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+
+from db import get_database
+from utils.gps import to_local_xy, route_arrays, distances_to_points
+from config import (
+    TRACK_OFF_ROUTE_DISTANCE,
+    TRACK_BACK_ON_ROUTE_DISTANCE,
+    TRACK_GEOFENCE_EXIT_MARGIN,
+    TRACK_STALL_SECONDS,
+    TRACK_STALL_RADIUS,
+    TRACK_ROUTE_SEARCH_WINDOW,
+    ROUTE_INDEX_CELL_SIZE,
+    GEO_INDEX_REFRESH_SECONDS,
+)
+
+
+class RouteIndex:
+    """Route segments in local meters, bucketed into a grid of ROUTE_INDEX_CELL_SIZE cells"""
+
+    def __init__(self, route_points, cell_size=ROUTE_INDEX_CELL_SIZE):
+        lats, lons = route_arrays(route_points)
+        self.cell_size = cell_size
+        self.size = max(lats.size - 1, 0)
+        self._cells = {}
+        if self.size == 0:
+            return
+
+        # One projection for the whole route, referenced at its start
+        self.ref_lat, self.ref_lon = float(lats[0]), float(lons[0])
+        x, y = to_local_xy(lats, lons, self.ref_lat, self.ref_lon)
+        self.ax, self.ay = x[:-1], y[:-1]
+        self.dx, self.dy = x[1:] - self.ax, y[1:] - self.ay
+        self.length_sq = self.dx * self.dx + self.dy * self.dy
+
+        cells = defaultdict(list)
+        x0 = np.floor(np.minimum(x[:-1], x[1:]) / cell_size).astype(int)
+        x1 = np.floor(np.maximum(x[:-1], x[1:]) / cell_size).astype(int)
+        y0 = np.floor(np.minimum(y[:-1], y[1:]) / cell_size).astype(int)
+        y1 = np.floor(np.maximum(y[:-1], y[1:]) / cell_size).astype(int)
+        for segment in range(self.size):
+            for cx in range(x0[segment], x1[segment] + 1):
+                for cy in range(y0[segment], y1[segment] + 1):
+                    cells[(cx, cy)].append(segment)
+        self._cells = {cell: np.array(ids) for cell, ids in cells.items()}
+
+    def project(self, lat, lon):
+        x, y = to_local_xy(lat, lon, self.ref_lat, self.ref_lon)
+        return float(x), float(y)
+
+    def _distances(self, segments, px, py):
+        ax, ay = self.ax[segments], self.ay[segments]
+        dx, dy = self.dx[segments], self.dy[segments]
+        length_sq = self.length_sq[segments]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.where(length_sq > 0, ((px - ax) * dx + (py - ay) * dy) / length_sq, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        return np.hypot(ax + t * dx - px, ay + t * dy - py)
+
+    def _best(self, segments, px, py):
+        dist = self._distances(segments, px, py)
+        index = int(dist.argmin())
+        return float(dist[index]), int(segments[index])
+
+    def locate(self, lat, lon, hint=None, within=TRACK_OFF_ROUTE_DISTANCE, exact=True):
+        """
+        (distance_m, segment) of the closest route segment.
+        Tries the segments around `hint` first, then the grid cells around the
+        fix. When nothing lies within `within` meters, a full scan gives the
+        exact distance, or (inf, hint) is returned if `exact` is False.
+        """
+        if self.size == 0:
+            return None, None
+        px, py = self.project(lat, lon)
+
+        if hint is not None and 0 <= hint < self.size:
+            window = np.arange(
+                max(hint - TRACK_ROUTE_SEARCH_WINDOW, 0),
+                min(hint + TRACK_ROUTE_SEARCH_WINDOW + 1, self.size),
+            )
+            distance, segment = self._best(window, px, py)
+            if distance <= within:
+                return distance, segment
+
+        cx, cy = int(math.floor(px / self.cell_size)), int(math.floor(py / self.cell_size))
+        reach = int(math.ceil(within / self.cell_size))
+        nearby = [
+            self._cells[(i, j)]
+            for i in range(cx - reach, cx + reach + 1)
+            for j in range(cy - reach, cy + reach + 1)
+            if (i, j) in self._cells
+        ]
+        if nearby:
+            distance, segment = self._best(np.unique(np.concatenate(nearby)), px, py)
+            if distance <= within:
+                return distance, segment
+
+        if not exact:
+            return math.inf, hint
+        return self._best(np.arange(self.size), px, py)
+
+
+_route_cache = {}
+
+
+async def get_route_context(challenge_id: str):
+    """Route index and checkpoints of a challenge, cached per process"""
+    cached = _route_cache.get(challenge_id)
+    if cached and time.monotonic() - cached[0] < GEO_INDEX_REFRESH_SECONDS:
+        return cached[1]
+
+    db = get_database()
+    challenge = None
+    if ObjectId.is_valid(challenge_id):
+        challenge = await db.challenges.find_one(
+            {"_id": ObjectId(challenge_id)},
+            {"route_points": 1, "checkpoints": 1},
+        )
+    checkpoints = (challenge or {}).get("checkpoints", [])
+    context = {
+        "route": RouteIndex((challenge or {}).get("route_points") or []),
+        "checkpoint_ids": [cp["checkpoint_id"] for cp in checkpoints],
+        "lats": np.array([cp["latitude"] for cp in checkpoints], dtype=np.float64),
+        "lons": np.array([cp["longitude"] for cp in checkpoints], dtype=np.float64),
+        "radii": np.array([cp.get("gps_radius", 50.0) for cp in checkpoints], dtype=np.float64),
+    }
+    _route_cache[challenge_id] = (time.monotonic(), context)
+    return context
+
+
+def new_monitor_state():
+    return {
+        "segment": None,
+        "off_route": False,
+        "inside": [],
+        "anchor": None,  # [t, lat, lon] where the hiker last made progress
+        "stalled": False,
+    }
+
+
+def evaluate_fixes(state, data, context):
+    """
+    Advance the monitor state over sorted fixes ([t, lat, lon, ...] rows).
+    Returns (new state, events) without touching the database.
+    """
+    state = {**new_monitor_state(), **(state or {})}
+    inside = set(state["inside"])
+    route = context["route"]
+    events = []
+
+    def emit(kind, t, lat, lon, **extra):
+        events.append({
+            "type": kind,
+            "at": datetime.fromtimestamp(t, timezone.utc),
+            "latitude": lat,
+            "longitude": lon,
+            **extra,
+        })
+
+    for t, lat, lon in data[:, :3].tolist():
+        # Off-route, starting from the segment matched last
+        if route.size:
+            # While off route, only "back within range" matters: skip the full scan
+            if state["off_route"]:
+                distance, segment = route.locate(
+                    lat, lon, hint=state["segment"], within=TRACK_BACK_ON_ROUTE_DISTANCE, exact=False
+                )
+            else:
+                distance, segment = route.locate(lat, lon, hint=state["segment"])
+            state["segment"] = segment
+            if not state["off_route"] and distance > TRACK_OFF_ROUTE_DISTANCE:
+                state["off_route"] = True
+                emit("off_route", t, lat, lon, distance_m=distance)
+            elif state["off_route"] and distance <= TRACK_BACK_ON_ROUTE_DISTANCE:
+                state["off_route"] = False
+                emit("back_on_route", t, lat, lon, distance_m=distance)
+
+        # Checkpoint geofences
+        if context["checkpoint_ids"]:
+            distances = distances_to_points(lat, lon, context["lats"], context["lons"])
+            for i, checkpoint_id in enumerate(context["checkpoint_ids"]):
+                if checkpoint_id not in inside and distances[i] <= context["radii"][i]:
+                    inside.add(checkpoint_id)
+                    emit("geofence_enter", t, lat, lon, checkpoint_id=checkpoint_id,
+                         distance_m=float(distances[i]))
+                elif checkpoint_id in inside and \
+                        distances[i] > context["radii"][i] + TRACK_GEOFENCE_EXIT_MARGIN:
+                    inside.discard(checkpoint_id)
+                    emit("geofence_exit", t, lat, lon, checkpoint_id=checkpoint_id,
+                         distance_m=float(distances[i]))
+
+        # Stall: no movement beyond TRACK_STALL_RADIUS from the anchor
+        anchor = state["anchor"]
+        if anchor is None or float(distances_to_points(lat, lon, [anchor[1]], [anchor[2]])[0]) > TRACK_STALL_RADIUS:
+            if state["stalled"]:
+                state["stalled"] = False
+                emit("moving", t, lat, lon)
+            state["anchor"] = [t, lat, lon]
+        elif not state["stalled"] and t - anchor[0] >= TRACK_STALL_SECONDS:
+            state["stalled"] = True
+            emit("stalled", t, lat, lon, stalled_seconds=t - anchor[0])
+
+    state["inside"] = sorted(inside)
+    return state, events
+
+
+async def setup_track_events():
+    db = get_database()
+    await db.trek_events.create_index([("created_at", DESCENDING)])
+    await db.trek_events.create_index([("session_id", ASCENDING), ("created_at", DESCENDING)])
+    # sweep_stalled_sessions
+    await db.trek_sessions.create_index([("status", ASCENDING), ("monitor.stalled", ASCENDING)])
+
+
+async def store_events(session: dict, events, batch_id: str = None):
+    """
+    Write monitor events. With `batch_id` their ids are derived from the batch,
+    so storing the same batch again (see utils/tracks.py) adds nothing.
+    """
+    if not events:
+        return
+    now = datetime.now(timezone.utc)
+    docs = [
+        {
+            "session_id": str(session["_id"]),
+            "user_id": session["user_id"],
+            "challenge_id": session["challenge_id"],
+            "created_at": now,
+            **event,
+        }
+        for event in events
+    ]
+    if batch_id:
+        for index, doc in enumerate(docs):
+            doc["_id"] = f"{batch_id}:{index}"
+    try:
+        await get_database().trek_events.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        if not batch_id or any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+
+
+async def sweep_stalled_sessions():
+    """
+    Flag active sessions without progress for TRACK_STALL_SECONDS even though no
+    fixes came in. The write is conditional on `track_version`, like batches in
+    utils/tracks.py, so it never overwrites state from a concurrent batch.
+    Returns the number of sessions flagged.
+    """
+    db = get_database()
+    now = time.time()
+    cutoff = now - TRACK_STALL_SECONDS
+    flagged = 0
+    async for session in db.trek_sessions.find(
+        {"status": "active", "monitor.stalled": {"$ne": True}, "monitor.anchor.0": {"$lt": cutoff}},
+        {"user_id": 1, "challenge_id": 1, "monitor": 1, "track_version": 1, "last_fix_at": 1},
+    ):
+        result = await db.trek_sessions.update_one(
+            {"_id": session["_id"], "status": "active", "track_version": session.get("track_version")},
+            {"$set": {"monitor.stalled": True}, "$inc": {"track_version": 1}},
+        )
+        if result.modified_count == 0:
+            continue  # a batch arrived meanwhile; it re-evaluates the stall itself
+
+        anchor_t, lat, lon = session["monitor"]["anchor"]
+        await store_events(session, [{
+            "type": "stalled",
+            "at": datetime.fromtimestamp(now, timezone.utc),
+            "latitude": lat,
+            "longitude": lon,
+            "stalled_seconds": now - anchor_t,
+            "last_fix_at": session.get("last_fix_at"),
+            "source": "sweep",
+        }])
+        flagged += 1
+    return flagged
+
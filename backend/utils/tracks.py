@@ -0,0 +1,336 @@
+"""
+GPS track storage for trek sessions.
+
+Fixes arrive in batches as compact arrays `[t, lat, lon, accuracy?, altitude?]`
+(t in epoch seconds) and are bulk-inserted into the `trek_tracks` time-series
+collection. Session totals (distance, pace, last position) and the
+off-route/geofence monitor state (utils/track_monitor.py) are maintained with
+one pipeline update per batch: the distance inside the batch is computed here,
+and the gap between the previously stored last position and the first new fix
+is computed by Mongo itself.
+
+The monitor state is evaluated from the session as read, so the update only
+applies if `track_version` is still the version that was read; otherwise the
+batch is evaluated again against the new state. Fixes at or before the stored
+`last_fix_at` are skipped, which makes a retried batch (e.g. after a client
+timeout) a no-op instead of counting its distance and points twice.
+
+The same update parks the batch's fixes and events in `track_pending` until
+they are stored. If that insert fails, the next batch for the session (the
+client's retry included) stores whatever is missing before it goes on, so a
+counted batch is never lost.
+"""
+
+import math
+import time
+import uuid
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import numpy as np
+from pymongo import ReturnDocument
+from pymongo.errors import CollectionInvalid
+
+from db import get_database
+from utils.gps import segment_lengths, EARTH_RADIUS
+from utils.track_monitor import get_route_context, evaluate_fixes, store_events, sweep_stalled_sessions
+from config import (
+    TRACK_MAX_ACCURACY,
+    TRACK_CLOCK_SKEW_SECONDS,
+    TRACK_UPDATE_ATTEMPTS,
+    TRACK_PENDING_CLAIM_SECONDS,
+    TRACK_STALL_SWEEP_INTERVAL_SECONDS,
+)
+
+
+class TrackUpdateConflict(Exception):
+    """The session kept changing under a batch; the client should retry"""
+
+
+async def setup_track_store():
+    """Create the time-series collection on first start"""
+    db = get_database()
+    try:
+        await db.create_collection(
+            "trek_tracks",
+            timeseries={"timeField": "t", "metaField": "meta", "granularity": "seconds"},
+        )
+    except CollectionInvalid:
+        pass  # already exists
+
+
+def parse_fixes(fixes, min_t: float = None, max_t: float = None):
+    """
+    Valid fixes sorted by time, as an (N, 5) float array [t, lat, lon, acc, alt]
+    (NaN where accuracy/altitude were not sent), plus the count of dropped fixes.
+    `t` must be finite and within [min_t, max_t] (epoch seconds); it is
+    truncated to milliseconds, the precision Mongo stores, and only the first
+    fix of each timestamp is kept.
+    """
+    rows = []
+    for fix in fixes:
+        if len(fix) < 3 or None in fix[:3]:
+            continue
+        t, lat, lon = fix[0], fix[1], fix[2]
+        if not all(math.isfinite(value) for value in (t, lat, lon)):
+            continue
+        # Catches milliseconds sent as seconds and clocks far off
+        if (min_t is not None and t < min_t) or (max_t is not None and t > max_t):
+            continue
+        t = math.floor(t * 1000) / 1000
+        accuracy = fix[3] if len(fix) > 3 and fix[3] is not None else math.nan
+        altitude = fix[4] if len(fix) > 4 and fix[4] is not None else math.nan
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180) or t <= 0:
+            continue
+        if accuracy > TRACK_MAX_ACCURACY:
+            continue
+        rows.append((t, lat, lon, accuracy, altitude))
+
+    if not rows:
+        return np.empty((0, 5)), len(fixes)
+    data = np.array(rows, dtype=np.float64)
+    data = data[np.argsort(data[:, 0], kind="stable")]
+    data = data[np.r_[True, np.diff(data[:, 0]) > 0]]
+    return data, len(fixes) - len(data)
+
+
+def _timestamp(seconds):
+    return datetime.fromtimestamp(float(seconds), timezone.utc)
+
+
+def track_documents(data, session_id: str, user_id: str):
+    meta = {"session_id": session_id, "user_id": user_id}
+    docs = []
+    for t, lat, lon, accuracy, altitude in data.tolist():
+        doc = {"t": _timestamp(t), "meta": meta, "lat": lat, "lon": lon}
+        if not math.isnan(accuracy):
+            doc["acc"] = accuracy
+        if not math.isnan(altitude):
+            doc["alt"] = altitude
+        docs.append(doc)
+    return docs
+
+
+def _haversine_expr(lat, lon):
+    """Aggregation expression: meters from the stored last_position to (lat, lon)"""
+    return {
+        "$let": {
+            "vars": {
+                "phi1": {"$degreesToRadians": "$last_position.latitude"},
+                "phi2": math.radians(lat),
+                "dlambda": {"$degreesToRadians": {"$subtract": [lon, "$last_position.longitude"]}},
+            },
+            "in": {
+                "$multiply": [2 * EARTH_RADIUS, {"$asin": {"$sqrt": {"$min": [1, {"$add": [
+                    {"$pow": [{"$sin": {"$divide": [{"$subtract": ["$$phi2", "$$phi1"]}, 2]}}, 2]},
+                    {"$multiply": [
+                        {"$cos": "$$phi1"},
+                        {"$cos": "$$phi2"},
+                        {"$pow": [{"$sin": {"$divide": ["$$dlambda", 2]}}, 2]},
+                    ]},
+                ]}]}}}]
+            },
+        }
+    }
+
+
+def session_track_update(data, monitor, pending):
+    """
+    Pipeline update folding one sorted batch (and monitor state) into the session.
+    Every fix is newer than the stored last_fix_at (see record_track).
+    """
+    first_lat, first_lon = data[0, 1:3]
+    last_t, last_lat, last_lon = data[-1, :3]
+    batch_distance = float(segment_lengths(data[:, 1], data[:, 2]).sum())
+
+    # Bridge from the stored last fix to the first new one
+    continues = {"$ne": [{"$ifNull": ["$last_position", None]}, None]}
+    return [
+        {"$set": {
+            "track_distance_m": {"$add": [
+                {"$ifNull": ["$track_distance_m", 0]},
+                batch_distance,
+                {"$cond": [continues, _haversine_expr(first_lat, first_lon), 0]},
+            ]},
+            "track_points": {"$add": [{"$ifNull": ["$track_points", 0]}, len(data)]},
+            "last_position": {"$literal": {"latitude": last_lat, "longitude": last_lon}},
+            "last_fix_at": _timestamp(last_t),
+            "monitor": {"$literal": monitor},
+            "track_pending": {"$literal": pending},
+            "track_version": {"$add": [{"$ifNull": ["$track_version", 0]}, 1]},
+        }},
+        {"$set": {
+            # Seconds per kilometer since the trek started
+            "pace_s_per_km": {"$cond": [
+                {"$gt": ["$track_distance_m", 0]},
+                {"$divide": [
+                    {"$divide": [{"$subtract": ["$last_fix_at", "$started_at"]}, 1000]},
+                    {"$divide": ["$track_distance_m", 1000]},
+                ]},
+                None,
+            ]},
+        }},
+    ]
+
+
+def _epoch(value):
+    """Epoch seconds of a stored (naive UTC) datetime"""
+    return value.replace(tzinfo=timezone.utc).timestamp() if value else None
+
+
+TRACK_STATE_FIELDS = {
+    "user_id": 1, "challenge_id": 1, "status": 1, "monitor": 1,
+    "started_at": 1, "last_fix_at": 1, "track_version": 1, "track_pending": 1,
+}
+
+
+async def _store_batch(session: dict, pending: dict, check_stored=False):
+    """
+    Insert the points and events of a committed batch, then clear `track_pending`.
+    `check_stored` skips points an earlier, interrupted attempt already wrote;
+    no other batch writes inside this batch's time range.
+    """
+    db = get_database()
+    session_id = str(session["_id"])
+    data = np.array(pending["fixes"], dtype=np.float64).reshape(-1, 5)
+    if check_stored:
+        stored = set()
+        async for doc in db.trek_tracks.find(
+            {
+                "meta.session_id": session_id,
+                "t": {"$gte": _timestamp(data[0, 0]), "$lte": _timestamp(data[-1, 0])},
+            },
+            {"t": 1},
+        ):
+            stored.add(round(_epoch(doc["t"]) * 1000))
+        data = data[np.array([round(t * 1000) not in stored for t in data[:, 0].tolist()], dtype=bool)]
+    if len(data):
+        await db.trek_tracks.insert_many(track_documents(data, session_id, session["user_id"]), ordered=False)
+    await store_events(session, pending["events"], batch_id=pending["id"])
+    await db.trek_sessions.update_one(
+        {"_id": session["_id"], "track_pending.id": pending["id"]},
+        {"$set": {"track_pending": None}},
+    )
+
+
+async def _complete_pending(session: dict):
+    """
+    Store a batch whose session update committed but whose points were not
+    (crash, lost connection). Returns False while its own request may still be
+    writing them.
+    """
+    pending = session.get("track_pending")
+    if not pending:
+        return True
+    now = datetime.now(timezone.utc)
+    claimed = await get_database().trek_sessions.update_one(
+        {
+            "_id": session["_id"],
+            "track_pending.id": pending["id"],
+            "track_pending.claimed_at": {"$lt": now - timedelta(seconds=TRACK_PENDING_CLAIM_SECONDS)},
+        },
+        {"$set": {"track_pending.claimed_at": now}},
+    )
+    if claimed.matched_count == 0:
+        return False
+    await _store_batch(session, pending, check_stored=True)
+    return True
+
+
+async def record_track(session: dict, fixes):
+    """
+    Store a batch of fixes for an active session and update its totals.
+    `session` needs TRACK_STATE_FIELDS. Returns (updated session or None if no
+    longer active, accepted, rejected, duplicates, events).
+    """
+    db = get_database()
+    started = _epoch(session.get("started_at"))
+    data, rejected = parse_fixes(
+        fixes,
+        min_t=started - TRACK_CLOCK_SKEW_SECONDS if started else None,
+        max_t=time.time() + TRACK_CLOCK_SKEW_SECONDS,
+    )
+    context = await get_route_context(session["challenge_id"]) if len(data) else None
+
+    for _ in range(TRACK_UPDATE_ATTEMPTS):
+        if not await _complete_pending(session):
+            raise TrackUpdateConflict("The previous batch is still being stored")
+
+        # Already stored (a replayed batch) or older than what is stored
+        last_fix = _epoch(session.get("last_fix_at"))
+        fresh = data[data[:, 0] > last_fix] if last_fix is not None else data
+        duplicates = len(data) - len(fresh)
+        if len(fresh) == 0:
+            return await db.trek_sessions.find_one({"_id": session["_id"]}), 0, rejected, duplicates, []
+
+        # Off-route, geofence and stall checks continue from the monitor state as read
+        monitor, events = evaluate_fixes(session.get("monitor"), fresh, context)
+        pending = {
+            "id": uuid.uuid4().hex,
+            "fixes": fresh.tolist(),
+            "events": events,
+            "claimed_at": datetime.now(timezone.utc),
+        }
+        updated = await db.trek_sessions.find_one_and_update(
+            {
+                "_id": session["_id"],
+                "status": "active",
+                "track_version": session.get("track_version"),
+                "track_pending": None,
+            },
+            session_track_update(fresh, monitor, pending),
+            return_document=ReturnDocument.AFTER,
+        )
+        if updated is not None:
+            # Points are written once their batch is committed, so a retry cannot duplicate them
+            await _store_batch(session, pending)
+            updated["track_pending"] = None
+            return updated, len(fresh), rejected, duplicates, events
+
+        # Another batch (or the stall sweep) got in first: evaluate against its state
+        session = await db.trek_sessions.find_one({"_id": session["_id"]}, TRACK_STATE_FIELDS)
+        if session is None or session["status"] != "active":
+            return None, 0, rejected, 0, []
+
+    raise TrackUpdateConflict("Too many concurrent track updates")
+
+
+async def complete_pending_batches():
+    """Store batches left pending by sessions that sent nothing since (e.g. ended). Returns the count."""
+    db = get_database()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=TRACK_PENDING_CLAIM_SECONDS)
+    completed = 0
+    async for session in db.trek_sessions.find(
+        {"track_pending.claimed_at": {"$lt": cutoff}},
+        {"user_id": 1, "challenge_id": 1, "track_pending": 1},
+    ):
+        if await _complete_pending(session):
+            completed += 1
+    return completed
+
+
+_sweep_task = None
+
+
+async def _sweep_loop():
+    while True:
+        await asyncio.sleep(TRACK_STALL_SWEEP_INTERVAL_SECONDS)
+        try:
+            await sweep_stalled_sessions()
+            completed = await complete_pending_batches()
+            if completed:
+                print(f"Track sweep: stored {completed} pending batch(es)")
+        except Exception as e:
+            print(f"Track sweep error: {e}")
+
+
+async def start_track_sweeper():
+    global _sweep_task
+    _sweep_task = asyncio.create_task(_sweep_loop())
+
+
+async def stop_track_sweeper():
+    global _sweep_task
+    if _sweep_task:
+        _sweep_task.cancel()
+        _sweep_task = None
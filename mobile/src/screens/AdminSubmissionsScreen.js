@@ -9,6 +9,7 @@ import {
   Alert,
   RefreshControl,
   ScrollView,
+  Image,
 } from "react-native";
 import { LinearGradient } from "expo-linear-gradient";
 import { useNavigation, useRoute } from "@react-navigation/native";
@@ -17,6 +18,8 @@ import {
   getAllSubmissions,
   approveSubmission,
   rejectSubmission,
+  getMediaUri,
+  getMediaHeaders,
 } from "../services/admin";
 import { colors } from "../theme/colors";
 
@@ -28,11 +31,22 @@ const AdminSubmissionsScreen = () => {
   const [isLoading, setIsLoading] = useState(true);
   const [refreshing, setRefreshing] = useState(false);
   const [filter, setFilter] = useState(status || "all");
+  const [mediaHeaders, setMediaHeaders] = useState(null);
 
   useEffect(() => {
     loadSubmissions();
   }, [filter]);
 
+  useEffect(() => {
+    // Thumbnails are served by the authenticated media endpoint
+    getMediaHeaders().then(setMediaHeaders);
+  }, []);
+
+  const thumbSource = (path) => ({
+    uri: getMediaUri(path),
+    headers: mediaHeaders,
+  });
+
   const loadSubmissions = async () => {
     try {
       const data = await getAllSubmissions(
@@ -146,6 +160,17 @@ const AdminSubmissionsScreen = () => {
         </View>
       </View>
 
+      {mediaHeaders && (item.photo_thumb_url || item.selfie_thumb_url) && (
+        <View style={styles.thumbRow}>
+          {item.photo_thumb_url && (
+            <Image source={thumbSource(item.photo_thumb_url)} style={styles.thumb} />
+          )}
+          {item.selfie_thumb_url && (
+            <Image source={thumbSource(item.selfie_thumb_url)} style={styles.thumb} />
+          )}
+        </View>
+      )}
+
       {item.ocr && (
         <View style={styles.detailRow}>
           <Text style={styles.detailLabel}>
@@ -422,6 +447,17 @@ const styles = StyleSheet.create({
     fontWeight: "700",
     letterSpacing: 0.5,
   },
+  thumbRow: {
+    flexDirection: "row",
+    marginBottom: 12,
+  },
+  thumb: {
+    width: 96,
+    height: 96,
+    borderRadius: 8,
+    marginRight: 8,
+    backgroundColor: colors.background,
+  },
   detailRow: {
     flexDirection: "row",
     justifyContent: "space-between",
@@ -15,13 +15,20 @@ import Ionicons from "@expo/vector-icons/Ionicons";
 import * as Location from "expo-location";
 import NetInfo from "@react-native-community/netinfo";
 import AsyncStorage from "@react-native-async-storage/async-storage";
-import { cancelTrek } from "../services/trekSessions";
+import { cancelTrek, sendTrackFixes } from "../services/trekSessions";
 import { cacheTilesForRoute } from "../utils/offlineMapCache";
 import CancelTrekModal from "../components/CancelTrekModal";
 import { colors } from "../theme/colors";
 
 const { width, height } = Dimensions.get("window");
 
+// GPS fixes are buffered and uploaded in batches
+const TRACK_FLUSH_SIZE = 50;
+const TRACK_FLUSH_INTERVAL_MS = 60000;
+// Fixes per request (the server accepts up to 2000) and fixes kept while offline
+const TRACK_MAX_BATCH = 1000;
+const TRACK_MAX_BUFFERED = 20000;
+
 const TrekMapScreen = () => {
     const navigation = useNavigation();
     const route = useRoute();
@@ -35,6 +42,8 @@ const TrekMapScreen = () => {
     const [isOffline, setIsOffline] = useState(false);
     const [cachingProgress, setCachingProgress] = useState(null);
     const [locationSubscription, setLocationSubscription] = useState(null);
+    const trackBuffer = useRef([]);
+    const isFlushing = useRef(false);
 
     const checkpoints = challenge?.checkpoints || [];
     const routePoints = challenge?.route_points || [];
@@ -58,6 +67,38 @@ const TrekMapScreen = () => {
                     longitude: cp.longitude,
                 }));
 
+    const flushTrack = async () => {
+        if (!trekSession?.id || isFlushing.current || trackBuffer.current.length === 0) return;
+        isFlushing.current = true;
+        try {
+            // Oldest first, in slices the server accepts; new fixes keep being appended meanwhile
+            while (trackBuffer.current.length > 0) {
+                const batch = trackBuffer.current.slice(0, TRACK_MAX_BATCH);
+                try {
+                    await sendTrackFixes(trekSession.id, batch);
+                } catch (error) {
+                    const status = error?.response?.status;
+                    if (!status || status >= 500 || status === 409 || status === 429) {
+                        // Offline or temporary: keep the fixes for the next attempt
+                        break;
+                    }
+                    // Rejected for good (e.g. session ended): drop the slice, retrying cannot help
+                }
+                trackBuffer.current = trackBuffer.current.slice(batch.length);
+            }
+        } finally {
+            isFlushing.current = false;
+        }
+    };
+
+    useEffect(() => {
+        const interval = setInterval(flushTrack, TRACK_FLUSH_INTERVAL_MS);
+        return () => {
+            clearInterval(interval);
+            flushTrack();
+        };
+    }, []);
+
     useEffect(() => {
         initializeMap();
         const unsubscribe = NetInfo.addEventListener((state) => {
@@ -100,6 +141,20 @@ const TrekMapScreen = () => {
                         latitude: loc.coords.latitude,
                         longitude: loc.coords.longitude,
                     });
+                    trackBuffer.current.push([
+                        loc.timestamp / 1000,
+                        loc.coords.latitude,
+                        loc.coords.longitude,
+                        loc.coords.accuracy ?? null,
+                        loc.coords.altitude ?? null,
+                    ]);
+                    if (!isFlushing.current && trackBuffer.current.length > TRACK_MAX_BUFFERED) {
+                        // Long offline stretch: drop the oldest fixes (not while a flush owns the front)
+                        trackBuffer.current = trackBuffer.current.slice(-TRACK_MAX_BUFFERED);
+                    }
+                    if (trackBuffer.current.length >= TRACK_FLUSH_SIZE) {
+                        flushTrack();
+                    }
                 }
             );
             setLocationSubscription(sub);
@@ -1,3 +1,4 @@
+import AsyncStorage from "@react-native-async-storage/async-storage";
 import api from "./api";
 
 export const getAdminStats = async () => {
@@ -53,3 +54,11 @@ export const deleteChallenge = async (challengeId) => {
   return response.data;
 };
 
+/** Absolute URL for a media path returned by the API (e.g. photo_thumb_url) */
+export const getMediaUri = (path) => `${api.defaults.baseURL}${path}`;
+
+/** Auth headers for loading media URLs in <Image> sources */
+export const getMediaHeaders = async () => {
+  const token = await AsyncStorage.getItem("access_token");
+  return token ? { Authorization: `Bearer ${token}` } : {};
+};
@@ -1,6 +1,30 @@
 import api from "./api";
+import { uploadResumable, clearUploads } from "./uploads";
+
+export const precheckLocation = async (submissionData) => {
+  const response = await api.post("/api/submissions/precheck", {
+    challenge_id: submissionData.challengeId,
+    checkpoint_id: submissionData.checkpointId,
+    gps_latitude: submissionData.gpsLatitude,
+    gps_longitude: submissionData.gpsLongitude,
+  });
+  return response.data;
+};
 
 export const submitCheckpoint = async (submissionData) => {
+  // Out of range: the submission is recorded as rejected without uploading the images
+  const precheck = await precheckLocation(submissionData);
+
+  // Images go up first in resumable chunks; the submission only references them
+  const photoUploadId =
+    precheck.is_valid && submissionData.photo
+      ? await uploadResumable(submissionData.photo.uri)
+      : null;
+  const selfieUploadId =
+    precheck.is_valid && submissionData.selfie
+      ? await uploadResumable(submissionData.selfie.uri)
+      : null;
+
   const formData = new FormData();
 
   formData.append("challenge_id", submissionData.challengeId);
@@ -8,20 +32,12 @@ export const submitCheckpoint = async (submissionData) => {
   formData.append("gps_latitude", submissionData.gpsLatitude.toString());
   formData.append("gps_longitude", submissionData.gpsLongitude.toString());
 
-  if (submissionData.photo) {
-    formData.append("photo", {
-      uri: submissionData.photo.uri,
-      type: "image/jpeg",
-      name: "photo.jpg",
-    });
+  if (photoUploadId) {
+    formData.append("photo_upload_id", photoUploadId);
   }
 
-  if (submissionData.selfie) {
-    formData.append("selfie", {
-      uri: submissionData.selfie.uri,
-      type: "image/jpeg",
-      name: "selfie.jpg",
-    });
+  if (selfieUploadId) {
+    formData.append("selfie_upload_id", selfieUploadId);
   }
 
   const response = await api.post("/api/submissions", formData, {
@@ -29,15 +45,31 @@ export const submitCheckpoint = async (submissionData) => {
       "Content-Type": "multipart/form-data",
     },
   });
+  clearUploads(submissionData.photo?.uri, submissionData.selfie?.uri);
 
-  return response.data;
+  // Verification runs in the background; wait briefly for the result
+  return waitForSubmissionResult(response.data);
 };
 
-export const getSubmission = async (submissionId) => {
-  const response = await api.get(`/api/submissions/${submissionId}`);
+export const getSubmission = async (submissionId, wait = 0) => {
+  const params = wait ? `?wait=${wait}` : "";
+  const response = await api.get(`/api/submissions/${submissionId}${params}`);
   return response.data;
 };
 
+export const waitForSubmissionResult = async (submission, attempts = 2) => {
+  let current = submission;
+  for (let i = 0; i < attempts && current.status === "pending"; i++) {
+    try {
+      current = await getSubmission(current.id, 20);
+    } catch (error) {
+      // Keep the pending submission; the result shows up in history later
+      break;
+    }
+  }
+  return current;
+};
+
 export const getSubmissions = async (challengeId = null) => {
   const params = challengeId ? `?challenge_id=${challengeId}` : "";
   const response = await api.get(`/api/submissions${params}`);
@@ -24,3 +24,11 @@ export const getTrekHistory = async () => {
     const response = await api.get("/api/trek-sessions/history");
     return response.data;
 };
+
+/** Upload buffered GPS fixes: [[t (epoch s), latitude, longitude, accuracy, altitude], ...] */
+export const sendTrackFixes = async (sessionId, fixes) => {
+    const response = await api.post(`/api/trek-sessions/${sessionId}/track`, {
+        fixes,
+    });
+    return response.data;
+};
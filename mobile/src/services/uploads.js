@@ -0,0 +1,105 @@
+import * as FileSystem from "expo-file-system";
+import api from "./api";
+
+// Resumable (tus-style) uploads: the photo is sent in chunks and, after a
+// dropped connection, resumed from the offset the server already has.
+const TUS_VERSION = "1.0.0";
+const CHUNK_SIZE = 256 * 1024;
+const MAX_RETRIES = 8;
+const RETRYABLE_STATUSES = [409, 500, 502, 503, 504];
+
+// Unfinished uploads by file URI, so a retried submission continues where it stopped
+const pendingUploads = new Map();
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+const base64ToBytes = (base64) => {
+  const binary = atob(base64);
+  const bytes = new Uint8Array(binary.length);
+  for (let i = 0; i < binary.length; i++) {
+    bytes[i] = binary.charCodeAt(i);
+  }
+  return bytes;
+};
+
+const readOffset = (response) => parseInt(response.headers["upload-offset"], 10);
+
+const getUploadOffset = async (uploadId) => {
+  const response = await api.head(`/api/uploads/${uploadId}`, {
+    headers: { "Tus-Resumable": TUS_VERSION },
+  });
+  return readOffset(response);
+};
+
+const createUpload = async (length, ext) => {
+  const response = await api.post(`/api/uploads?ext=${ext}`, null, {
+    headers: { "Tus-Resumable": TUS_VERSION, "Upload-Length": String(length) },
+  });
+  return response.data.upload_id;
+};
+
+/** Upload a local file resumably and return its upload id for POST /api/submissions */
+export const uploadResumable = async (uri, { ext = "jpg", onProgress } = {}) => {
+  const info = await FileSystem.getInfoAsync(uri);
+  const length = info.size;
+
+  let uploadId = pendingUploads.get(uri);
+  let offset = 0;
+  if (uploadId) {
+    try {
+      offset = await getUploadOffset(uploadId);
+    } catch (error) {
+      // Expired or unknown on the server: start over
+      uploadId = null;
+    }
+  }
+  if (!uploadId) {
+    uploadId = await createUpload(length, ext);
+    pendingUploads.set(uri, uploadId);
+  }
+
+  let failures = 0;
+  while (offset < length) {
+    try {
+      const chunk = await FileSystem.readAsStringAsync(uri, {
+        encoding: FileSystem.EncodingType.Base64,
+        position: offset,
+        length: Math.min(CHUNK_SIZE, length - offset),
+      });
+      const response = await api.patch(`/api/uploads/${uploadId}`, base64ToBytes(chunk), {
+        headers: {
+          "Tus-Resumable": TUS_VERSION,
+          "Upload-Offset": String(offset),
+          "Content-Type": "application/offset+octet-stream",
+        },
+        transformRequest: [(data) => data],
+        timeout: 60000,
+      });
+      offset = readOffset(response);
+      failures = 0;
+      onProgress?.(offset / length);
+    } catch (error) {
+      const status = error?.response?.status;
+      if (status && !RETRYABLE_STATUSES.includes(status)) {
+        throw error;
+      }
+      failures += 1;
+      if (failures > MAX_RETRIES) {
+        throw error;
+      }
+      await sleep(Math.min(1000 * 2 ** failures, 30000));
+      // Continue from whatever the server received before the failure
+      try {
+        offset = await getUploadOffset(uploadId);
+      } catch (headError) {
+        // Still offline; the next PATCH tells us
+      }
+    }
+  }
+  return uploadId;
+};
+
+/** Forget uploads once a submission has used them */
+export const clearUploads = (...uris) => {
+  uris.forEach((uri) => pendingUploads.delete(uri));
+};